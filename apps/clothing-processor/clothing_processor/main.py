@@ -1,16 +1,43 @@
-from fastapi import FastAPI, UploadFile, Depends
-from fastapi.responses import JSONResponse
-from clothing_processor.utils.image import to_image_array, remove_background, preprocess_image, get_colour
-from clothing_processor.utils.files import get_image
-from clothing_processor.utils.predictions import load_model, predict_class
-from shared_utils.auth import auth0_auth_middleware
-from clothing_processor.utils.s3 import s3_upload
+from typing import Any, List
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, Depends, File, Query
+from fastapi.responses import JSONResponse, Response
+from clothing_processor.utils.files import UploadTooLargeError
+from shared_utils.auth import auth0_auth_middleware, close_http_client, get_token_cache_stats
+from clothing_processor.utils.pipeline import process_upload, process_batch, MAX_BATCH_SIZE, MAX_PALETTE_SIZE
+from clothing_processor.utils.result_cache import get_result_cache
+from clothing_processor.utils.executor import get_executor, shutdown_executor
+from clothing_processor.utils.models import get_model_loader, BACKGROUND_MODEL_LOADING
+from clothing_processor.utils.s3 import encode_stats
+from clothing_processor.utils.upload_queue import get_upload_queue
+from clothing_processor.utils.batcher import batcher_stats
+from clothing_processor.utils.timing import Trace, new_trace, record, METRICS_REGISTRY
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from fastapi.middleware.cors import CORSMiddleware
 
 # from mangum import Mangum
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  """
+  Load the clothing classifier and the background removal model, before the
+  server starts accepting requests or, with `BACKGROUND_MODEL_LOADING`, while
+  it already does. Start the upload queue, which picks up uploads left over
+  from the last run. When the server stops, finish queued uploads, then
+  release worker pools and pooled connections.
+  """
+  models = get_model_loader()
+  models.start()
+  if not BACKGROUND_MODEL_LOADING:
+    await models.wait()
+  get_upload_queue().start()
+  yield
+  await get_upload_queue().drain()
+  shutdown_executor()
+  await close_http_client()
+
 # Initialise FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS to allow requests from frontent
 app.add_middleware(
@@ -24,54 +51,163 @@ app.add_middleware(
   allow_headers=["*"],
 )
 
-# Load tensorflow model
-model = load_model()
+async def loaded_classifier():
+  """
+  Wait for the models the pipeline needs and return the clothing classifier.
+
+  Requests arriving while the models load share the one run loading them.
+  """
+  models = get_model_loader()
+  await models.get("rembg")
+  return await models.get("classifier")
+
+def timed_response(content: Any, trace: Trace | None) -> JSONResponse:
+  """
+  Build a JSON response and, when timing is on, record the request's stage timings
+  and report them in a Server-Timing header.
+
+  :param content: The response body.
+  :type content: Any
+  :param trace: The request's trace, or None when timing is off.
+  :type trace: Trace | None
+  :return: The JSON response.
+  :rtype: JSONResponse
+  """
+  response = JSONResponse(content=content)
+  if trace is not None:
+    trace.finish()
+    record(trace)
+    response.headers["Server-Timing"] = trace.server_timing()
+  return response
 
 @app.post("/", dependencies=[Depends(auth0_auth_middleware)])
-async def upload_image(upload_file: UploadFile | None = None):
+async def upload_image(upload_file: UploadFile | None = None, palette: int = Query(default=0, ge=0, le=MAX_PALETTE_SIZE)):
   """
   Upload an image, process it, and return the predicted class, dominant color, and image URL.
 
   :param upload_file: The image file to be uploaded.
   :type upload_file: UploadFile | None
+  :param palette: If positive, also return the image's main colours, up to this many, with their coverage.
+  :type palette: int
   :raise ValueError: If the file type is invalid or there is an error processing the image.
   :return: A JSON response containing the predicted class, dominant color, and image URL.
   :rtype: JSONResponse
   """
   if not upload_file:
     return JSONResponse(content={"error": "File not provided"}, status_code=422)
-  
-  try:
-    # Get file content as image
-    # (also checks if `upload_file` is an image)
-    content_image = await get_image(upload_file)
 
-    # Convert image to bytes array
-    image_array = to_image_array(content_image)
+  try:
+    trace = new_trace()
+    # Get the predicted class, dominant colour and stored image URL
+    # (from the cache if the same image was uploaded before)
+    response_content = await process_upload(await loaded_classifier(), upload_file, palette, trace)
 
-    # Remove image background
-    array_bg_removed, image_bg_removed = remove_background(image_array)
+    return timed_response(response_content, trace)
 
-    # Preprocess image for model (convert 28x28, greyscale, etc.)
-    preprocessed_image = preprocess_image(image_bg_removed)
+  except UploadTooLargeError as e:
+    return JSONResponse(content={"error": str(e)}, status_code=413)
 
-    # Make predictions
-    predicted_class = predict_class(model, preprocessed_image)
+  except Exception as e:
+    return JSONResponse(content={"error": f"Couldn't process image: {str(e)}"}, status_code=500)
 
-    # Get dominant colour 
-    colour = get_colour(array_bg_removed)
 
-    s3_url = s3_upload(image_bg_removed)
+@app.post("/batch", dependencies=[Depends(auth0_auth_middleware)])
+async def upload_images(
+  upload_files: List[UploadFile] = File(default=[]),
+  palette: int = Query(default=0, ge=0, le=MAX_PALETTE_SIZE),
+):
+  """
+  Upload several images, process them together, and return a result for each one.
+
+  :param upload_files: The image files to be uploaded.
+  :type upload_files: List[UploadFile]
+  :param palette: If positive, also return each image's main colours, up to this many, with their coverage.
+  :type palette: int
+  :return: A JSON response with one result per file, holding either the predicted class,
+    dominant color and image URL or an error message.
+  :rtype: JSONResponse
+  """
+  if not upload_files:
+    return JSONResponse(content={"error": "Files not provided"}, status_code=422)
 
-    response_content = {
-      "class": predicted_class,
-      "colour": colour, 
-      "image_url": s3_url
-    }
+  if len(upload_files) > MAX_BATCH_SIZE:
+    return JSONResponse(
+      content={"error": f"Too many files: at most {MAX_BATCH_SIZE} images can be uploaded at once"},
+      status_code=413,
+    )
 
-    return JSONResponse(content=response_content)
+  try:
+    trace = new_trace()
+    model = await loaded_classifier()
+    results = await process_batch(model, upload_files, palette, trace)
+    return timed_response({"results": results}, trace)
 
   except Exception as e:
-    return JSONResponse(content={"error": f"Couldn't process image: {str(e)}"}, status_code=500)
+    return JSONResponse(content={"error": f"Couldn't process images: {str(e)}"}, status_code=500)
+
+
+@app.get("/stats")
+async def pipeline_stats():
+  """
+  Report queue depth, worker usage, result cache hit rate, inference batching, image encoding cost and the upload queue of the processing pipeline, and the hit rate of the verified-token cache.
+
+  Left without authentication on purpose, like `/metrics`: it only reports aggregate counters.
+
+  :return: A JSON response with request admission, per-pool, result cache, inference batch, encoding, upload queue and token cache counters.
+  :rtype: JSONResponse
+  """
+  return JSONResponse(content={
+    **get_executor().stats(),
+    "result_cache": get_result_cache().stats(),
+    "inference": batcher_stats(),
+    "encoding": encode_stats(),
+    "upload_queue": get_upload_queue().stats(),
+    "token_cache": get_token_cache_stats(),
+  })
+
+
+@app.get("/metrics")
+async def metrics():
+  """
+  Report how long each pipeline stage takes and how many bytes it handles, for Prometheus to scrape.
+
+  Stages are only timed with `PIPELINE_TIMING` on; otherwise the histograms stay empty.
+  Like `/stats`, this is deliberately left without authentication so scrapers don't need
+  an Auth0 token: it only reports aggregate counters, no user data or image keys. Keep it
+  off the public ingress and let only the monitoring network reach it.
+
+  :return: The per-stage duration and size histograms in the Prometheus text format.
+  :rtype: Response
+  """
+  return Response(generate_latest(METRICS_REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/ready")
+async def readiness():
+  """
+  Report whether the models are loaded and the server is ready for uploads.
+
+  :return: A JSON response with overall readiness and the loading state of each model,
+    with status 503 until every model is ready.
+  :rtype: JSONResponse
+  """
+  status = get_model_loader().status()
+  return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/uploads/{key}", dependencies=[Depends(auth0_auth_middleware)])
+async def upload_status(key: str):
+  """
+  Report whether a processed image has been stored yet.
+
+  :param key: The content hash the image is named after, the image URL's file name without extension.
+  :type key: str
+  :return: A JSON response with the upload state, or a 404 if the image is not queued and wasn't stored or given up on recently.
+  :rtype: JSONResponse
+  """
+  status = get_upload_queue().status(key)
+  if status is None:
+    return JSONResponse(content={"error": "Upload not found"}, status_code=404)
+  return JSONResponse(content=status)
 
 # handler = Mangum(app=app)
\ No newline at end of file
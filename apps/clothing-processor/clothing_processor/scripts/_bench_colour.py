@@ -0,0 +1,69 @@
+import time
+import argparse
+import numpy as np
+from collections import Counter
+from clothing_processor.utils.image import get_rgb_colour
+
+def counter_rgb_colour(image_array):
+  """Previous `get_rgb_colour` implementation, kept as the benchmark baseline."""
+  pixels = image_array.reshape(-1, 4)
+  non_transparent_pixels = pixels[pixels[:, 3] > 10, :3]
+  r, g, b = Counter(map(tuple, non_transparent_pixels)).most_common(1)[0][0]
+  return (int(r), int(g), int(b))
+
+def make_garment(width: int, height: int, seed: int = 0):
+  """Generate a background-removed, textured garment photo as an RGBA array."""
+  rng = np.random.default_rng(seed)
+  image = np.zeros((height, width, 4), dtype=np.uint8)
+  # Fabric: a base colour with sensor noise and a weave pattern
+  base = np.array([30, 60, 140], dtype=np.int16)
+  noise = rng.normal(0, 6, size=(height, width, 3)).astype(np.int16)
+  weave = ((np.indices((height, width)).sum(axis=0) % 4) * 3)[..., None].astype(np.int16)
+  image[..., :3] = np.clip(base + noise + weave, 0, 255)
+  # Transparent background around an elliptical garment mask
+  yy, xx = np.ogrid[:height, :width]
+  mask = ((yy - height / 2) / (height * 0.45)) ** 2 + ((xx - width / 2) / (width * 0.4)) ** 2 <= 1
+  image[..., 3] = np.where(mask, 255, 0)
+  return image
+
+def time_call(fn, repeat: int):
+  """Return the best wall time of `repeat` runs and the last result."""
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark dominant-colour extraction.")
+  parser.add_argument("--width", type=int, default=4000)
+  parser.add_argument("--height", type=int, default=3000)
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--skip-baseline", action="store_true", help="Skip the slow Counter baseline.")
+  args = parser.parse_args()
+
+  image = make_garment(args.width, args.height)
+  print(f"Image: {args.width}x{args.height} ({args.width * args.height / 1e6:.1f} MP)\n")
+
+  cases = [
+    ("numpy exact", lambda: get_rgb_colour(image)),
+    ("numpy 1M sample", lambda: get_rgb_colour(image, max_pixels=1_000_000)),
+    ("numpy 5-bit bins", lambda: get_rgb_colour(image, quantise_bits=5)),
+    ("numpy 1M sample + 5-bit bins", lambda: get_rgb_colour(image, max_pixels=1_000_000, quantise_bits=5)),
+  ]
+  if not args.skip_baseline:
+    cases.insert(0, ("Counter (baseline)", lambda: counter_rgb_colour(image)))
+
+  results = {}
+  for name, fn in cases:
+    seconds, rgb = time_call(fn, args.repeat)
+    results[name] = rgb
+    print(f"{name:<30} {seconds * 1000:>9.1f} ms   {rgb}")
+
+  if not args.skip_baseline:
+    assert results["numpy exact"] == results["Counter (baseline)"], "Exact mode must match the baseline."
+    print("\nExact mode matches the Counter baseline.")
+
+if __name__ == "__main__":
+  main()
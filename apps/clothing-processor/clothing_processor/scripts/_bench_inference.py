@@ -0,0 +1,43 @@
+import time
+import argparse
+import numpy as np
+from clothing_processor.utils.predictions import load_model, compile_model, load_classifier, predict_classes
+
+def latencies(fn, images, runs: int, warm_up: int = 10):
+  """Return the wall time of each of `runs` calls, after `warm_up` untimed ones."""
+  for _ in range(warm_up):
+    fn(images)
+  times = np.empty(runs)
+  for i in range(runs):
+    start = time.perf_counter()
+    fn(images)
+    times[i] = time.perf_counter() - start
+  return times
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare inference latency of model.predict, the compiled graph function and ONNX Runtime.")
+  parser.add_argument("--runs", type=int, default=500)
+  parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+  args = parser.parse_args()
+
+  model = load_model()
+  backends = {
+    "keras (baseline)": compile_model(model, "keras"),
+    "function": compile_model(model, "function"),
+    "onnx": load_classifier("onnx"),
+    "onnx-int8": load_classifier("onnx-int8"),
+  }
+
+  rng = np.random.default_rng(0)
+  for batch_size in args.batch_sizes:
+    images = rng.random((batch_size, 28, 28, 1))
+    baseline = predict_classes(backends["keras (baseline)"], images)
+
+    print(f"Batch of {batch_size}:")
+    for name, backend in backends.items():
+      times = latencies(lambda batch: predict_classes(backend, batch), images, args.runs) * 1000
+      agreement = np.mean([a == b for a, b in zip(predict_classes(backend, images), baseline)])
+      print(f"  {name:<18} p50 {np.percentile(times, 50):>7.2f} ms   p99 {np.percentile(times, 99):>7.2f} ms   {agreement:>4.0%} same class")
+
+if __name__ == "__main__":
+  main()
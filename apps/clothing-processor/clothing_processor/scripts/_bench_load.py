@@ -0,0 +1,256 @@
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import socket
+import asyncio
+import argparse
+import resource
+import subprocess
+import numpy as np
+from contextlib import asynccontextmanager, ExitStack
+from typing import Any, Dict, List, Optional
+from unittest.mock import patch
+
+TEST_IMAGES = os.path.join(os.path.dirname(__file__), "..", "data", "test-images", "*.jpeg")
+
+# Settings that change how fast the pipeline runs, recorded with each report
+ENV_KEYS = {
+  "BACKGROUND_UPLOADS", "UPLOAD_QUEUE_WORKERS",
+  "PIPELINE_CPU_EXECUTOR", "PIPELINE_CPU_WORKERS", "PIPELINE_IO_WORKERS", "PIPELINE_MAX_CONCURRENCY",
+  "INFERENCE_BACKEND", "INFERENCE_MAX_BATCH", "INFERENCE_BATCH_WAIT_MS",
+  "REMBG_MODEL", "REMBG_MASK_SIZE", "IMAGE_MAX_SIZE", "IMAGE_FORMAT", "IMAGE_THUMBNAIL_SIZES",
+  "RESULT_CACHE_SIZE", "COLOUR_MAX_PIXELS", "COLOUR_METRIC",
+}
+
+class LocalS3:
+  """Stands in for the S3 client: keeps uploaded objects in memory, without the network."""
+
+  def __init__(self):
+    self.objects: Dict[str, bytes] = {}
+
+  def upload_fileobj(self, Fileobj, Bucket: str, Key: str, ExtraArgs=None, Config=None):
+    self.objects[Key] = Fileobj.read()
+
+def peak_rss_mb() -> float:
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def git_commit() -> Optional[str]:
+  """Return the checked-out commit, marked "-dirty" if there are uncommitted changes."""
+  try:
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip()
+    return f"{commit}-dirty" if dirty else commit
+  except Exception:
+    return None
+
+def load_images() -> List[bytes]:
+  images = []
+  for path in sorted(glob.glob(TEST_IMAGES)):
+    with open(path, "rb") as f:
+      images.append(f.read())
+  return images
+
+def unique(content: bytes) -> bytes:
+  """Make an upload distinct without changing the picture: decoders ignore bytes after the JPEG end marker."""
+  return content + uuid.uuid4().bytes
+
+def summarise(values: List[float]) -> Dict[str, float]:
+  if not values:
+    return {}
+  array = np.array(values)
+  return {
+    "mean": round(float(array.mean()), 2),
+    "p50": round(float(np.percentile(array, 50)), 2),
+    "p95": round(float(np.percentile(array, 95)), 2),
+    "p99": round(float(np.percentile(array, 99)), 2),
+    "max": round(float(array.max()), 2),
+  }
+
+@asynccontextmanager
+async def in_process_client(app):
+  """Call the app directly, running its startup and shutdown around the run."""
+  import httpx
+
+  async with app.router.lifespan_context(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+      yield client
+
+@asynccontextmanager
+async def uvicorn_client(app):
+  """Serve the app with uvicorn on a free local port, in this process, and call it over HTTP."""
+  import httpx
+  import uvicorn
+
+  with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+
+  server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+  serving = asyncio.ensure_future(server.serve())
+  while not server.started:
+    if serving.done():
+      serving.result()
+    await asyncio.sleep(0.05)
+
+  try:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None, limits=limits) as client:
+      yield client
+  finally:
+    server.should_exit = True
+    await serving
+
+async def run_level(client, images: List[bytes], concurrency: int, requests: int, batch_size: int, repeat: bool) -> Dict[str, Any]:
+  """Send `requests` uploads from `concurrency` clients, each sending its next upload once the last one is answered."""
+  from clothing_processor.utils.timing import parse_server_timing
+
+  latencies: List[float] = []
+  stages: Dict[str, List[float]] = {}
+  errors: Dict[str, int] = {}
+  sent = 0
+
+  def next_content() -> bytes:
+    content = images[sent % len(images)]
+    return content if repeat else unique(content)
+
+  async def worker():
+    nonlocal sent
+    while sent < requests:
+      if batch_size:
+        files = []
+        for _ in range(batch_size):
+          files.append(("upload_files", (f"{sent}.jpeg", next_content(), "image/jpeg")))
+        path = "/batch"
+      else:
+        files = {"upload_file": (f"{sent}.jpeg", next_content(), "image/jpeg")}
+        path = "/"
+      sent += 1
+
+      start = time.perf_counter()
+      response = await client.post(path, files=files)
+      latency = (time.perf_counter() - start) * 1000
+
+      if response.status_code != 200:
+        errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+        continue
+      latencies.append(latency)
+      for stage, ms in parse_server_timing(response.headers.get("server-timing", "")).items():
+        stages.setdefault(stage, []).append(ms)
+
+  start = time.perf_counter()
+  await asyncio.gather(*(worker() for _ in range(concurrency)))
+  seconds = time.perf_counter() - start
+
+  return {
+    "concurrency": concurrency,
+    "requests": requests,
+    "images_per_request": batch_size or 1,
+    "errors": errors,
+    "seconds": round(seconds, 3),
+    "throughput_rps": round(len(latencies) / seconds, 2),
+    "throughput_images_per_s": round(len(latencies) * (batch_size or 1) / seconds, 2),
+    "latency_ms": summarise(latencies),
+    "stages_ms": {stage: summarise(values) for stage, values in sorted(stages.items())},
+    "peak_rss_mb": round(peak_rss_mb(), 1),
+  }
+
+async def run(args) -> Dict[str, Any]:
+  from shared_utils.auth import auth0_auth_middleware
+  from clothing_processor.utils import s3
+  from clothing_processor.main import app
+
+  # No Auth0 token needed
+  app.dependency_overrides[auth0_auth_middleware] = lambda: {"sub": "bench"}
+  s3._s3 = LocalS3()
+
+  images = load_images()
+  connect = uvicorn_client if args.uvicorn else in_process_client
+  runs = []
+  async with connect(app) as client:
+    started = time.perf_counter()
+    await run_level(client, images, 1, args.warm_up, args.batch_size, args.repeat)
+    warm_up_seconds = time.perf_counter() - started
+
+    for concurrency in args.concurrency:
+      result = await run_level(client, images, concurrency, args.requests, args.batch_size, args.repeat)
+      runs.append(result)
+      latency = result["latency_ms"]
+      print(
+        f"concurrency {concurrency:>3}: {result['throughput_rps']:>7.2f} req/s   "
+        f"p50 {latency.get('p50', 0):>8.1f} ms   p95 {latency.get('p95', 0):>8.1f} ms   p99 {latency.get('p99', 0):>8.1f} ms   "
+        f"errors {sum(result['errors'].values())}   peak RSS {result['peak_rss_mb']:.0f} MB",
+        file=sys.stderr,
+      )
+
+  return {
+    "commit": git_commit(),
+    "label": args.label,
+    "settings": {
+      "server": "uvicorn" if args.uvicorn else "in-process",
+      "rembg": "model" if args.model else "stand-in",
+      "requests": args.requests,
+      "warm_up": args.warm_up,
+      "batch_size": args.batch_size,
+      "repeat": args.repeat,
+      "env": {key: value for key, value in sorted(os.environ.items()) if key in ENV_KEYS},
+    },
+    "warm_up_seconds": round(warm_up_seconds, 3),
+    "runs": runs,
+  }
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]):
+  """Print the change in throughput and latency at each concurrency level both runs measured."""
+  before = {run["concurrency"]: run for run in baseline["runs"]}
+  print(f"\nAgainst {baseline.get('label') or baseline.get('commit')}:", file=sys.stderr)
+  if baseline["settings"] != result["settings"]:
+    print("(the runs used different settings)", file=sys.stderr)
+  for run in result["runs"]:
+    old = before.get(run["concurrency"])
+    if old is None or not old["latency_ms"] or not run["latency_ms"]:
+      continue
+    changes = [f"throughput {(run['throughput_images_per_s'] / old['throughput_images_per_s'] - 1) * 100:>+6.1f}%"]
+    for percentile in ("p50", "p95", "p99"):
+      changes.append(f"{percentile} {(run['latency_ms'][percentile] / old['latency_ms'][percentile] - 1) * 100:>+6.1f}%")
+    print(f"concurrency {run['concurrency']:>3}: " + "   ".join(changes), file=sys.stderr)
+
+def main():
+  parser = argparse.ArgumentParser(description="Load-test the upload endpoint with the bundled test images and report throughput, latency percentiles, peak RSS and per-stage timings as JSON.")
+  parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients; one run per value.")
+  parser.add_argument("--requests", type=int, default=100, help="Requests per run.")
+  parser.add_argument("--warm-up", type=int, default=8, help="Untimed requests sent first, to load models and fill pools.")
+  parser.add_argument("--batch-size", type=int, default=0, help="Send this many images per request to /batch instead of one to /.")
+  parser.add_argument("--repeat", action="store_true", help="Send the test images unchanged, so repeats are served from the result cache.")
+  parser.add_argument("--uvicorn", action="store_true", help="Serve the app with uvicorn on a local port instead of calling it in-process.")
+  parser.add_argument("--model", action="store_true", help="Use the real rembg model instead of a stand-in session.")
+  parser.add_argument("--label", help="Name for this run in the report, e.g. the change being measured.")
+  parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+  parser.add_argument("--baseline", help="A previous JSON report to compare this run with.")
+  args = parser.parse_args()
+
+  # Every request reports its stage timings in a Server-Timing header; for /batch each stage
+  # is the longest any of its images spent in it, so the stage figures stay within the latency
+  os.environ["PIPELINE_TIMING"] = "1"
+
+  with ExitStack() as stack:
+    if not args.model:
+      from clothing_processor.scripts._bench_memory import FakeSession
+      stack.enter_context(patch("clothing_processor.utils.image.rembg.new_session", return_value=FakeSession()))
+    result = asyncio.run(run(args))
+
+  report = json.dumps(result, indent=2)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(report + "\n")
+  else:
+    print(report)
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      compare(result, json.load(f))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,109 @@
+import io
+import time
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+from PIL import Image
+from unittest.mock import patch
+import rembg
+
+class FakeSession:
+  """Stands in for a rembg model: same resizing and mask handling, without the network."""
+
+  def predict(self, img, *args, **kwargs):
+    small = np.asarray(img.convert("RGB").resize((320, 320), Image.Resampling.LANCZOS))
+    yy, xx = np.ogrid[:320, :320]
+    mask = (((yy - 160) / 150) ** 2 + ((xx - 160) / 120) ** 2 <= 1) & (small[..., 0] >= 0)
+    return [Image.fromarray((mask * 255).astype(np.uint8)).resize(img.size, Image.Resampling.LANCZOS)]
+
+def make_photo(width: int, height: int) -> bytes:
+  """Encode a synthetic phone photo as a JPEG upload."""
+  rng = np.random.default_rng(0)
+  image = np.empty((height, width, 3), dtype=np.uint8)
+  image[...] = [30, 60, 140]
+  image += rng.integers(0, 12, size=(height, width, 1), dtype=np.uint8)
+  buf = io.BytesIO()
+  Image.fromarray(image).save(buf, format="JPEG", quality=90)
+  return buf.getvalue()
+
+def baseline_prepare_image(content):
+  """Previous pipeline stages, kept as the benchmark baseline."""
+  from clothing_processor.utils.files import open_image
+  from clothing_processor.utils.image import get_rembg_session, visible_pixels, pack_rgb, match_colour
+  content_image = open_image(content)
+
+  # PIL -> NumPy -> PIL, then rembg converts to PIL and back to NumPy again
+  image_array = np.array(content_image)
+  image = Image.fromarray(image_array)
+  output_array = rembg.remove(image_array, session=get_rembg_session())
+  del image
+  output_image = Image.fromarray(output_array)
+
+  grey = np.array(output_image.convert("L").resize((28, 28))) / 255.0
+  model_input = np.expand_dims(grey, axis=(0, -1))
+
+  packed = pack_rgb(visible_pixels(output_array))
+  colours, counts = np.unique(packed, return_counts=True)
+  tied = colours[counts == counts.max()]
+  rgb = int(tied[0] if len(tied) == 1 else packed[np.flatnonzero(np.isin(packed, tied))[0]])
+  colour = match_colour((rgb >> 16, (rgb >> 8) & 0xFF, rgb & 0xFF))
+  return {"image": output_image, "model_input": model_input, "colour": colour}
+
+def current_prepare_image(content):
+  from clothing_processor.utils.pipeline import prepare_image
+  return prepare_image(content)
+
+VARIANTS = {
+  "baseline": baseline_prepare_image,
+  "current": current_prepare_image,
+}
+
+def peak_rss_mb() -> float:
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_variant(name: str, content: bytes, use_model: bool, queue):
+  def run():
+    start = time.perf_counter()
+    prepared = VARIANTS[name](content)
+    seconds = time.perf_counter() - start
+    return prepared, seconds
+
+  if use_model:
+    context = patch("clothing_processor.utils.image.rembg.new_session", side_effect=lambda *a, **k: rembg.new_session(*a, **k))
+  else:
+    context = patch("clothing_processor.utils.image.rembg.new_session", return_value=FakeSession())
+
+  with context:
+    # Warm up on a small image so imports, sessions and pools are not counted
+    small = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(small, format="JPEG")
+    VARIANTS[name](small.getvalue())
+
+    before = peak_rss_mb()
+    prepared, seconds = run()
+    queue.put((name, peak_rss_mb() - before, seconds, prepared["colour"]["name"]))
+
+def main():
+  parser = argparse.ArgumentParser(description="Measure the peak RSS one upload adds to a worker, per pipeline variant.")
+  parser.add_argument("--width", type=int, default=4000)
+  parser.add_argument("--height", type=int, default=3000)
+  parser.add_argument("--model", action="store_true", help="Use the real rembg model instead of a stand-in session.")
+  args = parser.parse_args()
+
+  content = make_photo(args.width, args.height)
+  print(f"Upload: {args.width}x{args.height} JPEG, {len(content) / 1e6:.1f} MB\n")
+
+  # Each variant runs in a fresh process, since peak RSS never goes down
+  context = multiprocessing.get_context("spawn")
+  queue = context.Queue()
+  for name in VARIANTS:
+    process = context.Process(target=run_variant, args=(name, content, args.model, queue))
+    process.start()
+    process.join()
+    name, peak, seconds, colour = queue.get()
+    print(f"{name:<10} peak RSS +{peak:>7.1f} MB   {seconds * 1000:>7.0f} ms   colour {colour}")
+
+if __name__ == "__main__":
+  main()
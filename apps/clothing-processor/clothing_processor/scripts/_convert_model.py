@@ -0,0 +1,77 @@
+import os
+import glob
+import argparse
+import numpy as np
+import tensorflow as tf
+from clothing_processor.utils.files import open_image
+from clothing_processor.utils.image import preprocess_image
+from clothing_processor.utils.predictions import load_model, KERAS_MODEL_PATH, ONNX_MODEL_PATH, ONNX_INT8_MODEL_PATH
+
+TEST_IMAGES = "clothing_processor/data/test-images/*.jpeg"
+
+def calibration_paths() -> list:
+  """Every other bundled test image; the rest are held out to check the int8 model against."""
+  return sorted(glob.glob(TEST_IMAGES))[::2]
+
+def holdout_paths() -> list:
+  """The bundled test images the int8 model is not calibrated on."""
+  return sorted(glob.glob(TEST_IMAGES))[1::2]
+
+def load_images(paths: list) -> np.ndarray:
+  """Preprocess images into one float32 batch."""
+  images = []
+  for path in paths:
+    with open(path, "rb") as f:
+      images.append(preprocess_image(open_image(f.read())))
+  return np.concatenate(images).astype(np.float32)
+
+def calibration_images() -> np.ndarray:
+  """The calibration images and their mirror images, which widen the activation ranges seen."""
+  images = load_images(calibration_paths())
+  return np.concatenate([images, images[:, :, ::-1]])
+
+def convert(model: tf.keras.Model, output_path: str, opset: int):
+  """Export the model as ONNX, with the batch size left open."""
+  import tf2onnx
+
+  signature = (tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="images"),)
+  function = tf.function(lambda images: model(images, training=False))
+  tf2onnx.convert.from_function(function, input_signature=signature, opset=opset, output_path=output_path)
+
+def quantise(input_path: str, output_path: str, calibration: np.ndarray):
+  """Quantise weights and activations to int8, calibrated on the given images."""
+  from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+  class Reader(CalibrationDataReader):
+    def __init__(self):
+      self.batches = iter([{"images": image[None]} for image in calibration])
+
+    def get_next(self):
+      return next(self.batches, None)
+
+  quantize_static(
+    input_path,
+    output_path,
+    Reader(),
+    quant_format=QuantFormat.QDQ,
+    activation_type=QuantType.QUInt8,
+    weight_type=QuantType.QInt8,
+    per_channel=True,
+  )
+
+def main():
+  parser = argparse.ArgumentParser(description=f"Convert {KERAS_MODEL_PATH} to ONNX for the onnx inference backend.")
+  parser.add_argument("--opset", type=int, default=17)
+  parser.add_argument("--skip-int8", action="store_true", help="Only write the float32 model.")
+  args = parser.parse_args()
+
+  model = load_model()
+  convert(model, ONNX_MODEL_PATH, args.opset)
+  print(f"Wrote {ONNX_MODEL_PATH} ({os.path.getsize(ONNX_MODEL_PATH) / 1024:.0f} KB)")
+
+  if not args.skip_int8:
+    quantise(ONNX_MODEL_PATH, ONNX_INT8_MODEL_PATH, calibration_images())
+    print(f"Wrote {ONNX_INT8_MODEL_PATH} ({os.path.getsize(ONNX_INT8_MODEL_PATH) / 1024:.0f} KB)")
+
+if __name__ == "__main__":
+  main()
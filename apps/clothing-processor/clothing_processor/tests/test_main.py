@@ -0,0 +1,37 @@
+from fastapi.testclient import TestClient
+from prometheus_client.parser import text_string_to_metric_families
+from shared_utils.auth import get_token_cache_stats
+
+from clothing_processor.main import app
+from clothing_processor.utils.timing import Trace, record, reset_metrics
+
+client = TestClient(app)
+
+# /stats Tests
+def test_stats_reports_token_cache():
+  response = client.get("/stats")
+  assert response.status_code == 200
+  stats = response.json()
+  assert {"requests", "result_cache", "upload_queue"} <= set(stats)
+  assert stats["token_cache"] == get_token_cache_stats()
+  assert {"hits", "misses", "hit_rate"} <= set(stats["token_cache"])
+
+# /metrics Tests
+def test_metrics_serves_stage_histograms():
+  trace = Trace()
+  trace.add("decode", 0.003, 1200)
+  record(trace)
+  try:
+    response = client.get("/metrics")
+  finally:
+    reset_metrics()
+
+  assert response.status_code == 200
+  assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+  families = {family.name: family for family in text_string_to_metric_families(response.text)}
+  assert {"clothing_processor_stage_duration_seconds", "clothing_processor_stage_bytes"} <= set(families)
+  assert any(sample.labels.get("stage") == "decode" for sample in families["clothing_processor_stage_bytes"].samples)
+
+# /uploads/{key} Tests
+def test_upload_status_needs_token():
+  assert client.get("/uploads/abc123").status_code in (401, 403)
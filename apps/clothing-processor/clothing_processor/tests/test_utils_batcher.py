@@ -0,0 +1,88 @@
+import pytest
+import asyncio
+import numpy as np
+from unittest.mock import MagicMock
+
+from clothing_processor.utils.batcher import InferenceBatcher, get_batcher
+from clothing_processor.utils.predictions import class_names
+
+def mock_model():
+  model = MagicMock()
+  # Each image is classified by the value of its first pixel
+  model.predict.side_effect = lambda batch: np.eye(10)[batch[:, 0, 0, 0].astype(int)]
+  return model
+
+def model_input(label):
+  return np.full((1, 28, 28, 1), label, dtype=np.float32)
+
+def test_batcher_invalid_config():
+  with pytest.raises(ValueError, match="at least one image"):
+    InferenceBatcher(mock_model(), max_batch=0)
+  with pytest.raises(ValueError, match="can't be negative"):
+    InferenceBatcher(mock_model(), max_wait_ms=-1)
+
+@pytest.mark.asyncio
+async def test_batcher_invalid_input():
+  with pytest.raises(ValueError, match="shape"):
+    await InferenceBatcher(mock_model()).predict(np.zeros((2, 28, 28, 1)))
+
+@pytest.mark.asyncio
+async def test_batcher_combines_concurrent_requests():
+  model = mock_model()
+  batcher = InferenceBatcher(model, max_batch=8, max_wait_ms=50)
+  labels = await asyncio.gather(*(batcher.predict(model_input(i)) for i in range(5)))
+
+  # One model call, each result back with its own request
+  model.predict.assert_called_once()
+  assert model.predict.call_args[0][0].shape == (5, 28, 28, 1)
+  assert labels == class_names[:5]
+
+  stats = batcher.stats()
+  assert stats["batches"] == 1
+  assert stats["batch_sizes"] == {"5": 1}
+  assert stats["mean_batch_size"] == 5
+  assert stats["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_batcher_runs_full_batch_without_waiting():
+  model = mock_model()
+  # A wait this long would time the test out if full batches waited for it
+  batcher = InferenceBatcher(model, max_batch=3, max_wait_ms=60_000)
+  labels = await asyncio.wait_for(asyncio.gather(*(batcher.predict(model_input(i)) for i in range(6))), 5)
+
+  assert labels == class_names[:6]
+  assert model.predict.call_count == 2
+  assert batcher.stats()["batch_sizes"] == {"3": 2}
+
+@pytest.mark.asyncio
+async def test_batcher_fails_every_request_in_batch():
+  model = MagicMock()
+  model.predict.side_effect = Exception("Model crashed")
+  batcher = InferenceBatcher(model, max_wait_ms=1)
+  results = await asyncio.gather(batcher.predict(model_input(0)), batcher.predict(model_input(1)), return_exceptions=True)
+
+  assert all(isinstance(result, ValueError) and "Model crashed" in str(result) for result in results)
+  assert batcher.stats()["failed_batches"] == 1
+
+  # The next batch is unaffected
+  model.predict.side_effect = mock_model().predict.side_effect
+  assert await batcher.predict(model_input(2)) == class_names[2]
+
+@pytest.mark.asyncio
+async def test_batcher_predict_batch_runs_at_once():
+  model = mock_model()
+  # Neither the wait nor the batch size holds back an explicit batch
+  batcher = InferenceBatcher(model, max_batch=2, max_wait_ms=60_000)
+  labels = await asyncio.wait_for(batcher.predict_batch([model_input(i) for i in range(5)]), 5)
+
+  assert labels == class_names[:5]
+  model.predict.assert_called_once()
+  assert batcher.stats()["batch_sizes"] == {"5": 1}
+  assert await batcher.predict_batch([]) == []
+  with pytest.raises(ValueError, match="shape"):
+    await batcher.predict_batch([np.zeros((2, 28, 28, 1))])
+
+def test_get_batcher_follows_model():
+  model = mock_model()
+  assert get_batcher(model) is get_batcher(model)
+  assert get_batcher(mock_model()).model is not model
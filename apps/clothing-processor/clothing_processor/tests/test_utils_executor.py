@@ -0,0 +1,111 @@
+import pytest
+import asyncio
+import operator
+import threading
+
+from clothing_processor.utils import executor as executor_module
+from clothing_processor.utils.executor import (
+  PipelineExecutor,
+  get_executor,
+  shutdown_executor,
+)
+
+# PipelineExecutor Tests
+def test_pipeline_executor_invalid_kind():
+  with pytest.raises(ValueError, match="Invalid executor kind"):
+    PipelineExecutor(cpu_executor="gpu")
+
+def test_pipeline_executor_invalid_concurrency():
+  with pytest.raises(ValueError, match="max_concurrency must be at least 1."):
+    PipelineExecutor(max_concurrency=0)
+
+@pytest.mark.asyncio
+async def test_run_cpu_and_io_off_event_loop():
+  executor = PipelineExecutor(cpu_workers=2, io_workers=2)
+  loop_thread = threading.get_ident()
+  try:
+    cpu_thread = await executor.run_cpu(threading.get_ident)
+    io_thread = await executor.run_io(threading.get_ident)
+    assert cpu_thread != loop_thread
+    assert io_thread != loop_thread
+    assert await executor.run_cpu(operator.add, 2, 3) == 5
+    stats = executor.stats()
+    assert stats["cpu"]["completed"] == 2
+    assert stats["io"]["completed"] == 1
+  finally:
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_run_cpu_failure_counted():
+  executor = PipelineExecutor(cpu_workers=1)
+  try:
+    with pytest.raises(ZeroDivisionError):
+      await executor.run_cpu(operator.truediv, 1, 0)
+    assert executor.stats()["cpu"]["failed"] == 1
+  finally:
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_run_cpu_process_pool():
+  executor = PipelineExecutor(cpu_executor="process", cpu_workers=1)
+  try:
+    assert await executor.run_cpu(operator.mul, 6, 7) == 42
+    # Stages that cannot be pickled fall back to the thread pool
+    lock = threading.Lock()
+    assert await executor.run_cpu(lock.locked, allow_process=False) is False
+    assert executor.stats()["io"]["completed"] == 1
+  finally:
+    executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_limit_bounds_concurrency_and_reports_waiting():
+  executor = PipelineExecutor(max_concurrency=1)
+  release = asyncio.Event()
+  entered = asyncio.Event()
+
+  async def hold_slot():
+    async with executor.limit():
+      entered.set()
+      await release.wait()
+
+  async def wait_for_slot():
+    async with executor.limit():
+      return executor.stats()["requests"]["active"]
+
+  first = asyncio.create_task(hold_slot())
+  await entered.wait()
+  second = asyncio.create_task(wait_for_slot())
+  await asyncio.sleep(0)
+
+  stats = executor.stats()["requests"]
+  assert stats["active"] == 1
+  assert stats["waiting"] == 1
+
+  release.set()
+  await first
+  assert await second == 1
+  assert executor.stats()["requests"] == {"active": 0, "waiting": 0, "max_concurrency": 1}
+
+@pytest.mark.asyncio
+async def test_queue_depth_reported():
+  executor = PipelineExecutor(cpu_workers=1)
+  gate = threading.Event()
+  try:
+    tasks = [asyncio.create_task(executor.run_cpu(gate.wait)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    stats = executor.stats()["cpu"]
+    assert stats["running"] == 1
+    assert stats["queued"] == 2
+    gate.set()
+    await asyncio.gather(*tasks)
+  finally:
+    executor.shutdown()
+
+# get_executor() Tests
+def test_get_executor_cached():
+  shutdown_executor()
+  try:
+    assert get_executor() is get_executor()
+  finally:
+    shutdown_executor()
+  assert executor_module._executor is None
@@ -8,6 +8,10 @@ import io
 from clothing_processor.utils.files import (
   valid_file_type,
   get_image,
+  read_upload,
+  open_image,
+  sniff_image_type,
+  UploadTooLargeError,
 )
 
 # Create mock Image UploadFile without actual image data to test the functions with
@@ -32,10 +36,10 @@ def test_valid_file_type_empty_exstension():
   assert valid_file_type(file) == False
 
 # Create mock Image UploadFile with real image data to test the functions with
-def create_image_upload_file(filename: str):
-    img = Image.new('RGB', (10, 10), color='red')
+def create_image_upload_file(filename: str, size=(10, 10), format='PNG'):
+    img = Image.new('RGB', size, color='red')
     buf = io.BytesIO()
-    img.save(buf, format='PNG')
+    img.save(buf, format=format)
     buf.seek(0)
     return StarletteUploadFile(filename=filename, file=buf)
 
@@ -56,4 +60,86 @@ async def test_get_image_invalid_type():
 async def test_get_image_invalid_image_content():
     file = create_upload_file('testImage.png')
     with pytest.raises(ValueError, match='Error while processing image:'):
-        await get_image(file)
\ No newline at end of file
+        await get_image(file)
+
+# read_upload() Tests
+@pytest.mark.asyncio
+async def test_read_upload_returns_bytes():
+  content = create_image_upload_file('testImage.png').file.read()
+  assert await read_upload(create_upload_file('testImage.png', content)) == content
+
+@pytest.mark.asyncio
+async def test_read_upload_invalid_type():
+  with pytest.raises(ValueError, match='Invalid file type'):
+    await read_upload(create_upload_file('testImage.txt'))
+
+# open_image() Tests
+def test_open_image_valid_image():
+  content = create_image_upload_file('testImage.png').file.read()
+  assert open_image(content).size == (10, 10)
+
+def test_open_image_invalid_content():
+  with pytest.raises(ValueError, match='Error while processing image:'):
+    open_image(b'not an image')
+
+@pytest.mark.asyncio
+async def test_read_upload_too_large():
+  file = create_image_upload_file('testImage.png', size=(200, 200))
+  with pytest.raises(UploadTooLargeError, match='File too large'):
+    await read_upload(file, max_bytes=100)
+
+@pytest.mark.asyncio
+async def test_read_upload_stops_at_limit():
+  # A huge stream is rejected after the first chunk over the limit, not read whole
+  class EndlessFile(io.RawIOBase):
+    reads = 0
+    def readable(self):
+      return True
+    def readinto(self, buffer):
+      EndlessFile.reads += 1
+      header = b'\xff\xd8\xff\xe0'
+      buffer[:len(header)] = header
+      return len(buffer)
+
+  file = StarletteUploadFile(filename='huge.jpg', file=io.BufferedReader(EndlessFile()))
+  with pytest.raises(UploadTooLargeError):
+    await read_upload(file, max_bytes=3 * 1024 * 1024)
+  assert EndlessFile.reads < 10
+
+@pytest.mark.asyncio
+async def test_read_upload_declared_size_too_large():
+  file = StarletteUploadFile(filename='testImage.png', file=io.BytesIO(b''), size=10 ** 9)
+  with pytest.raises(UploadTooLargeError):
+    await read_upload(file)
+
+@pytest.mark.asyncio
+async def test_read_upload_wrong_content():
+  # A text file renamed to .png is rejected on its first bytes
+  with pytest.raises(ValueError, match='not a JPEG or PNG image'):
+    await read_upload(create_upload_file('testImage.png', b'just some text'))
+
+# sniff_image_type() Tests
+def test_sniff_image_type():
+  assert sniff_image_type(create_image_upload_file('a.png').file.read()) == 'PNG'
+  assert sniff_image_type(create_image_upload_file('a.jpg', format='JPEG').file.read()) == 'JPEG'
+  assert sniff_image_type(b'GIF89a') is None
+  assert sniff_image_type(b'') is None
+
+def test_open_image_too_many_pixels():
+  content = create_image_upload_file('a.png', size=(100, 100)).file.read()
+  with pytest.raises(UploadTooLargeError, match='Image too large: 100x100 pixels'):
+    open_image(content, max_pixels=5000)
+
+def test_open_image_jpeg_reduced_decoding():
+  content = create_image_upload_file('a.jpg', size=(800, 600), format='JPEG').file.read()
+  # Decoded at the smallest scale whose longest side still covers max_size
+  image = open_image(content, max_size=200)
+  assert image.load() is not None
+  assert image.size == (200, 150)
+  assert open_image(content, max_size=300).size == (400, 300)
+  assert open_image(content).size == (800, 600)
+  assert open_image(content, max_size=1000).size == (800, 600)
+
+def test_open_image_png_full_size():
+  content = create_image_upload_file('a.png', size=(800, 600)).file.read()
+  assert open_image(content, max_size=200).size == (800, 600)
@@ -4,18 +4,41 @@ from PIL import Image
 import io
 import base64
 import rembg
-
+import itertools
+import os
+import sys
+import subprocess
+from unittest.mock import patch, MagicMock
+from concurrent.futures import ThreadPoolExecutor
+
+from clothing_processor.utils import image as image_module
 from clothing_processor.utils.image import (
   to_image_array,
   remove_background,
+  cut_out,
+  fit_image,
+  upsample_mask,
   to_bytes_image,
   preprocess_image,
   to_base64,
   get_rgb_colour,
+  visible_pixels,
+  visible_colours,
+  pack_rgb,
   rgb_to_hex,
   hex_to_rgb,
   calculate_distance,
   match_colour,
+  match_colours,
+  rgb_to_lab,
+  get_palette,
+  get_rembg_session,
+  warm_up_rembg,
+  get_lookup_table,
+  lookup_indices,
+  lookup_colour,
+  colour_histogram,
+  extract_palette,
   get_colour,
   COLOUR_MAP,
 )
@@ -49,29 +72,139 @@ def test_to_image_array_empty_image():
   with pytest.raises(ValueError, match="Produced an empty image array."):
     to_image_array(MockEmptyImage())
 
-def test_remove_background_valid_input():
+def test_remove_background_valid_input(fake_session):
   img_array = np.zeros((10, 10, 4), dtype=np.uint8)
   img_array[2:8, 2:8] = [255, 0, 0, 255] # A red square with alpha
 
-  # Mock rembg.remove to return a predictable output for testing
-  original_rembg_remove = rembg.remove
-  def mock_rembg_remove(data):
-    output = data.copy()
-    output[:2, :] = 0
-    return output
-  rembg.remove = mock_rembg_remove
-
-  try:
-    output_array, output_image = remove_background(img_array)
-    assert isinstance(output_array, np.ndarray)
-    assert isinstance(output_image, Image.Image)
-    assert output_array.shape == img_array.shape
-    assert output_image.size == (img_array.shape[1], img_array.shape[0])
-    assert np.all(output_array[:2, :, 3] == 0)
-
-  finally:
-    rembg.remove = original_rembg_remove
-
+  output_array, output_image = remove_background(img_array)
+  assert isinstance(output_array, np.ndarray)
+  assert isinstance(output_image, Image.Image)
+  assert output_array.shape == img_array.shape
+  assert output_image.size == (img_array.shape[1], img_array.shape[0])
+  # Outside the mask everything is transparent
+  assert np.all(output_array[:2, :, 3] == 0)
+  assert output_array[4, 4].tolist() == [255, 0, 0, 255]
+
+
+@pytest.fixture
+def rembg_sessions():
+  image_module._rembg_sessions.clear()
+  with patch("clothing_processor.utils.image.rembg.new_session", side_effect=lambda name: MagicMock(name=name)) as mock_new_session:
+    yield mock_new_session
+  image_module._rembg_sessions.clear()
+
+def test_get_rembg_session_reused(rembg_sessions):
+  session = get_rembg_session("u2netp")
+  assert get_rembg_session("u2netp") is session
+  rembg_sessions.assert_called_once_with("u2netp")
+
+def test_get_rembg_session_per_model(rembg_sessions):
+  assert get_rembg_session("u2net") is not get_rembg_session("isnet")
+  assert [c.args[0] for c in rembg_sessions.call_args_list] == ["u2net", "isnet-general-use"]
+
+def test_get_rembg_session_concurrent_first_use(rembg_sessions):
+  with ThreadPoolExecutor(8) as pool:
+    sessions = list(pool.map(lambda _: get_rembg_session("silueta"), range(16)))
+  assert all(s is sessions[0] for s in sessions)
+  rembg_sessions.assert_called_once()
+
+def test_get_rembg_session_invalid_model():
+  with pytest.raises(ValueError, match="Invalid rembg model"):
+    get_rembg_session("u3net")
+
+def test_get_rembg_session_load_failure(rembg_sessions):
+  rembg_sessions.side_effect = Exception("Download failed")
+  with pytest.raises(ValueError, match="Failed to load rembg model 'u2net'"):
+    get_rembg_session("u2net")
+  assert "u2net" not in image_module._rembg_sessions
+
+def test_warm_up_rembg(rembg_sessions):
+  with patch("clothing_processor.utils.image.rembg.remove") as mock_remove:
+    warm_up_rembg("u2netp")
+  assert mock_remove.call_args.kwargs["session"] is get_rembg_session("u2netp")
+
+class FakeSession:
+  """Stands in for a rembg session: the foreground is the middle half of the image."""
+
+  def __init__(self):
+    self.sizes = []
+
+  def predict(self, img, *args, **kwargs):
+    self.sizes.append(img.size)
+    mask = np.zeros((img.size[1], img.size[0]), dtype=np.uint8)
+    h, w = mask.shape
+    mask[h // 4:3 * h // 4, w // 4:3 * w // 4] = 255
+    return [Image.fromarray(mask)]
+
+@pytest.fixture
+def fake_session(rembg_sessions):
+  session = FakeSession()
+  rembg_sessions.side_effect = lambda name: session
+  return session
+
+def test_remove_background_uses_session(rembg_sessions, fake_session):
+  img_array = np.zeros((10, 10, 3), dtype=np.uint8)
+  remove_background(img_array)
+  remove_background(img_array)
+  assert fake_session.sizes == [(10, 10), (10, 10)]
+  rembg_sessions.assert_called_once()
+
+def test_remove_background_downscaled_mask(fake_session):
+  img_array = np.zeros((400, 800, 3), dtype=np.uint8)
+  img_array[...] = [10, 200, 30]
+  output_array, output_image = remove_background(img_array, mask_size=200)
+
+  # The mask is computed on the small copy only
+  assert fake_session.sizes == [(200, 100)]
+  assert output_array.shape == (400, 800, 4)
+  assert output_image.size == (800, 400)
+  assert output_array[200, 400].tolist() == [10, 200, 30, 255]
+  assert output_array[10, 10, 3] == 0
+  # Edges stay about as sharp as a full-resolution mask
+  assert np.count_nonzero((output_array[200, :, 3] > 0) & (output_array[200, :, 3] < 255)) <= 4
+
+def test_remove_background_caps_output_size(fake_session):
+  img_array = np.zeros((300, 600, 3), dtype=np.uint8)
+  output_array, output_image = remove_background(img_array, max_size=300)
+  assert fake_session.sizes == [(300, 150)]
+  assert output_array.shape == (150, 300, 4)
+
+def test_remove_background_small_image_skips_downscale(fake_session):
+  img_array = np.zeros((50, 60, 3), dtype=np.uint8)
+  remove_background(img_array, mask_size=200, max_size=300)
+  assert fake_session.sizes == [(60, 50)]
+
+def test_remove_background_image_input(fake_session):
+  img = create_test_image(width=40, height=30, color=(10, 200, 30))
+  from_image = remove_background(img)[0]
+  from_array = remove_background(np.asarray(img))[0]
+  assert np.array_equal(from_image, from_array)
+
+def test_remove_background_outputs_share_buffer(fake_session):
+  output_array, output_image = remove_background(np.zeros((20, 20, 3), dtype=np.uint8))
+  # The image is a view of the array, not a copy
+  output_array[0, 0] = [1, 2, 3, 4]
+  assert output_image.getpixel((0, 0)) == (1, 2, 3, 4)
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_cut_out_matches_rembg(mode):
+  rng = np.random.default_rng(0)
+  img = Image.fromarray(rng.integers(0, 256, (50, 30, len(mode)), dtype=np.uint8), mode)
+  mask = Image.fromarray(rng.integers(0, 256, (50, 30), dtype=np.uint8))
+  expected = np.asarray(rembg.bg.naive_cutout(img, mask))
+  assert np.array_equal(cut_out(img, mask, rows=16), expected)
+
+def test_fit_image():
+  img = create_test_image(width=400, height=100)
+  assert fit_image(img, 200).size == (200, 50)
+  assert fit_image(img, 500) is img
+  assert fit_image(img, 0) is img
+
+def test_upsample_mask_sharpens_edges():
+  mask = Image.fromarray(np.repeat([[0] * 5 + [255] * 5], 10, axis=0).astype(np.uint8))
+  upsampled = np.asarray(upsample_mask(mask, (80, 80)))
+  assert upsampled.shape == (80, 80)
+  assert np.count_nonzero((upsampled[0] > 0) & (upsampled[0] < 255)) <= 2
 
 def test_remove_background_none_input():
   with pytest.raises(ValueError, match="Input image array is None or empty."):
@@ -91,6 +224,57 @@ def test_to_bytes_image_invalid_image_object():
   with pytest.raises(ValueError, match="Error converting image to bytes: "):
     to_bytes_image("not an image")
 
+def test_to_bytes_image_png_compress_level():
+  img = Image.fromarray(np.random.default_rng(0).integers(0, 4, (64, 64, 4), dtype=np.uint8))
+  fast = to_bytes_image(img, "png", compress_level=1)
+  small = to_bytes_image(img, "png", compress_level=9)
+  assert fast.getvalue()[:8] == b"\x89PNG\r\n\x1a\n"
+  assert len(small.getvalue()) <= len(fast.getvalue())
+  assert np.array_equal(np.asarray(Image.open(fast)), np.asarray(img))
+
+def test_to_bytes_image_webp_lossless_keeps_pixels():
+  img = create_test_image(width=20, height=20, color=(10, 200, 30, 255))
+  img.putpixel((0, 0), (0, 0, 0, 0))
+  decoded = Image.open(to_bytes_image(img, "webp", quality=0))
+  assert decoded.format == "WEBP"
+  assert np.array_equal(np.asarray(decoded), np.asarray(img))
+
+def test_to_bytes_image_webp_lossy_keeps_alpha():
+  img = create_test_image(width=20, height=20, color=(10, 200, 30, 255))
+  img.paste((0, 0, 0, 0), (0, 0, 10, 20))
+  decoded = np.asarray(Image.open(to_bytes_image(img, "webp", quality=75)))
+  assert decoded[5, 2, 3] == 0
+  assert decoded[5, 15, 3] == 255
+
+def test_to_bytes_image_avif_needs_quality():
+  with pytest.raises(ValueError, match="AVIF output is lossy only"):
+    to_bytes_image(create_test_image(), "avif", quality=0)
+
+@patch("clothing_processor.utils.image.avif_supported", return_value=False)
+def test_to_bytes_image_avif_unsupported(mock_avif_supported):
+  with pytest.raises(ValueError, match="AVIF output needs Pillow 11.2"):
+    to_bytes_image(create_test_image(), "avif", quality=50)
+
+@pytest.mark.parametrize("image_format, message", [
+  ("gif", "Invalid IMAGE_FORMAT: 'gif'"),
+  ("avif", "IMAGE_FORMAT=avif needs Pillow 11.2"),
+])
+def test_image_format_checked_at_import(image_format, message):
+  # Stands in for a Pillow without AVIF support, like the pinned 11.1
+  code = "from PIL import features; features.modules.pop('avif', None); import clothing_processor.utils.image"
+  result = subprocess.run(
+    [sys.executable, "-c", code],
+    env={**os.environ, "IMAGE_FORMAT": image_format},
+    capture_output=True,
+    text=True,
+  )
+  assert result.returncode != 0
+  assert message in result.stderr
+
+def test_to_bytes_image_invalid_format():
+  with pytest.raises(ValueError, match="Invalid image format: 'gif'"):
+    to_bytes_image(create_test_image(), "gif")
+
 def test_preprocess_image_valid_image():
   img = create_test_image(width=100, height=100, mode='RGBA') 
   processed_array = preprocess_image(img)
@@ -134,6 +318,64 @@ def test_get_rgb_colour_invalid_shape():
   with pytest.raises(ValueError, match="Expected an RGBA image array."):
     get_rgb_colour(img_array_rgb)
 
+def test_get_rgb_colour_tie_prefers_first_seen():
+  img_array = np.zeros((2, 2, 4), dtype=np.uint8)
+  img_array[0, 0] = [0, 0, 255, 255]
+  img_array[0, 1] = [255, 0, 0, 255]
+  img_array[1, 0] = [255, 0, 0, 255]
+  img_array[1, 1] = [0, 0, 255, 255]
+  assert get_rgb_colour(img_array) == (0, 0, 255)
+
+def test_get_rgb_colour_matches_counter():
+  from collections import Counter
+  rng = np.random.default_rng(0)
+  img_array = rng.integers(0, 4, size=(50, 50, 4), dtype=np.uint8) * 60
+  pixels = img_array.reshape(-1, 4)
+  visible = pixels[pixels[:, 3] > 10, :3]
+  expected = tuple(int(c) for c in Counter(map(tuple, visible)).most_common(1)[0][0])
+  assert get_rgb_colour(img_array) == expected
+
+def test_get_rgb_colour_downsampled():
+  img_array = np.full((100, 100, 4), [0, 128, 0, 255], dtype=np.uint8)
+  img_array[:10] = [255, 255, 255, 255]
+  assert get_rgb_colour(img_array, max_pixels=500) == (0, 128, 0)
+
+def test_get_rgb_colour_quantised_returns_bin_mean():
+  img_array = np.zeros((10, 10, 4), dtype=np.uint8)
+  img_array[:, :, 3] = 255
+  img_array[:6, :, :3] = [200, 10, 10]
+  img_array[6:, :, :3] = [90, 90, 90]
+  img_array[:3, :, :3] = [202, 12, 12]  # Same bin as (200, 10, 10) at 4 bits
+  assert get_rgb_colour(img_array, quantise_bits=4) == (201, 11, 11)
+
+def test_get_rgb_colour_invalid_quantise_bits():
+  img_array = np.full((10, 10, 4), 255, dtype=np.uint8)
+  with pytest.raises(ValueError, match="quantise_bits must be between 1 and 8."):
+    get_rgb_colour(img_array, quantise_bits=0)
+
+def test_visible_pixels_filters_transparent():
+  img_array = np.zeros((4, 4, 4), dtype=np.uint8)
+  img_array[0] = [1, 2, 3, 255]
+  pixels = visible_pixels(img_array)
+  assert pixels.shape == (4, 3)
+  assert np.all(pixels == [1, 2, 3])
+
+def test_pack_rgb():
+  packed = pack_rgb(np.array([[255, 0, 0], [1, 2, 3]], dtype=np.uint8))
+  assert packed.tolist() == [0xFF0000, 0x010203]
+
+def test_visible_colours():
+  img_array = np.zeros((4, 4, 4), dtype=np.uint8)
+  img_array[0] = [1, 2, 3, 255]
+  img_array[1, 0] = [9, 9, 9, 5]  # Near-transparent
+  colours = visible_colours(img_array)
+  # Packed straight from the RGBA bytes, red in the lowest byte
+  assert colours.tolist() == [0x030201] * 4
+
+def test_visible_colours_no_visible_pixels():
+  with pytest.raises(ValueError, match="No visible pixels found in the image."):
+    visible_colours(np.zeros((4, 4, 4), dtype=np.uint8))
+
 def test_rgb_to_hex_valid_rgb():
   assert rgb_to_hex((255, 0, 0)) == "#FF0000"
   assert rgb_to_hex((0, 255, 0)) == "#00FF00"
@@ -230,6 +472,157 @@ def test_match_colour_empty_colour_map():
   finally:
     COLOUR_MAP.update(original_colour_map)
 
+def test_match_colour_same_as_pairwise_loop():
+  def loop_match(rgb):
+    distances = [(calculate_distance(rgb, hex_to_rgb(v)), n) for n, v in COLOUR_MAP.items()]
+    return min(distances, key=lambda d: d[0])[1]
+
+  rng = np.random.default_rng(0)
+  for rgb in rng.integers(0, 256, size=(500, 3)):
+    rgb = tuple(int(c) for c in rgb)
+    assert match_colour(rgb, metric="rgb")["name"] == loop_match(rgb)
+
+def test_match_colour_invalid_input():
+  with pytest.raises(ValueError):
+    match_colour((255, 0))
+  with pytest.raises(ValueError):
+    match_colour(("red", 0, 0))
+  with pytest.raises(ValueError, match="Invalid colour metric"):
+    match_colour((255, 0, 0), metric="hsv")
+
+def test_match_colour_lab_metric():
+  # A tan fabric is nearest Grey in RGB space but reads as Khaki
+  assert match_colour((255, 0, 0), metric="lab")["name"] == "Red"
+  assert match_colour((150, 120, 90), metric="rgb")["name"] == "Grey"
+  assert match_colour((150, 120, 90), metric="lab")["name"] == "Khaki"
+
+def test_match_colours_batch():
+  matched = match_colours([(250, 10, 10), (128, 0, 128), (0, 0, 0)])
+  assert [m["name"] for m in matched] == ["Red", "Purple", "Black"]
+  matched = match_colours(np.array([[255, 255, 255], [0, 0, 255]], dtype=np.uint8), metric="lab")
+  assert [m["name"] for m in matched] == ["White", "Blue"]
+
+def test_match_colours_empty_colour_map():
+  original_colour_map = COLOUR_MAP.copy()
+  COLOUR_MAP.clear()
+  try:
+    assert match_colours([(10, 20, 30), (0, 0, 0)]) == [None, None]
+  finally:
+    COLOUR_MAP.update(original_colour_map)
+
+def test_get_palette_cached_and_rebuilt_on_change():
+  palette = get_palette()
+  assert get_palette() is palette
+  assert palette["rgb"].shape == (len(COLOUR_MAP), 3)
+  COLOUR_MAP["Test"] = "#123456"
+  try:
+    assert match_colour((0x12, 0x34, 0x56))["name"] == "Test"
+  finally:
+    del COLOUR_MAP["Test"]
+  assert get_palette()["names"] == list(COLOUR_MAP)
+
+def test_rgb_to_lab_reference_values():
+  lab = rgb_to_lab(np.array([[255, 255, 255], [0, 0, 0], [255, 0, 0]]))
+  np.testing.assert_allclose(lab[0], [100, 0, 0], atol=0.01)
+  np.testing.assert_allclose(lab[1], [0, 0, 0], atol=0.01)
+  np.testing.assert_allclose(lab[2], [53.24, 80.09, 67.20], atol=0.01)
+
+def test_lookup_table_matches_cell_centres():
+  table = get_lookup_table(5, metric="rgb")
+  assert table.shape == (32 ** 3,)
+  rng = np.random.default_rng(1)
+  pixels = rng.integers(0, 256, size=(300, 3))
+  centres = (pixels >> 3 << 3) + 4
+  expected = [m["name"] for m in match_colours(centres, metric="rgb")]
+  names = get_palette()["names"]
+  assert [names[i] for i in lookup_indices(pixels, 5, metric="rgb")] == expected
+
+def test_lookup_colour():
+  assert lookup_colour((250, 10, 10)) == {"name": "Red", "value": "#FF0000"}
+  assert lookup_colour((0, 0, 0), metric="lab")["name"] == "Black"
+  with pytest.raises(ValueError):
+    lookup_colour((255, 0))
+
+def test_lookup_table_invalid_bits():
+  with pytest.raises(ValueError, match="Invalid lookup table bits"):
+    get_lookup_table(0)
+
+def test_lookup_table_memory_mapped(tmp_path):
+  table = get_lookup_table(4, metric="rgb", directory=str(tmp_path))
+  files = list(tmp_path.glob("colour_lut_rgb_4_*.npy"))
+  assert len(files) == 1
+
+  # A fresh process would load the saved table instead of building it
+  from clothing_processor.utils import image
+  image._lookup_tables.clear()
+  mapped = get_lookup_table(4, metric="rgb", directory=str(tmp_path))
+  assert isinstance(mapped, np.memmap)
+  np.testing.assert_array_equal(mapped, table)
+  image._lookup_tables.clear()
+
+def test_colour_histogram():
+  img_array = np.zeros((10, 10, 4), dtype=np.uint8)
+  img_array[:6] = [250, 5, 5, 255]
+  img_array[6:9] = [5, 5, 250, 255]
+  histogram = colour_histogram(img_array)
+  assert [(c["name"], c["coverage"]) for c in histogram] == [("Red", 2 / 3), ("Blue", 1 / 3)]
+
+def test_colour_histogram_no_visible_pixels():
+  with pytest.raises(ValueError, match="No visible pixels found in the image."):
+    colour_histogram(np.zeros((10, 10, 4), dtype=np.uint8))
+
+def striped_garment(width=400, height=300):
+  img_array = np.zeros((height, width, 4), dtype=np.uint8)
+  img_array[..., :3] = [20, 40, 120]
+  img_array[::4, :, :3] = [250, 250, 250]  # Stripes covering a quarter of the fabric
+  img_array[50:250, 50:350, 3] = 255
+  return img_array
+
+def test_extract_palette_coverage():
+  palette = extract_palette(striped_garment(), k=2)
+  assert [c["name"] for c in palette] == ["Navy", "White"]
+  assert palette[0]["hex"] == "#142878"
+  assert palette[0]["coverage"] == pytest.approx(0.75, abs=0.05)
+  assert sum(c["coverage"] for c in palette) == pytest.approx(1.0)
+
+def test_extract_palette_fewer_colours_than_k():
+  img_array = np.full((10, 10, 4), [255, 0, 0, 255], dtype=np.uint8)
+  palette = extract_palette(img_array, k=5)
+  assert palette == [{"name": "Red", "value": "#FF0000", "hex": "#FF0000", "coverage": 1.0}]
+
+def test_extract_palette_deterministic():
+  img_array = np.random.default_rng(2).integers(0, 256, size=(100, 100, 4), dtype=np.uint8)
+  img_array[..., 3] = 255
+  assert extract_palette(img_array, k=4) == extract_palette(img_array, k=4)
+
+def test_extract_palette_time_budget_on_4k_image():
+  img_array = np.random.default_rng(3).integers(0, 256, size=(3000, 4000, 4), dtype=np.uint8)
+  img_array[..., 3] = 255
+  # A clock that advances one second per reading, so the budget runs out after a known number of updates
+  with patch.object(image_module, "time") as mock_time, \
+      patch("clothing_processor.utils.image._assign", wraps=image_module._assign) as mock_assign:
+    mock_time.perf_counter.side_effect = itertools.count()
+    palette = extract_palette(img_array, k=8, max_iter=100000, time_budget=5)
+  # Four updates fit in the budget, then one pass assigns every sampled pixel
+  assert mock_assign.call_count == 4 + 1
+  assert len(palette) == 8
+
+def test_extract_palette_invalid_input():
+  with pytest.raises(ValueError, match="Invalid palette size"):
+    extract_palette(striped_garment(), k=0)
+  with pytest.raises(ValueError, match="No visible pixels found in the image."):
+    extract_palette(np.zeros((10, 10, 4), dtype=np.uint8))
+
+def test_visible_pixels_random_sample():
+  img_array = np.zeros((100, 100, 4), dtype=np.uint8)
+  img_array[..., 3] = 255
+  img_array[:, ::10, 0] = 255  # Every 10th column is red, in step with an even stride
+  strided = visible_pixels(img_array, max_pixels=1000)
+  sampled = visible_pixels(img_array, max_pixels=1000, rng=np.random.default_rng(0))
+  assert len(sampled) == 1000
+  assert (strided[:, 0] == 255).all()
+  assert (sampled[:, 0] == 255).mean() == pytest.approx(0.1, abs=0.03)
+
 def test_get_colour_valid_input():
   img_array = np.full((10, 10, 4), [255, 0, 0, 255], dtype=np.uint8) # Solid Red
   matched_colour = get_colour(img_array)
@@ -237,6 +630,13 @@ def test_get_colour_valid_input():
   assert matched_colour["name"] == "Red"
   assert matched_colour["value"] == "#FF0000"
 
+def test_get_colour_with_lookup_table():
+  img_array = np.full((10, 10, 4), [0, 0, 250, 255], dtype=np.uint8)
+  with patch("clothing_processor.utils.image.COLOUR_LOOKUP_BITS", 6):
+    with patch("clothing_processor.utils.image.match_colour") as mock_match:
+      assert get_colour(img_array) == {"name": "Blue", "value": "#0000FF"}
+      mock_match.assert_not_called()
+
 def test_get_colour_no_visible_pixels():
   img_array = np.zeros((10, 10, 4), dtype=np.uint8) 
   with pytest.raises(ValueError, match="No visible pixels found in the image."):
@@ -0,0 +1,58 @@
+import pytest
+import asyncio
+import time
+from unittest.mock import MagicMock
+
+from clothing_processor.utils.models import ModelLoader, get_model_loader
+
+def slow_loader(value="model", seconds=0.05):
+  def load():
+    time.sleep(seconds)
+    return value
+  return MagicMock(side_effect=load)
+
+@pytest.mark.asyncio
+async def test_model_loader_shares_one_load():
+  load = slow_loader()
+  loader = ModelLoader({"classifier": load})
+  loader.start()
+  assert loader.status()["models"]["classifier"]["state"] == "loading"
+  assert not loader.ready()
+
+  # Requests arriving while the model loads wait on the same run
+  models = await asyncio.gather(*(loader.get("classifier") for _ in range(5)))
+  assert models == ["model"] * 5
+  load.assert_called_once()
+
+  status = loader.status()
+  assert status["ready"] is True
+  assert status["models"]["classifier"]["state"] == "ready"
+  assert status["models"]["classifier"]["load_seconds"] >= 0.05
+
+@pytest.mark.asyncio
+async def test_model_loader_wait():
+  loader = ModelLoader({"classifier": slow_loader(), "rembg": slow_loader(None)})
+  await loader.wait()
+  assert loader.ready()
+
+@pytest.mark.asyncio
+async def test_model_loader_retries_after_failure():
+  load = MagicMock(side_effect=[Exception("Out of memory"), "model"])
+  loader = ModelLoader({"classifier": load})
+  with pytest.raises(Exception, match="Out of memory"):
+    await loader.get("classifier")
+  assert loader.status()["models"]["classifier"] == {"state": "failed", "error": "Out of memory", "load_seconds": None}
+
+  assert await loader.get("classifier") == "model"
+  assert loader.status()["models"]["classifier"]["state"] == "ready"
+  assert loader.status()["models"]["classifier"]["error"] is None
+
+@pytest.mark.asyncio
+async def test_model_loader_unknown_model():
+  with pytest.raises(ValueError, match="Unknown model: 'missing'"):
+    await ModelLoader({}).get("missing")
+
+def test_get_model_loader_models():
+  status = get_model_loader().status()
+  assert set(status["models"]) == {"classifier", "rembg"}
+  assert get_model_loader() is get_model_loader()
@@ -0,0 +1,375 @@
+import pytest
+import numpy as np
+from unittest.mock import patch, MagicMock
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from PIL import Image, ImageFile
+import io
+import time
+import asyncio
+import threading
+
+from clothing_processor.utils import result_cache
+from clothing_processor.utils.result_cache import ResultCache
+from clothing_processor.utils import upload_queue
+from clothing_processor.utils.upload_queue import UploadQueue
+from clothing_processor.utils.timing import Trace
+from clothing_processor.utils import executor as executor_module
+from clothing_processor.utils.executor import PipelineExecutor
+from clothing_processor.utils import batcher as batcher_module
+from clothing_processor.utils.pipeline import (
+  prepare_image,
+  process_upload,
+  process_batch,
+)
+
+@pytest.fixture(autouse=True)
+def fresh_result_cache():
+  result_cache._result_cache = ResultCache(max_size=16)
+  yield result_cache._result_cache
+  result_cache._result_cache = None
+
+@pytest.fixture(autouse=True)
+def fresh_executor():
+  # Each test runs on its own event loop, which the executor's slots would be bound to
+  executor_module.shutdown_executor()
+  yield
+  executor_module.shutdown_executor()
+
+def image_bytes(colour=(255, 0, 0), size=(10, 10), format="PNG") -> bytes:
+  buf = io.BytesIO()
+  Image.new("RGB", size, color=colour).save(buf, format=format)
+  return buf.getvalue()
+
+def create_image_upload_file(filename: str, colour=(255, 0, 0)):
+  img = Image.new("RGB", (10, 10), color=colour)
+  buf = io.BytesIO()
+  img.save(buf, format="PNG")
+  buf.seek(0)
+  return StarletteUploadFile(filename=filename, file=buf)
+
+def fake_remove_background(image):
+  output_array = np.array(image.convert("RGBA"))
+  return output_array, Image.fromarray(output_array)
+
+def mock_model(num_classes=10):
+  model = MagicMock()
+  model.predict.side_effect = lambda batch: np.eye(num_classes)[np.arange(len(batch)) % num_classes]
+  return model
+
+# prepare_image() Tests
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+def test_prepare_image(mock_remove_background):
+  prepared = prepare_image(image_bytes())
+  assert prepared["model_input"].shape == (1, 28, 28, 1)
+  assert prepared["colour"]["name"] == "Red"
+  assert isinstance(prepared["image"], Image.Image)
+
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+def test_prepare_image_passes_decoded_image(mock_remove_background):
+  prepare_image(image_bytes())
+  # No NumPy copy of the upload is made before background removal
+  content_image = mock_remove_background.call_args.args[0]
+  assert isinstance(content_image, Image.Image)
+  assert content_image.size == (10, 10)
+
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+def test_prepare_image_max_size(mock_remove_background):
+  prepare_image(image_bytes(size=(400, 400), format="JPEG"), max_size=100)
+  # The JPEG is decoded at a reduced scale
+  assert mock_remove_background.call_args.args[0].size == (100, 100)
+
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+def test_prepare_image_invalid(mock_remove_background):
+  with pytest.raises(ValueError, match="Error while processing image"):
+    prepare_image(b"not an image")
+  mock_remove_background.assert_not_called()
+
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+def test_prepare_image_with_palette(mock_remove_background):
+  prepared = prepare_image(image_bytes(), palette_size=3)
+  assert [(c["name"], c["coverage"]) for c in prepared["palette"]] == [("Red", 1.0)]
+  assert "palette" not in prepare_image(image_bytes())
+
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+def test_prepare_image_with_spans(mock_remove_background):
+  prepared = prepare_image(image_bytes(), palette_size=3, with_spans=True)
+  spans = {stage: (seconds, size) for stage, seconds, size in prepared["spans"]}
+  assert list(spans) == ["decode", "remove_background", "preprocess_image", "get_colour", "extract_palette"]
+  assert spans["decode"][1] == 10 * 10 * 3
+  assert spans["remove_background"][1] == 10 * 10 * 4
+  assert all(seconds >= 0 for seconds, _ in spans.values())
+  assert "spans" not in prepare_image(image_bytes())
+
+# process_batch() Tests
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", side_effect=lambda image, key=None, trace=None: "https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_single_predict_call(mock_remove_background, mock_s3_upload):
+  model = mock_model()
+  files = [create_image_upload_file(f"{i}.png", (255, i, 0)) for i in range(3)]
+  results = await process_batch(model, files)
+
+  model.predict.assert_called_once()
+  assert model.predict.call_args[0][0].shape == (3, 28, 28, 1)
+  assert mock_s3_upload.call_count == 3
+  assert [r["filename"] for r in results] == ["0.png", "1.png", "2.png"]
+  assert sorted(r["class"] for r in results) == ["Pullover", "T-shirt/top", "Trouser"]
+  assert all(r["colour"]["name"] == "Red" for r in results)
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+async def test_process_batch_single_predict_call_slow_images(mock_s3_upload):
+  def slow_remove_background(image):
+    # Images finish preparing well apart, far beyond the batcher's wait
+    time.sleep(0.02 * image.getpixel((0, 0))[1])
+    return fake_remove_background(image)
+
+  model = mock_model()
+  files = [create_image_upload_file(f"{i}.png", (255, i, 0)) for i in range(4)]
+  with patch("clothing_processor.utils.pipeline.remove_background", side_effect=slow_remove_background):
+    results = await process_batch(model, files)
+
+  assert all("error" not in r for r in results)
+  model.predict.assert_called_once()
+  assert model.predict.call_args[0][0].shape == (4, 28, 28, 1)
+  assert batcher_module.batcher_stats()["batch_sizes"] == {"4": 1}
+
+@pytest.fixture
+def one_slot_executor():
+  executor_module._executor = PipelineExecutor(cpu_workers=4, max_concurrency=1)
+  yield executor_module._executor
+  executor_module.shutdown_executor()
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+async def test_process_batch_takes_slot_per_image(mock_s3_upload, one_slot_executor):
+  running, most_running = 0, 0
+  lock = threading.Lock()
+  def count_running(image):
+    nonlocal running, most_running
+    with lock:
+      running += 1
+      most_running = max(most_running, running)
+    time.sleep(0.01)
+    with lock:
+      running -= 1
+    return fake_remove_background(image)
+
+  with patch("clothing_processor.utils.pipeline.remove_background", side_effect=count_running):
+    files = [create_image_upload_file(f"{i}.png", (255, i, 0)) for i in range(4)]
+    results = await process_batch(mock_model(), files)
+
+  assert all("error" not in r for r in results)
+  # The free CPU workers don't let more than one image into the pipeline at once
+  assert most_running == 1
+  assert one_slot_executor.stats()["requests"]["active"] == 0
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_reports_errors_per_file(mock_remove_background, mock_s3_upload):
+  model = mock_model()
+  bad_file = StarletteUploadFile(filename="notes.txt", file=io.BytesIO(b"not an image"))
+  files = [create_image_upload_file("good.png"), bad_file]
+  results = await process_batch(model, files)
+
+  assert results[0]["class"] == "T-shirt/top"
+  assert "error" not in results[0]
+  assert results[1]["filename"] == "notes.txt"
+  assert results[1]["error"].startswith("Couldn't process image: Invalid file type")
+  assert model.predict.call_args[0][0].shape == (1, 28, 28, 1)
+
+def fake_s3_upload(image, key=None, trace=None):
+  # Fail the upload of the red image only
+  if image.getpixel((0, 0))[:3] == (255, 0, 0):
+    raise ValueError("Failed to upload file: Timeout")
+  return "https://wfits-bucket.s3.amazonaws.com/b.png"
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", side_effect=fake_s3_upload)
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_upload_failure(mock_remove_background, mock_s3_upload):
+  files = [create_image_upload_file("a.png"), create_image_upload_file("b.png", colour=(0, 0, 255))]
+  results = await process_batch(mock_model(), files)
+  assert results[0]["error"] == "Couldn't process image: Failed to upload file: Timeout"
+  assert results[1]["image_url"] == "https://wfits-bucket.s3.amazonaws.com/b.png"
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_prediction_failure(mock_remove_background):
+  model = MagicMock()
+  model.predict.side_effect = Exception("Model crashed")
+  results = await process_batch(model, [create_image_upload_file("a.png")])
+  assert results[0]["error"] == "Couldn't process image: Error during prediction: Model crashed"
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_with_palette(mock_remove_background, mock_s3_upload):
+  files = [create_image_upload_file("red.png"), create_image_upload_file("blue.png", colour=(0, 0, 255))]
+  results = await process_batch(mock_model(), files, palette_size=2)
+  assert [r["palette"][0]["name"] for r in results] == ["Red", "Blue"]
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", side_effect=lambda image, key=None, trace=None: f"https://wfits-bucket.s3.amazonaws.com/{key}.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_reuses_cached_results(mock_remove_background, mock_s3_upload, fresh_result_cache):
+  model = mock_model()
+  first = await process_batch(model, [create_image_upload_file("a.png")])
+  second = await process_batch(model, [create_image_upload_file("b.png"), create_image_upload_file("c.png", colour=(0, 0, 255))])
+
+  # Only the new image goes through the pipeline again
+  assert mock_remove_background.call_count == 2
+  assert model.predict.call_count == 2
+  assert second[0]["image_url"] == first[0]["image_url"]
+  assert second[0]["filename"] == "b.png"
+  assert second[1]["colour"]["name"] == "Blue"
+  assert fresh_result_cache.stats()["memory"]["hits"] == 1
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", side_effect=lambda image, key=None, trace=None: f"https://wfits-bucket.s3.amazonaws.com/{key}.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_shares_pipeline_with_upload(mock_remove_background, mock_s3_upload, fresh_result_cache):
+  model = mock_model()
+  single, batch = await asyncio.gather(
+    process_upload(model, create_image_upload_file("a.png")),
+    process_batch(model, [create_image_upload_file("b.png"), create_image_upload_file("c.png")]),
+  )
+
+  # The same image sent to both endpoints at once goes through the pipeline once
+  mock_remove_background.assert_called_once()
+  mock_s3_upload.assert_called_once()
+  assert batch[0]["image_url"] == batch[1]["image_url"] == single["image_url"]
+  assert fresh_result_cache.stats()["coalesced"] == 2
+
+# process_upload() Tests
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", side_effect=lambda image, key=None, trace=None: f"https://wfits-bucket.s3.amazonaws.com/{key}.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_upload_cached(mock_remove_background, mock_s3_upload):
+  model = MagicMock()
+  model.predict.return_value = np.eye(10)[[1]]
+  first = await process_upload(model, create_image_upload_file("a.png"))
+  second = await process_upload(model, create_image_upload_file("retry.png"))
+
+  assert first == second
+  assert first["class"] == "Trouser"
+  mock_remove_background.assert_called_once()
+  # The S3 object is named after the content hash
+  assert first["image_url"].endswith(f"/{mock_s3_upload.call_args.args[1]}.png")
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_upload_palette_cached_separately(mock_remove_background, mock_s3_upload):
+  model = mock_model()
+  plain = await process_upload(model, create_image_upload_file("a.png"))
+  with_palette = await process_upload(model, create_image_upload_file("a.png"), palette_size=2)
+  assert "palette" not in plain
+  assert with_palette["palette"][0]["name"] == "Red"
+  assert mock_remove_background.call_count == 2
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", side_effect=ValueError("Failed to upload file: timeout"))
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_upload_failure_not_cached(mock_remove_background, mock_s3_upload, fresh_result_cache):
+  for _ in range(2):
+    with pytest.raises(ValueError, match="timeout"):
+      await process_upload(mock_model(), create_image_upload_file("a.png"))
+  assert mock_remove_background.call_count == 2
+  assert fresh_result_cache.stats()["memory"]["size"] == 0
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_upload_trace(mock_remove_background, mock_s3_upload):
+  trace = Trace()
+  result = await process_upload(mock_model(), create_image_upload_file("a.png"), trace=trace)
+  stages = [stage for stage, _, _ in trace.spans]
+  assert stages == [
+    "read", "wait_for_slot", "decode", "remove_background", "preprocess_image",
+    "get_colour", "predict_class", "s3_upload",
+  ]
+  assert "spans" not in result
+  assert trace.spans[0][2] == len(create_image_upload_file("a.png").file.getvalue())
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_batch_trace(mock_remove_background, mock_s3_upload):
+  trace = Trace()
+  files = [create_image_upload_file(f"{i}.png", (i, 0, 0)) for i in range(2)]
+  results = await process_batch(mock_model(), files, trace=trace)
+  stages = [stage for stage, _, _ in trace.spans]
+  assert all("spans" not in r for r in results)
+  # The images ran side by side, so each stage is reported once rather than summed
+  assert sorted(stages) == sorted([
+    "read", "wait_for_slot", "decode", "remove_background", "preprocess_image",
+    "get_colour", "predict_class", "s3_upload",
+  ])
+  sizes = {stage: size for stage, _, size in trace.spans}
+  assert sizes["read"] == sum(len(f.file.getvalue()) for f in files)
+  assert sizes["decode"] == 2 * 10 * 10 * 3
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.s3.IMAGE_THUMBNAIL_SIZES", [128])
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_upload_thumbnail_urls(mock_remove_background, mock_s3_upload):
+  result = await process_upload(mock_model(), create_image_upload_file("a.png"))
+  assert result["thumbnail_urls"] == {"128": "https://wfits-bucket.s3.amazonaws.com/test_128.png"}
+  batch = await process_batch(mock_model(), [create_image_upload_file("b.png", (0, 255, 0))])
+  assert batch[0]["thumbnail_urls"] == result["thumbnail_urls"]
+
+def prepare_image_in_worker(*args):
+  # Runs in the worker process, where the test's patches don't apply
+  with patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background):
+    return prepare_image(*args)
+
+@pytest.fixture
+def process_executor():
+  executor_module._executor = PipelineExecutor(cpu_executor="process", cpu_workers=1)
+  yield executor_module._executor
+  executor_module.shutdown_executor()
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.s3_upload", return_value="https://wfits-bucket.s3.amazonaws.com/test.png")
+async def test_process_upload_decodes_in_worker(mock_s3_upload, process_executor):
+  decoded_here = []
+  load = ImageFile.ImageFile.load
+  def record_load(image):
+    decoded_here.append(image)
+    return load(image)
+
+  with patch.object(ImageFile.ImageFile, "load", record_load), \
+      patch("clothing_processor.utils.pipeline.prepare_image", prepare_image_in_worker):
+    trace = Trace()
+    result = await process_upload(mock_model(), create_image_upload_file("a.png"), trace=trace)
+
+  assert result["colour"]["name"] == "Red"
+  assert process_executor.stats()["cpu"]["completed"] == 1
+  # Only the upload's bytes went to the worker; it was never decoded in this process
+  assert decoded_here == []
+  assert "decode" in [stage for stage, _, _ in trace.spans]
+
+@pytest.fixture
+def fresh_upload_queue():
+  upload_queue._upload_queue = UploadQueue(directory=None, retry_delay=0.01)
+  yield upload_queue._upload_queue
+  upload_queue._upload_queue = None
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.pipeline.BACKGROUND_UPLOADS", True)
+@patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=[ValueError("Failed to upload file: timeout"), "url"])
+@patch("clothing_processor.utils.pipeline.remove_background", side_effect=fake_remove_background)
+async def test_process_upload_background_upload(mock_remove_background, mock_s3_upload, fresh_upload_queue):
+  result = await process_upload(mock_model(), create_image_upload_file("a.png"))
+  # Returned before the upload ran, at the URL it will be stored at
+  digest = result["image_url"].rsplit("/", 1)[1].split(".")[0]
+  assert result["image_url"] == f"https://wfits-bucket.s3.amazonaws.com/{digest}.png"
+  assert fresh_upload_queue.status(digest)["state"] in ("queued", "uploading")
+
+  await fresh_upload_queue.drain()
+  # Retried until stored
+  assert mock_s3_upload.call_count == 2
+  assert fresh_upload_queue.status(digest) == {"key": digest, "state": "stored", "attempts": 2}
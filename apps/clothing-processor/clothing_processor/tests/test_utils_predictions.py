@@ -1,12 +1,26 @@
 import pytest
 import numpy as np
+import tensorflow as tf
 from unittest.mock import patch, MagicMock
 
 from clothing_processor.utils.predictions import (
   class_names,
   load_model,
   predict_class,
+  predict_classes,
+  compile_model,
+  CompiledModel,
+  load_classifier,
+  OnnxModel,
+  model_path,
+  model_hash,
 )
+from clothing_processor.scripts._convert_model import load_images, calibration_paths, holdout_paths
+
+def small_model():
+    inputs = tf.keras.Input((28, 28, 1))
+    outputs = tf.keras.layers.Dense(10, activation="softmax")(tf.keras.layers.Flatten()(inputs))
+    return tf.keras.Model(inputs, outputs)
 
 # load_model() Tests
 @patch("clothing_processor.utils.predictions.tf.keras.models.load_model")
@@ -40,4 +54,96 @@ def test_predict_class_none_input():
 def test_predict_class_invalid_input_type():
     mock_model = MagicMock()
     with pytest.raises(ValueError, match="Input image must be a valid numpy array."):
-        predict_class(mock_model, "not an image")
\ No newline at end of file
+        predict_class(mock_model, "not an image")
+
+# predict_classes() Tests
+def test_predict_classes_valid():
+    mock_model = MagicMock()
+    mock_model.predict.return_value = np.array([
+      [0.9, 0.1, 0, 0, 0, 0, 0, 0, 0, 0],
+      [0, 0, 0, 0, 0, 0, 0, 0.2, 0, 0.8],
+    ])
+    batch = np.random.rand(2, 28, 28, 1)
+    result = predict_classes(mock_model, batch)
+    mock_model.predict.assert_called_once()
+    assert result == [class_names[0], class_names[9]]
+
+def test_predict_classes_invalid_shape():
+    mock_model = MagicMock()
+    with pytest.raises(ValueError, match="Input images must be a numpy array"):
+        predict_classes(mock_model, np.random.rand(28, 28))
+
+def test_predict_classes_model_error():
+    mock_model = MagicMock()
+    mock_model.predict.side_effect = Exception("Bad input")
+    with pytest.raises(ValueError, match="Error during prediction: Bad input"):
+        predict_classes(mock_model, np.random.rand(1, 28, 28, 1))
+
+# compile_model() Tests
+def test_compile_model_matches_keras_predict():
+    model = small_model()
+    compiled = compile_model(model, "function")
+    assert isinstance(compiled, CompiledModel)
+    batch = np.random.default_rng(0).random((3, 28, 28, 1))
+    np.testing.assert_allclose(compiled.predict(batch), model.predict(batch), rtol=1e-5, atol=1e-6)
+    assert predict_classes(compiled, batch) == predict_classes(model, batch)
+
+def test_compile_model_varying_batch_size_does_not_retrace():
+    compiled = compile_model(small_model(), "function")
+    for batch_size in (1, 5, 32):
+        assert compiled.predict(np.zeros((batch_size, 28, 28, 1))).shape == (batch_size, 10)
+    assert predict_class(compiled, np.zeros((1, 28, 28, 1))) in class_names
+
+def test_compile_model_keras_backend():
+    model = MagicMock()
+    assert compile_model(model, "keras") is model
+
+def test_compile_model_invalid_backend():
+    with pytest.raises(ValueError, match="Invalid TensorFlow inference backend: 'onnx'"):
+        compile_model(MagicMock(), "onnx")
+
+def test_compile_model_failure():
+    with pytest.raises(ValueError, match="Failed to compile model"):
+        compile_model(MagicMock(input_shape="bad"), "function")
+
+# load_classifier() Tests
+# The int8 model is calibrated on the other bundled images, so these show how it does on unseen ones
+@pytest.mark.parametrize("backend, atol", [("onnx", 1e-5), ("onnx-int8", 0.05)])
+def test_load_classifier_onnx_matches_keras(backend, atol):
+    images = load_images(holdout_paths())
+    keras_model = tf.keras.models.load_model("clothing_processor/data/models/fashion_mnist_model.h5")
+    model = load_classifier(backend)
+    assert isinstance(model, OnnxModel)
+    assert predict_classes(model, images) == predict_classes(keras_model, images)
+    # The models return logits; compare the class probabilities
+    probabilities = tf.nn.softmax(model.predict(images)).numpy()
+    expected = tf.nn.softmax(keras_model(images, training=False)).numpy()
+    np.testing.assert_allclose(probabilities, expected, atol=atol)
+
+def test_int8_calibration_excludes_holdout_images():
+    assert holdout_paths()
+    assert not set(calibration_paths()) & set(holdout_paths())
+
+@patch("clothing_processor.utils.predictions.load_model")
+def test_load_classifier_tensorflow_backend(mock_load_model):
+    model = MagicMock()
+    mock_load_model.return_value = model
+    assert load_classifier("keras") is model
+
+def test_load_classifier_invalid_backend():
+    with pytest.raises(ValueError, match="Invalid inference backend: 'tflite'"):
+        load_classifier("tflite")
+
+@patch("clothing_processor.utils.predictions.ONNX_MODEL_PATH", "missing.onnx")
+def test_load_classifier_onnx_missing_model():
+    with pytest.raises(ValueError, match="Failed to load model"):
+        load_classifier("onnx")
+
+def test_model_hash():
+    assert model_path("onnx-int8").endswith(".int8.onnx")
+    assert model_path("function") == model_path("keras")
+    assert len(model_hash("onnx")) == 64
+    assert model_hash("onnx") == model_hash("onnx")
+    assert model_hash("onnx") != model_hash("onnx-int8")
+    with patch("clothing_processor.utils.predictions.ONNX_MODEL_PATH", "missing.onnx"):
+        assert model_hash("onnx") == "missing"
@@ -0,0 +1,152 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import patch
+
+from clothing_processor.utils.result_cache import (
+  ResultCache,
+  content_digest,
+  result_key,
+)
+
+RESULT = {"class": "Shirt", "colour": {"name": "Red", "value": "#FF0000"}, "image_url": "https://wfits-bucket.s3.amazonaws.com/abc.png"}
+
+# content_digest() Tests
+def test_content_digest_stable():
+  assert content_digest(b"image") == content_digest(b"image")
+  assert content_digest(b"image") != content_digest(b"other image")
+  assert len(content_digest(b"image")) == 64
+
+def test_content_digest_changes_with_pipeline_version():
+  digest = content_digest(b"image")
+  with patch("clothing_processor.utils.result_cache.PIPELINE_VERSION", "2"):
+    assert content_digest(b"image") != digest
+  with patch("clothing_processor.utils.image.REMBG_MODEL", "u2netp"):
+    assert content_digest(b"image") != digest
+
+def test_content_digest_changes_with_model():
+  digest = content_digest(b"image")
+  # Each backend serves its own model file
+  with patch("clothing_processor.utils.predictions.INFERENCE_BACKEND", "onnx-int8"):
+    assert content_digest(b"image") != digest
+  with patch("clothing_processor.utils.predictions._model_hashes", {}), \
+      patch("clothing_processor.utils.predictions.KERAS_MODEL_PATH", "clothing_processor/data/models/retrained.h5"):
+    assert content_digest(b"image") != digest
+
+# result_key() Tests
+def test_result_key():
+  assert result_key("abc") == "abc"
+  assert result_key("abc", 3) == "abc-p3"
+
+# ResultCache Tests
+def test_result_cache_memory():
+  cache = ResultCache(max_size=2)
+  assert cache.get("a") is None
+  cache.set("a", RESULT)
+  assert cache.get("a") == RESULT
+  stats = cache.stats()
+  assert stats["memory"]["hits"] == 1
+  assert stats["hit_rate"] == 0.5
+  assert stats["disk"] is None
+
+def test_result_cache_returns_copies():
+  cache = ResultCache()
+  cache.set("a", RESULT)
+  cache.get("a")["class"] = "Dress"
+  assert cache.get("a")["class"] == "Shirt"
+
+def test_result_cache_disabled():
+  cache = ResultCache(max_size=0)
+  cache.set("a", RESULT)
+  assert cache.get("a") is None
+  assert cache.stats() == {"enabled": False}
+
+def test_result_cache_disk(tmp_path):
+  ResultCache(directory=str(tmp_path)).set("abcdef", RESULT)
+  assert json.loads((tmp_path / "ab" / "abcdef.json").read_text()) == RESULT
+
+  # A new process finds the result on disk and keeps it in memory afterwards
+  cache = ResultCache(directory=str(tmp_path))
+  assert cache.get("abcdef") == RESULT
+  assert cache.get("abcdef") == RESULT
+  assert cache.get("missing") is None
+  stats = cache.stats()
+  assert stats["disk"]["hits"] == 1
+  assert stats["disk"]["misses"] == 1
+  assert stats["hit_rate"] == pytest.approx(2 / 3)
+
+def test_result_cache_delete(tmp_path):
+  cache = ResultCache(directory=str(tmp_path))
+  cache.set("abcdef", RESULT)
+  cache.delete("abcdef")
+  cache.delete("missing")
+  assert cache.get("abcdef") is None
+  assert not (tmp_path / "ab" / "abcdef.json").exists()
+
+def test_result_cache_corrupt_disk_entry(tmp_path):
+  (tmp_path / "ab").mkdir()
+  (tmp_path / "ab" / "abcdef.json").write_text("{not json")
+  cache = ResultCache(directory=str(tmp_path))
+  assert cache.get("abcdef") is None
+  assert cache.stats()["disk"]["errors"] == 1
+
+@pytest.mark.asyncio
+async def test_get_or_compute_coalesces_concurrent_requests():
+  cache = ResultCache()
+  calls = []
+
+  async def compute():
+    calls.append(1)
+    await asyncio.sleep(0.01)
+    return RESULT
+
+  results = await asyncio.gather(*(cache.get_or_compute("a", compute) for _ in range(5)))
+  assert all(r == RESULT for r in results)
+  assert len(calls) == 1
+  assert cache.stats()["coalesced"] == 4
+  assert await cache.get_or_compute("a", compute) == RESULT
+  assert len(calls) == 1
+
+@pytest.mark.asyncio
+async def test_get_or_compute_does_not_cache_errors():
+  cache = ResultCache()
+
+  async def fail():
+    raise ValueError("rembg failed")
+
+  with pytest.raises(ValueError):
+    await cache.get_or_compute("a", fail)
+
+  async def compute():
+    return RESULT
+
+  assert await cache.get_or_compute("a", compute) == RESULT
+
+@pytest.mark.asyncio
+async def test_get_or_compute_many():
+  cache = ResultCache()
+  cache.set("a", RESULT)
+  calls = []
+
+  async def compute(keys):
+    calls.append(keys)
+    await asyncio.sleep(0.01)
+    return [{"class": key} if key != "c" else ValueError("rembg failed") for key in keys]
+
+  async def single():
+    return {"class": "d"}
+
+  single_result, results = await asyncio.gather(
+    cache.get_or_compute("d", single),
+    cache.get_or_compute_many(["a", "b", "c", "b", "d"], compute),
+  )
+
+  # Cached and in-flight keys are left out, the rest are computed in one call
+  assert calls == [["b", "c"]]
+  assert results[0] == RESULT
+  assert results[1] == results[3] == {"class": "b"}
+  assert isinstance(results[2], ValueError)
+  assert results[4] == single_result == {"class": "d"}
+  assert cache.stats()["coalesced"] == 2
+  assert cache.get("b") == {"class": "b"}
+  assert cache.get("c") is None
@@ -1,4 +1,5 @@
 import pytest
+import boto3
 from unittest.mock import patch, MagicMock
 from PIL import Image
 from io import BytesIO
@@ -8,19 +9,45 @@ from clothing_processor.utils.s3 import (
   load_s3_client,
   test_s3_connection,
   s3_upload,
+  thumbnail_urls,
+  encode_stats,
+  object_url,
 )
+from clothing_processor.utils.timing import Trace, parse_server_timing
 
 @pytest.fixture
 def fake_image():
     return Image.new("RGB", (10, 10))
 
+@pytest.fixture(autouse=True)
+def fresh_encode_stats():
+    s3._encode_stats.clear()
+    yield
+    s3._encode_stats.clear()
+
 # load_s3_client() Test
 @patch("clothing_processor.utils.s3.boto3.client")
 def test_load_s3_client(mock_boto_client):
     s3._s3 = None  # Reset cache so that mock is used
     client = load_s3_client()
     assert client == mock_boto_client.return_value
-    mock_boto_client.assert_called_once_with("s3")
+    mock_boto_client.assert_called_once()
+    assert mock_boto_client.call_args.args == ("s3",)
+    assert mock_boto_client.call_args.kwargs["endpoint_url"] is None
+    config = mock_boto_client.call_args.kwargs["config"]
+    assert config.max_pool_connections == s3.S3_MAX_POOL_CONNECTIONS
+    assert config.retries == {"max_attempts": s3.S3_MAX_ATTEMPTS, "mode": "adaptive"}
+    s3._s3 = None
+
+@patch("clothing_processor.utils.s3.S3_ENDPOINT_URL", "http://localhost:9000")
+@patch("clothing_processor.utils.s3.boto3.client")
+def test_load_s3_client_endpoint(mock_boto_client):
+    s3._s3 = None
+    load_s3_client()
+    assert mock_boto_client.call_args.kwargs["endpoint_url"] == "http://localhost:9000"
+    assert mock_boto_client.call_args.kwargs["config"].s3 == {"addressing_style": "path"}
+    assert object_url("abc.png") == "http://localhost:9000/wfits-bucket/abc.png"
+    s3._s3 = None
 
 # test_s3_connection() Test
 @patch("clothing_processor.utils.s3.load_s3_client")
@@ -41,6 +68,7 @@ def test_s3_upload_success(mock_load_client, mock_to_bytes, fake_image):
     url = s3_upload(fake_image)
     assert url.startswith("https://wfits-bucket.s3.amazonaws.com/")
     mock_s3.upload_fileobj.assert_called_once()
+    assert mock_s3.upload_fileobj.call_args.kwargs["Config"].multipart_threshold == s3.S3_MULTIPART_THRESHOLD
 
 @patch("clothing_processor.utils.s3.to_bytes_image")
 @patch("clothing_processor.utils.s3.load_s3_client")
@@ -49,4 +77,99 @@ def test_s3_upload_failure(mock_load_client, mock_to_bytes, fake_image):
     mock_load_client.return_value = mock_s3
     mock_to_bytes.side_effect = Exception("Broken image")
     with pytest.raises(ValueError, match="Failed to upload file: Broken image"):
-        s3_upload(fake_image)
\ No newline at end of file
+        s3_upload(fake_image)
+
+@patch("clothing_processor.utils.s3.to_bytes_image")
+@patch("clothing_processor.utils.s3.load_s3_client")
+def test_s3_upload_with_key(mock_load_client, mock_to_bytes, fake_image):
+    mock_s3 = MagicMock()
+    mock_load_client.return_value = mock_s3
+    mock_to_bytes.return_value = BytesIO(b"fake image data")
+    url = s3_upload(fake_image, key="abc123")
+    assert url == "https://wfits-bucket.s3.amazonaws.com/abc123.png"
+    assert mock_s3.upload_fileobj.call_args.args[2] == "abc123.png"
+
+@patch("clothing_processor.utils.s3.to_bytes_image")
+@patch("clothing_processor.utils.s3.load_s3_client")
+def test_s3_upload_with_key_skips_head_request(mock_load_client, mock_to_bytes, fake_image):
+    mock_s3 = MagicMock()
+    mock_load_client.return_value = mock_s3
+    mock_to_bytes.return_value = BytesIO(b"fake image data")
+    s3_upload(fake_image, key="abc123")
+    # Repeats are caught by the result cache, not by asking S3 before every upload
+    mock_s3.head_object.assert_not_called()
+    mock_s3.upload_fileobj.assert_called_once()
+
+@patch("clothing_processor.utils.s3.IMAGE_THUMBNAIL_SIZES", [64, 256])
+@patch("clothing_processor.utils.s3.load_s3_client")
+def test_s3_upload_thumbnails(mock_load_client):
+    mock_s3 = MagicMock()
+    mock_load_client.return_value = mock_s3
+    url = s3_upload(Image.new("RGBA", (1000, 500)), key="abc123")
+
+    uploads = mock_s3.upload_fileobj.call_args_list
+    # Thumbnails go first, so a stored full image means its thumbnails are stored too
+    assert [c.args[2] for c in uploads] == ["abc123_64.png", "abc123_256.png", "abc123.png"]
+    assert [Image.open(c.args[0]).size for c in uploads] == [(64, 32), (256, 128), (1000, 500)]
+    assert all(c.kwargs["ExtraArgs"]["ContentType"] == "image/png" for c in uploads)
+    assert thumbnail_urls(url) == {
+        "256": "https://wfits-bucket.s3.amazonaws.com/abc123_256.png",
+        "64": "https://wfits-bucket.s3.amazonaws.com/abc123_64.png",
+    }
+
+@patch("clothing_processor.utils.s3.IMAGE_FORMAT", "webp")
+@patch("clothing_processor.utils.s3.to_bytes_image")
+@patch("clothing_processor.utils.s3.load_s3_client")
+def test_s3_upload_format(mock_load_client, mock_to_bytes, fake_image):
+    mock_s3 = MagicMock()
+    mock_load_client.return_value = mock_s3
+    mock_to_bytes.return_value = BytesIO(b"fake image data")
+    assert s3_upload(fake_image, key="abc123") == "https://wfits-bucket.s3.amazonaws.com/abc123.webp"
+    assert mock_s3.upload_fileobj.call_args.kwargs["ExtraArgs"]["ContentType"] == "image/webp"
+
+@patch("clothing_processor.utils.s3.to_bytes_image")
+@patch("clothing_processor.utils.s3.load_s3_client")
+def test_encode_stats(mock_load_client, mock_to_bytes, fake_image):
+    mock_s3 = MagicMock()
+    mock_load_client.return_value = mock_s3
+    mock_to_bytes.side_effect = lambda image: BytesIO(b"x" * 100)
+    s3_upload(fake_image)
+    s3_upload(fake_image, key="abc123")
+
+    stats = encode_stats()
+    assert stats["format"] == "png"
+    full = stats["renditions"]["full"]
+    assert full["count"] == 2
+    assert full["bytes"] == 200
+    assert full["mean_bytes"] == 100
+    assert full["mean_seconds"] >= 0
+
+@patch("clothing_processor.utils.s3.IMAGE_THUMBNAIL_SIZES", [64])
+@patch("clothing_processor.utils.s3.load_s3_client")
+def test_s3_upload_trace(mock_load_client):
+    trace = Trace()
+    s3_upload(Image.new("RGBA", (200, 100)), key="abc123", trace=trace)
+
+    # Each rendition's encode shows up in the request's Server-Timing
+    spans = {stage: size for stage, _, size in trace.spans}
+    assert list(spans) == ["encode_full", "encode_64"]
+    uploads = mock_load_client.return_value.upload_fileobj.call_args_list
+    assert spans["encode_64"] == len(uploads[0].args[0].getvalue())
+    assert spans["encode_full"] == len(uploads[1].args[0].getvalue())
+    assert set(parse_server_timing(trace.server_timing())) == {"encode_full", "encode_64"}
+
+# Against a local S3 stand-in
+def test_s3_upload_moto(fake_image):
+    moto = pytest.importorskip("moto")
+    with moto.mock_aws():
+        s3._s3 = None
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=s3.BUCKET_NAME)
+        with patch("clothing_processor.utils.s3.boto3.client", return_value=client):
+            url = s3_upload(fake_image, key="abc123")
+            # Uploading the same content again rewrites the same object
+            assert s3_upload(fake_image, key="abc123") == url
+        stored = client.get_object(Bucket=s3.BUCKET_NAME, Key="abc123.png")
+        assert stored["ContentType"] == "image/png"
+        assert Image.open(BytesIO(stored["Body"].read())).size == (10, 10)
+        s3._s3 = None
@@ -0,0 +1,119 @@
+import pytest
+import asyncio
+from unittest.mock import patch
+from prometheus_client import generate_latest
+
+from clothing_processor.utils.timing import (
+  METRICS_REGISTRY,
+  Trace,
+  new_trace,
+  parse_server_timing,
+  span,
+  timed,
+  record,
+  reset_metrics,
+)
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+  reset_metrics()
+  yield
+  reset_metrics()
+
+# Trace Tests
+def test_trace_span_records_duration_and_size():
+  trace = Trace()
+  with span(trace, "decode") as current:
+    current.size = 300
+  with span(trace, "get_colour", 400):
+    pass
+  assert [(stage, size) for stage, _, size in trace.spans] == [("decode", 300), ("get_colour", 400)]
+  assert all(seconds >= 0 for _, seconds, _ in trace.spans)
+
+def test_trace_span_records_failed_stage():
+  trace = Trace()
+  with pytest.raises(ValueError):
+    with span(trace, "remove_background"):
+      raise ValueError("Failed")
+  assert trace.spans[0][0] == "remove_background"
+
+def test_span_without_trace():
+  with span(None, "decode") as current:
+    current.size = 300
+  # The shared no-op span is reused for every untimed stage
+  assert span(None, "decode") is span(None, "remove_background")
+
+def test_server_timing_sums_repeated_stages():
+  trace = Trace()
+  trace.add("read", 0.001)
+  trace.add("remove_background", 0.25)
+  trace.add("read", 0.002)
+  assert trace.server_timing() == "read;dur=3.0, remove_background;dur=250.0"
+
+def test_extend_longest():
+  first, second = Trace(), Trace()
+  first.add("decode", 0.01, 300)
+  first.add("remove_background", 0.2, 400)
+  second.add("remove_background", 0.3, 400)
+  second.add("s3_upload", 0.05)
+  second.add("s3_upload", 0.05)
+
+  trace = Trace()
+  trace.add("predict_class", 0.004)
+  trace.extend_longest([first, second])
+  assert trace.spans == [
+    ("predict_class", 0.004, 0),
+    ("decode", 0.01, 300),
+    ("remove_background", 0.3, 800),
+    ("s3_upload", 0.1, 0),
+  ]
+
+def test_parse_server_timing():
+  trace = Trace()
+  trace.add("read", 0.0012)
+  trace.add("remove_background", 0.25)
+  assert parse_server_timing(trace.server_timing()) == {"read": 1.2, "remove_background": 250.0}
+  assert parse_server_timing("cache;desc=hit, total;dur=3") == {"total": 3.0}
+  assert parse_server_timing("") == {}
+
+def test_new_trace():
+  with patch("clothing_processor.utils.timing.PIPELINE_TIMING", False):
+    assert new_trace() is None
+  with patch("clothing_processor.utils.timing.PIPELINE_TIMING", True):
+    assert isinstance(new_trace(), Trace)
+
+@pytest.mark.asyncio
+async def test_timed():
+  trace = Trace()
+  assert await timed(trace, "s3_upload", asyncio.sleep(0.01, result="url")) == "url"
+  assert trace.spans[0][0] == "s3_upload"
+  assert trace.spans[0][1] >= 0.01
+  assert await timed(None, "s3_upload", asyncio.sleep(0, result="url")) == "url"
+
+# Metrics Tests
+def metrics_text() -> str:
+  return generate_latest(METRICS_REGISTRY).decode()
+
+def test_record_metrics():
+  trace = Trace()
+  trace.add("decode", 0.003, 1200)
+  trace.add("predict_class", 0.02)
+  record(trace)
+  record(None)
+
+  text = metrics_text()
+  assert "# TYPE clothing_processor_stage_duration_seconds histogram" in text
+  assert 'clothing_processor_stage_duration_seconds_bucket{le="0.005",stage="decode"} 1.0' in text
+  assert 'clothing_processor_stage_duration_seconds_bucket{le="0.001",stage="decode"} 0.0' in text
+  assert 'clothing_processor_stage_duration_seconds_count{stage="predict_class"} 1.0' in text
+  assert 'clothing_processor_stage_bytes_bucket{le="+Inf",stage="decode"} 1.0' in text
+  assert 'clothing_processor_stage_bytes_sum{stage="decode"} 1200.0' in text
+  # Stages without a size only have a duration histogram
+  assert 'clothing_processor_stage_bytes_count{stage="predict_class"}' not in text
+
+def test_reset_metrics():
+  trace = Trace()
+  trace.add("decode", 0.003, 1200)
+  record(trace)
+  reset_metrics()
+  assert "stage=" not in metrics_text()
@@ -0,0 +1,243 @@
+import pytest
+import asyncio
+import shutil
+import time
+import os
+from unittest.mock import patch
+from PIL import Image
+
+from clothing_processor.utils.upload_queue import UploadQueue, image_bytes, is_retryable, LOCK_FILE
+from clothing_processor.utils.timing import Trace
+
+def create_image(size=(20, 10)):
+  return Image.new("RGBA", size, (255, 0, 0, 255))
+
+def test_image_bytes():
+  assert image_bytes(create_image()) == 20 * 10 * 4
+
+def test_upload_queue_invalid_workers():
+  with pytest.raises(ValueError, match="at least one worker"):
+    UploadQueue(workers=0)
+  with pytest.raises(ValueError, match="at least one attempt"):
+    UploadQueue(max_attempts=0)
+
+class ClientError(Exception):
+  def __init__(self, status):
+    super().__init__(f"HTTP {status}")
+    self.response = {"ResponseMetadata": {"HTTPStatusCode": status}}
+
+def test_is_retryable():
+  assert is_retryable(ValueError("timeout"))
+  assert is_retryable(ClientError(503))
+  assert is_retryable(ClientError(429))
+  assert not is_retryable(ClientError(403))
+  assert not is_retryable(FileNotFoundError("gone"))
+  # Wrapped errors are judged by what they wrap
+  try:
+    try:
+      raise ClientError(404)
+    except ClientError as e:
+      raise ValueError(f"Failed to upload file: {e}")
+  except ValueError as e:
+    assert not is_retryable(e)
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.s3_upload")
+async def test_upload_queue_put(mock_s3_upload):
+  queue = UploadQueue(directory=None)
+  image = create_image()
+  url = await queue.put(image, "abc123")
+  # The same image queued again is only uploaded once
+  assert await queue.put(image, "abc123") == url
+  assert url == "https://wfits-bucket.s3.amazonaws.com/abc123.png"
+  assert queue.stats()["memory_bytes"] == image_bytes(image)
+
+  await queue.drain()
+  mock_s3_upload.assert_called_once_with(image, "abc123")
+  assert queue.status("abc123") == {"key": "abc123", "state": "stored", "attempts": 1}
+  assert queue.stats()["completed"] == 1
+  assert queue.stats()["memory_bytes"] == 0
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=[ValueError("timeout"), ValueError("timeout"), "url"])
+async def test_upload_queue_retries_until_stored(mock_s3_upload):
+  queue = UploadQueue(directory=None, retry_delay=0.01)
+  await queue.put(create_image(), "abc123")
+  while queue.status("abc123")["state"] != "stored":
+    await asyncio.sleep(0.01)
+
+  assert mock_s3_upload.call_count == 3
+  assert queue.stats()["failed_attempts"] == 2
+  await queue.drain()
+
+@pytest.mark.asyncio
+async def test_upload_queue_on_complete():
+  def upload(image, key):
+    if key == "def456":
+      raise ValueError("timeout")
+
+  completed = {}
+  queue = UploadQueue(directory=None, max_attempts=1, on_complete=completed.__setitem__)
+  with patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=upload):
+    await queue.put(create_image(), "abc123")
+    await queue.put(create_image(), "def456")
+    await queue.drain()
+
+  assert completed["abc123"] == "https://wfits-bucket.s3.amazonaws.com/abc123.png"
+  assert isinstance(completed["def456"], ValueError)
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.s3_upload")
+async def test_upload_queue_on_complete_coroutine(mock_s3_upload):
+  completed = []
+  async def on_complete(key, outcome):
+    await asyncio.sleep(0.01)
+    completed.append(key)
+    raise RuntimeError("webhook down")
+
+  queue = UploadQueue(directory=None, on_complete=on_complete)
+  await queue.put(create_image(), "abc123")
+  # Drain waits for the callback, whose error doesn't reach the queue
+  await queue.drain()
+  assert completed == ["abc123"]
+  assert queue.status("abc123")["state"] == "stored"
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=ValueError("timeout"))
+async def test_upload_queue_gives_up_after_max_attempts(mock_s3_upload):
+  queue = UploadQueue(directory=None, retry_delay=0.01, max_attempts=3)
+  await queue.put(create_image(), "abc123")
+  while queue.status("abc123")["state"] != "failed":
+    await asyncio.sleep(0.01)
+
+  assert mock_s3_upload.call_count == 3
+  assert queue.status("abc123") == {"key": "abc123", "state": "failed", "attempts": 3, "error": "timeout"}
+  assert queue.stats()["failed"] == 1
+  assert queue.stats()["pending"] == 0
+  assert queue.stats()["memory_bytes"] == 0
+  await queue.drain()
+
+def forbidden_upload(image, key):
+  try:
+    raise ClientError(403)
+  except ClientError as e:
+    raise ValueError(f"Failed to upload file: {e}")
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=forbidden_upload)
+async def test_upload_queue_does_not_retry_client_errors(mock_s3_upload):
+  queue = UploadQueue(directory=None, retry_delay=0.01)
+  await queue.put(create_image(), "abc123")
+  await queue.drain()
+
+  mock_s3_upload.assert_called_once()
+  assert queue.status("abc123")["state"] == "failed"
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.upload_objects", side_effect=ValueError("S3 is down"))
+async def test_upload_queue_missing_spill_files_fail(mock_upload_objects, tmp_path):
+  queue = UploadQueue(max_bytes=0, directory=str(tmp_path), retry_delay=60)
+  await queue.put(create_image(), "abc123")
+  while queue.status("abc123")["state"] != "retrying":
+    await asyncio.sleep(0.01)
+
+  # Drain retries at once and finds the spilled files gone
+  shutil.rmtree(os.path.join(queue.spill_directory, "abc123"))
+  await queue.drain()
+  mock_upload_objects.assert_called_once()
+  assert queue.status("abc123")["state"] == "failed"
+  assert queue.status("abc123")["attempts"] == 2
+
+@pytest.mark.asyncio
+async def test_upload_queue_waits_for_memory_without_directory():
+  release = asyncio.Event()
+  uploaded = []
+  queue = UploadQueue(max_bytes=image_bytes(create_image()), directory=None)
+
+  def slow_upload(image, key):
+    # Runs on a worker thread; the first upload holds its memory until released
+    while key == "first" and not release.is_set():
+      time.sleep(0.01)
+    uploaded.append(key)
+
+  with patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=slow_upload):
+    await queue.put(create_image(), "first")
+    second = asyncio.ensure_future(queue.put(create_image(), "second"))
+    await asyncio.sleep(0.05)
+
+    # Over budget with nowhere to spill, so the second image waits
+    assert not second.done()
+    assert queue.stats()["memory_bytes"] == image_bytes(create_image())
+    release.set()
+    await asyncio.wait_for(second, 5)
+    await queue.drain()
+
+  assert uploaded == ["first", "second"]
+  assert queue.stats()["memory_waits"] == 1
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.upload_objects")
+async def test_upload_queue_spills_to_disk(mock_upload_objects, tmp_path):
+  # No memory budget: every image is encoded to disk straight away
+  queue = UploadQueue(max_bytes=0, directory=str(tmp_path))
+  trace = Trace()
+  with patch("clothing_processor.utils.s3.IMAGE_THUMBNAIL_SIZES", [8]):
+    await queue.put(create_image(), "abc123", trace)
+  # Spilled during the request, so its encodes are part of the request's trace
+  assert [stage for stage, _, _ in trace.spans] == ["encode_full", "encode_8"]
+  assert queue.stats()["memory_bytes"] == 0
+  assert queue.stats()["spilled"] == 1
+
+  spill_directory = queue.spill_directory
+  assert os.path.dirname(spill_directory) == str(tmp_path)
+
+  await queue.drain()
+  objects = mock_upload_objects.call_args.args[0]
+  # Thumbnails first, the full image last
+  assert [name for name, _ in objects] == ["abc123_8.png", "abc123.png"]
+  assert not os.path.exists(spill_directory)
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.upload_objects")
+async def test_upload_queue_keeps_pending_uploads_for_next_start(mock_upload_objects, tmp_path):
+  queue = UploadQueue(directory=str(tmp_path), retry_delay=60)
+  with patch("clothing_processor.utils.upload_queue.s3_upload", side_effect=ValueError("S3 is down")):
+    await queue.put(create_image(), "abc123")
+    while queue.status("abc123")["state"] != "retrying":
+      await asyncio.sleep(0.01)
+    spill_directory = queue.spill_directory
+    await queue.drain(timeout=0.1)
+
+  # Still in memory when the server stopped, so it was spilled
+  assert os.listdir(os.path.join(spill_directory, "abc123")) == ["abc123.png"]
+  os.mkdir(os.path.join(spill_directory, "def456.1.tmp"))
+
+  restarted = UploadQueue(directory=str(tmp_path))
+  restarted.start()
+  await restarted.drain()
+  assert [name for name, _ in mock_upload_objects.call_args.args[0]] == ["abc123.png"]
+  assert restarted.status("abc123")["state"] == "stored"
+  assert os.listdir(tmp_path) == []
+
+@pytest.mark.asyncio
+@patch("clothing_processor.utils.upload_queue.upload_objects", side_effect=ValueError("S3 is down"))
+async def test_upload_queue_leaves_running_queues_alone(mock_upload_objects, tmp_path):
+  # Another worker process, its spilled upload waiting for a retry
+  running = UploadQueue(max_bytes=0, directory=str(tmp_path), retry_delay=60)
+  await running.put(create_image(), "abc123")
+  while running.status("abc123")["state"] != "retrying":
+    await asyncio.sleep(0.01)
+
+  other = UploadQueue(directory=str(tmp_path))
+  other.start()
+  # Spills elsewhere and doesn't pick up uploads that are still owned
+  assert other.spill_directory != running.spill_directory
+  assert other.stats()["pending"] == 0
+  await other.drain()
+  assert sorted(os.listdir(running.spill_directory)) == sorted([LOCK_FILE, "abc123"])
+
+  await running.drain(timeout=0.1)
+  assert mock_upload_objects.call_count == 2
+
+def test_upload_queue_status_unknown():
+  assert UploadQueue(directory=None).status("missing") is None
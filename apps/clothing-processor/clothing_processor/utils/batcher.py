@@ -0,0 +1,191 @@
+from typing import Any, Dict, List, Optional, Tuple
+from numpy.typing import NDArray
+from clothing_processor.utils.executor import get_executor
+from clothing_processor.utils.predictions import predict_classes
+import numpy as np
+import asyncio
+import time
+import os
+
+# Largest number of images classified in one model call
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH") or 32)
+# Longest time a request waits for others to join its batch, in milliseconds
+INFERENCE_BATCH_WAIT_MS = float(os.getenv("INFERENCE_BATCH_WAIT_MS") or 5)
+
+# Cache the inference batcher
+_batcher = None
+
+
+class InferenceBatcher:
+  """
+  Collects concurrent `predict` calls and classifies them in one model call.
+
+  A batch is run once it holds `max_batch` images or its first image has
+  waited `max_wait_ms`, whichever comes first. Batches run on the executor's
+  CPU pool, so the event loop keeps collecting the next batch meanwhile.
+  """
+
+  def __init__(self, model: Any, max_batch: int = INFERENCE_MAX_BATCH, max_wait_ms: float = INFERENCE_BATCH_WAIT_MS):
+    """
+    :param model: The loaded TensorFlow model.
+    :type model: tf.keras.Model
+    :param max_batch: Largest number of images in one model call.
+    :type max_batch: int
+    :param max_wait_ms: Longest time a request waits for a batch to fill, in milliseconds.
+    :type max_wait_ms: float
+    :raise ValueError: If the configuration is invalid.
+    """
+    if max_batch < 1:
+      raise ValueError("Inference batches need room for at least one image.")
+    if max_wait_ms < 0:
+      raise ValueError("Inference batch wait can't be negative.")
+
+    self.model = model
+    self.max_batch = max_batch
+    self.max_wait_ms = max_wait_ms
+    self.batches = 0
+    self.images = 0
+    self.failed_batches = 0
+    self.batch_sizes: Dict[int, int] = {}
+    self.wait_seconds = 0.0
+    self.max_wait_seconds = 0.0
+    self._pending: List[Tuple[NDArray[Any], asyncio.Future, float]] = []
+    self._timer: Optional[asyncio.TimerHandle] = None
+    self._running = set()
+
+  async def predict(self, image: NDArray[Any]) -> str:
+    """
+    Predict the class of one preprocessed image as part of the next batch.
+
+    :param image: The preprocessed image, shape (1, 28, 28, 1).
+    :type image: NDArray[Any]
+    :raise ValueError: If the input is not a single preprocessed image or if the prediction fails.
+    :return: The predicted class label.
+    :rtype: str
+    """
+    if not isinstance(image, np.ndarray) or image.ndim != 4 or image.shape[0] != 1:
+      raise ValueError("Input image must be a numpy array of shape (1, 28, 28, 1).")
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    self._pending.append((image, future, time.perf_counter()))
+
+    if len(self._pending) >= self.max_batch:
+      self._flush()
+    elif self._timer is None:
+      self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+
+    return await future
+
+  async def predict_batch(self, images: List[NDArray[Any]]) -> List[str]:
+    """
+    Predict the classes of several preprocessed images in one model call, straight away.
+
+    For callers that already hold a whole batch, such as a batch request:
+    the images don't wait for others to join, and they are never split by
+    `max_batch`, so the caller bounds how many it sends.
+
+    :param images: The preprocessed images, each of shape (1, 28, 28, 1).
+    :type images: List[NDArray[Any]]
+    :raise ValueError: If an input is not a single preprocessed image or if the prediction fails.
+    :return: The predicted class label of each image, in order.
+    :rtype: List[str]
+    """
+    for image in images:
+      if not isinstance(image, np.ndarray) or image.ndim != 4 or image.shape[0] != 1:
+        raise ValueError("Input image must be a numpy array of shape (1, 28, 28, 1).")
+    if not images:
+      return []
+
+    return await self._classify(images, [time.perf_counter()] * len(images))
+
+  def _flush(self):
+    if self._timer is not None:
+      self._timer.cancel()
+      self._timer = None
+
+    # Requests whose client went away don't take up room in the batch
+    pending = [item for item in self._pending if not item[1].done()]
+    self._pending = []
+    for start in range(0, len(pending), self.max_batch):
+      task = asyncio.ensure_future(self._run(pending[start:start + self.max_batch]))
+      self._running.add(task)
+      task.add_done_callback(self._running.discard)
+
+  async def _run(self, batch: List[Tuple[NDArray[Any], asyncio.Future, float]]):
+    try:
+      labels = await self._classify([image for image, _, _ in batch], [queued_at for _, _, queued_at in batch])
+    except Exception as e:
+      for _, future, _ in batch:
+        if not future.done():
+          future.set_exception(e)
+      return
+
+    for (_, future, _), label in zip(batch, labels):
+      if not future.done():
+        future.set_result(label)
+
+  async def _classify(self, images: List[NDArray[Any]], queued: List[float]) -> List[str]:
+    started = time.perf_counter()
+    for queued_at in queued:
+      waited = started - queued_at
+      self.wait_seconds += waited
+      self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    size = len(images)
+    self.batches += 1
+    self.images += size
+    self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+    try:
+      # The loaded model cannot be sent to a worker process
+      return await get_executor().run_cpu(predict_classes, self.model, np.concatenate(images), allow_process=False)
+    except Exception:
+      self.failed_batches += 1
+      raise
+
+  def stats(self) -> Dict[str, Any]:
+    """
+    Return the batching counters.
+
+    :return: Batches run, how many images they held, and how long images waited for them.
+    :rtype: Dict[str, Any]
+    """
+    return {
+      "max_batch": self.max_batch,
+      "max_wait_ms": self.max_wait_ms,
+      "pending": len(self._pending),
+      "running": len(self._running),
+      "batches": self.batches,
+      "images": self.images,
+      "failed_batches": self.failed_batches,
+      "mean_batch_size": self.images / self.batches if self.batches else 0.0,
+      "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+      "mean_wait_ms": self.wait_seconds * 1000 / self.images if self.images else 0.0,
+      "max_wait_ms_seen": self.max_wait_seconds * 1000,
+    }
+
+
+def get_batcher(model: Any) -> InferenceBatcher:
+  """
+  Load and return the inference batcher for `model`.
+
+  :param model: The loaded TensorFlow model.
+  :type model: tf.keras.Model
+  :return: The shared inference batcher.
+  :rtype: InferenceBatcher
+  """
+  global _batcher
+  if _batcher is None or _batcher.model is not model:
+    _batcher = InferenceBatcher(model)
+  return _batcher
+
+
+def batcher_stats() -> Dict[str, Any]:
+  """
+  Return the counters of the shared inference batcher.
+
+  :return: The batcher counters, or an empty dictionary before the first prediction.
+  :rtype: Dict[str, Any]
+  """
+  return _batcher.stats() if _batcher is not None else {}
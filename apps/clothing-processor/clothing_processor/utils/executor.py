@@ -0,0 +1,198 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional
+import multiprocessing
+import functools
+import asyncio
+import os
+
+# Where CPU-bound stages (decode, rembg, resizing) run: "thread" or "process"
+CPU_EXECUTOR = os.getenv("PIPELINE_CPU_EXECUTOR") or "thread"
+# Worker counts for the CPU and I/O pools
+CPU_WORKERS = int(os.getenv("PIPELINE_CPU_WORKERS") or os.cpu_count() or 1)
+IO_WORKERS = int(os.getenv("PIPELINE_IO_WORKERS") or 8)
+# Maximum number of requests inside the pipeline at once; the rest wait their turn
+MAX_CONCURRENCY = int(os.getenv("PIPELINE_MAX_CONCURRENCY") or CPU_WORKERS)
+
+# Cache the pipeline executor
+_executor = None
+
+
+class _Pool:
+  """A lazily started executor together with its queue-depth counters."""
+
+  def __init__(self, kind: str, workers: int):
+    if kind not in ("thread", "process"):
+      raise ValueError(f"Invalid executor kind: '{kind}'. Expected 'thread' or 'process'.")
+    if workers < 1:
+      raise ValueError("Executor needs at least one worker.")
+
+    self.kind = kind
+    self.workers = workers
+    self.pending = 0
+    self.completed = 0
+    self.failed = 0
+    self._executor: Optional[Executor] = None
+
+  def executor(self) -> Executor:
+    if self._executor is None:
+      if self.kind == "process":
+        # Spawn rather than fork: forking a process that has loaded TensorFlow is unsafe
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+      else:
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="pipeline")
+    return self._executor
+
+  async def run(self, fn: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    self.pending += 1
+    try:
+      result = await loop.run_in_executor(self.executor(), functools.partial(fn, *args, **kwargs))
+      self.completed += 1
+      return result
+    except Exception:
+      self.failed += 1
+      raise
+    finally:
+      self.pending -= 1
+
+  def stats(self) -> Dict[str, Any]:
+    return {
+      "kind": self.kind,
+      "workers": self.workers,
+      "running": min(self.pending, self.workers),
+      "queued": max(self.pending - self.workers, 0),
+      "completed": self.completed,
+      "failed": self.failed,
+    }
+
+  def shutdown(self, wait: bool = True):
+    if self._executor is not None:
+      self._executor.shutdown(wait=wait, cancel_futures=not wait)
+      self._executor = None
+
+
+class PipelineExecutor:
+  """
+  Runs blocking pipeline stages off the event loop.
+
+  CPU-bound stages go to a thread or process pool, I/O-bound stages to a
+  thread pool. `limit()` caps how many requests are in the pipeline at once.
+  """
+
+  def __init__(
+    self,
+    cpu_executor: str = CPU_EXECUTOR,
+    cpu_workers: int = CPU_WORKERS,
+    io_workers: int = IO_WORKERS,
+    max_concurrency: int = MAX_CONCURRENCY,
+  ):
+    """
+    :param cpu_executor: "thread" or "process", the pool type for CPU-bound stages.
+    :type cpu_executor: str
+    :param cpu_workers: Number of CPU pool workers.
+    :type cpu_workers: int
+    :param io_workers: Number of I/O pool threads.
+    :type io_workers: int
+    :param max_concurrency: Maximum number of requests processed at once.
+    :type max_concurrency: int
+    :raise ValueError: If the configuration is invalid.
+    """
+    if max_concurrency < 1:
+      raise ValueError("max_concurrency must be at least 1.")
+
+    self.cpu = _Pool(cpu_executor, cpu_workers)
+    self.io = _Pool("thread", io_workers)
+    self.max_concurrency = max_concurrency
+    self.active = 0
+    self.waiting = 0
+    self._semaphore: Optional[asyncio.Semaphore] = None
+
+  async def run_cpu(self, fn: Callable, *args, allow_process: bool = True, **kwargs) -> Any:
+    """
+    Run a CPU-bound stage on the CPU pool.
+
+    :param fn: The function to run. With a process pool it and its arguments must be picklable.
+    :type fn: Callable
+    :param allow_process: False for stages whose arguments cannot leave this process
+      (e.g. a loaded model); they run on the thread pool instead of a process pool.
+    :type allow_process: bool
+    :return: The return value of `fn`.
+    :rtype: Any
+    """
+    if self.cpu.kind == "process" and not allow_process:
+      return await self.io.run(fn, *args, **kwargs)
+    return await self.cpu.run(fn, *args, **kwargs)
+
+  async def run_io(self, fn: Callable, *args, **kwargs) -> Any:
+    """
+    Run an I/O-bound stage (e.g. an S3 upload) on the I/O thread pool.
+
+    :param fn: The function to run.
+    :type fn: Callable
+    :return: The return value of `fn`.
+    :rtype: Any
+    """
+    return await self.io.run(fn, *args, **kwargs)
+
+  @asynccontextmanager
+  async def limit(self):
+    """Wait for a pipeline slot and hold it for the duration of the block."""
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    self.waiting += 1
+    try:
+      await self._semaphore.acquire()
+    finally:
+      self.waiting -= 1
+
+    self.active += 1
+    try:
+      yield
+    finally:
+      self.active -= 1
+      self._semaphore.release()
+
+  def stats(self) -> Dict[str, Any]:
+    """
+    Return queue-depth metrics for sizing workers.
+
+    :return: Request admission counters and per-pool worker, queue and completion counts.
+    :rtype: dict[str, Any]
+    """
+    return {
+      "requests": {
+        "active": self.active,
+        "waiting": self.waiting,
+        "max_concurrency": self.max_concurrency,
+      },
+      "cpu": self.cpu.stats(),
+      "io": self.io.stats(),
+    }
+
+  def shutdown(self, wait: bool = True):
+    """Stop the worker pools."""
+    self.cpu.shutdown(wait)
+    self.io.shutdown(wait)
+
+
+def get_executor() -> PipelineExecutor:
+  """
+  Load and return the pipeline executor.
+
+  :return: The shared pipeline executor.
+  :rtype: PipelineExecutor
+  """
+  global _executor
+  if _executor is None:
+    _executor = PipelineExecutor()
+  return _executor
+
+
+def shutdown_executor(wait: bool = True):
+  """Stop the shared pipeline executor, if it was started."""
+  global _executor
+  if _executor is not None:
+    _executor.shutdown(wait)
+    _executor = None
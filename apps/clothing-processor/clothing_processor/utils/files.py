@@ -1,6 +1,26 @@
 from fastapi import UploadFile
 from PIL import Image
+from typing import Optional
+import math
 import io
+import os
+
+# Largest accepted upload, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES") or 20 * 1024 * 1024)
+# Largest accepted image, in pixels, checked from the header before decoding
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS") or 40_000_000)
+# Bytes read from an upload at a time
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Leading bytes of the accepted image formats
+IMAGE_SIGNATURES = {
+  b"\xff\xd8\xff": "JPEG",
+  b"\x89PNG\r\n\x1a\n": "PNG",
+}
+
+
+class UploadTooLargeError(ValueError):
+  """Raised when an upload is over the byte or pixel limit."""
 
 def valid_file_type(file: UploadFile):
   """Checks if the uploaded file is a valid image based on its extension -> bool."""
@@ -9,24 +29,110 @@ def valid_file_type(file: UploadFile):
   return file_extension in valid_extensions
 
 
-async def get_image(file: UploadFile):
+def sniff_image_type(header: bytes) -> Optional[str]:
   """
-  Reads and processes an uploaded image file.
+  Identify an image format from the first bytes of a file.
+
+  :param header: The first bytes of the file (at least 8).
+  :type header: bytes
+  :return: "JPEG" or "PNG", or None if the bytes match neither.
+  :rtype: str | None
+  """
+  for signature, image_type in IMAGE_SIGNATURES.items():
+    if header.startswith(signature):
+      return image_type
+  return None
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+  """
+  Reads the raw bytes of an uploaded image file.
+
+  The file is read in chunks and rejected as soon as it's over `max_bytes`
+  or its first bytes aren't those of a JPEG or PNG, so oversized or
+  mislabelled uploads are never held in memory whole.
 
   :param file: The uploaded image file.
   :type file: UploadFile
-  :raise ValueError: If the file type is invalid or there is an error processing the image.
-  :return: A PIL Image object of the uploaded image.
-  :rtype: Image.Image
+  :param max_bytes: The largest accepted file size.
+  :type max_bytes: int
+  :raise UploadTooLargeError: If the file is larger than `max_bytes`.
+  :raise ValueError: If the file type is invalid or the file can't be read.
+  :return: The content of the file.
+  :rtype: bytes
   """
   if not valid_file_type(file):
     raise ValueError(f"Invalid file type: {file.filename}. Please upload a valid image file.")
-  
+
+  # The size is known up front for multipart uploads
+  if file.size is not None and file.size > max_bytes:
+    raise UploadTooLargeError(f"File too large: {file.filename}. The limit is {max_bytes} bytes.")
+
+  chunks = []
+  total = 0
+  try:
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+      if not chunks and sniff_image_type(chunk) is None:
+        raise ValueError(f"{file.filename} is not a JPEG or PNG image.")
+
+      total += len(chunk)
+      if total > max_bytes:
+        raise UploadTooLargeError(f"File too large: {file.filename}. The limit is {max_bytes} bytes.")
+      chunks.append(chunk)
+  except UploadTooLargeError:
+    raise
+  except Exception as e:
+    raise ValueError(f"Error while processing image: {e}")
+
+  return b"".join(chunks)
+
+
+def open_image(content: bytes, max_size: int = 0, max_pixels: int = MAX_IMAGE_PIXELS) -> Image.Image:
+  """
+  Opens the raw bytes of an image file.
+
+  The pixel count is checked from the image header before anything is
+  decoded. JPEGs are decoded at a reduced scale when `max_size` makes the
+  full resolution unnecessary.
+
+  :param content: The content of the image file.
+  :type content: bytes
+  :param max_size: If positive, the longest side the image will be scaled down to later;
+    JPEGs are then decoded at the smallest 1/2, 1/4 or 1/8 scale that's still at least this size.
+  :type max_size: int
+  :param max_pixels: The largest accepted number of pixels.
+  :type max_pixels: int
+  :raise UploadTooLargeError: If the image has more than `max_pixels` pixels.
+  :raise ValueError: If the content is not a readable image.
+  :return: A PIL Image object of the image.
+  :rtype: Image.Image
+  """
   try:
-    content = await file.read()
     content_bytes = io.BytesIO(content)
     content_image = Image.open(content_bytes)
   except Exception as e:
     raise ValueError(f"Error while processing image: {e}")
-  
-  return content_image
\ No newline at end of file
+
+  width, height = content_image.size
+  if width * height > max_pixels:
+    raise UploadTooLargeError(f"Image too large: {width}x{height} pixels. The limit is {max_pixels} pixels.")
+
+  if max_size > 0 and content_image.format == "JPEG" and max(width, height) > max_size:
+    # Let the JPEG decoder skip the detail that would be scaled away anyway
+    scale = max(width, height) / max_size
+    content_image.draft(content_image.mode, (math.ceil(width / scale), math.ceil(height / scale)))
+
+  return content_image
+
+
+async def get_image(file: UploadFile):
+  """
+  Reads and processes an uploaded image file.
+
+  :param file: The uploaded image file.
+  :type file: UploadFile
+  :raise ValueError: If the file type is invalid or there is an error processing the image.
+  :return: A PIL Image object of the uploaded image.
+  :rtype: Image.Image
+  """
+  return open_image(await read_upload(file))
\ No newline at end of file
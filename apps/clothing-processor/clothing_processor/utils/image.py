@@ -1,11 +1,70 @@
-from typing import Any, Tuple, Dict
-from PIL import ImageFile, Image
+from __future__ import annotations
+from typing import Any, Tuple, Dict, List, Optional
+from PIL import ImageFile, Image, features
 import numpy as np
 from numpy.typing import NDArray
-import rembg
+from shared_utils.lazy import lazy_import
 import io
+import os
 import base64
-from collections import Counter
+import hashlib
+import time
+import threading
+
+# Imported on first use: rembg loads onnxruntime, scipy and scikit-image
+rembg = lazy_import("rembg")
+
+# Background removal models, by configuration name, and the one to use
+REMBG_MODELS = {
+  "u2net": "u2net",
+  "u2netp": "u2netp",
+  "isnet": "isnet-general-use",
+  "silueta": "silueta",
+}
+REMBG_MODEL = os.getenv("REMBG_MODEL") or "u2net"
+
+# Compute the background mask on a copy at most this many pixels on its longest side
+# and cap the longest side of the stored image (0 = full resolution)
+REMBG_MASK_SIZE = int(os.getenv("REMBG_MASK_SIZE") or 0)
+IMAGE_MAX_SIZE = int(os.getenv("IMAGE_MAX_SIZE") or 0)
+# Rows cut out at a time, which bounds the temporary buffers of the cutout
+CUTOUT_ROWS = int(os.getenv("CUTOUT_ROWS") or 256)
+
+# Stored image formats: Pillow format name and content type
+IMAGE_FORMATS = {
+  "png": ("PNG", "image/png"),
+  "webp": ("WEBP", "image/webp"),
+  "avif": ("AVIF", "image/avif"),
+}
+# Format of the stored images
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT") or "png"
+# 1-100 for lossy WebP or AVIF, 0 for lossless (PNG is always lossless)
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY") or 0)
+# PNG zlib level 0-9: lower encodes faster into larger files (Pillow's default is 6)
+IMAGE_PNG_COMPRESS_LEVEL = int(os.getenv("IMAGE_PNG_COMPRESS_LEVEL") or 6)
+# Longest sides of the thumbnails stored next to each image, e.g. "512,128"
+IMAGE_THUMBNAIL_SIZES = [int(size) for size in (os.getenv("IMAGE_THUMBNAIL_SIZES") or "").split(",") if size.strip()]
+
+
+def avif_supported() -> bool:
+  """
+  Check whether Pillow can write AVIF, which needs Pillow 11.2 or later built with libavif.
+
+  :return: True if images can be encoded as AVIF.
+  :rtype: bool
+  """
+  return "avif" in features.modules and features.check_module("avif")
+
+
+# Fail at startup rather than on every upload, which the upload queue would retry forever
+if IMAGE_FORMAT not in IMAGE_FORMATS:
+  raise ValueError(f"Invalid IMAGE_FORMAT: '{IMAGE_FORMAT}'. Expected one of: {', '.join(IMAGE_FORMATS)}.")
+if IMAGE_FORMAT == "avif" and not avif_supported():
+  raise ValueError("IMAGE_FORMAT=avif needs Pillow 11.2 or later built with libavif; this Pillow can't write AVIF. Use png or webp.")
+
+# Cache the rembg sessions, one per model
+_rembg_sessions = {}
+_rembg_lock = threading.Lock()
 
 # Map of colour options and hexcode
 COLOUR_MAP = {
@@ -34,10 +93,33 @@ COLOUR_MAP = {
   "Magenta" : "#FF00FF"
 }
 
+# Optional speed-ups for dominant colour detection on very large images:
+# sample at most this many pixels (0 = all) and keep this many bits per channel
+COLOUR_MAX_PIXELS = int(os.getenv("COLOUR_MAX_PIXELS") or 0)
+COLOUR_QUANTISE_BITS = int(os.getenv("COLOUR_QUANTISE_BITS") or 8)
+# Distance used to match colours to the colour map: "rgb" (Euclidean) or "lab" (CIELAB delta E)
+COLOUR_METRIC = os.getenv("COLOUR_METRIC") or "rgb"
+
+# Optional colour lookup table: bits kept per channel (0 = match without a table)
+# and a directory to store built tables in for memory-mapping by later processes
+COLOUR_LOOKUP_BITS = int(os.getenv("COLOUR_LOOKUP_BITS") or 0)
+COLOUR_LOOKUP_DIR = os.getenv("COLOUR_LOOKUP_DIR") or None
+
+# Multi-colour palette extraction: pixels sampled for k-means and the time budget in seconds
+COLOUR_PALETTE_SAMPLE = int(os.getenv("COLOUR_PALETTE_SAMPLE") or 20000)
+COLOUR_PALETTE_BUDGET = float(os.getenv("COLOUR_PALETTE_BUDGET") or 0.05)
+
+# Cache the colour map as arrays, rebuilt only if COLOUR_MAP changes
+_palette = None
+# Cache the colour lookup tables, by bits, metric and colour map
+_lookup_tables = {}
+
 def to_image_array(image: ImageFile.Image) -> NDArray[Any]:
   """
   Convert a PIL Image to a NumPy array.
 
+  The array is a read-only view of the exported pixels, not a second copy.
+
   :param image: The input PIL Image.
   :type image: ImageFile.Image
   :raise ValueError: If conversion fails or the array is empty.
@@ -48,7 +130,7 @@ def to_image_array(image: ImageFile.Image) -> NDArray[Any]:
     raise ValueError("Input image is None.")
   
   try:
-    image_array = np.array(image)
+    image_array = np.asarray(image)
   except Exception as e:
     raise ValueError(f"Failed to convert image to NumPy array: {e}")
   
@@ -58,21 +140,168 @@ def to_image_array(image: ImageFile.Image) -> NDArray[Any]:
   return image_array
 
 
-def remove_background(image_array: NDArray[Any]) -> tuple[NDArray[Any], Image.Image]:
+def get_rembg_session(model_name: str = REMBG_MODEL) -> rembg.sessions.BaseSession:
+  """
+  Load and return the rembg session for a background removal model.
+
+  Sessions are created once per model and reused by every call.
+
+  :param model_name: One of "u2net", "u2netp", "isnet" or "silueta".
+  :type model_name: str
+  :raise ValueError: If the model name is unknown or the model fails to load.
+  :return: The rembg session.
+  :rtype: rembg.sessions.BaseSession
+  """
+  if model_name not in REMBG_MODELS:
+    raise ValueError(f"Invalid rembg model: '{model_name}'. Expected one of: {', '.join(REMBG_MODELS)}.")
+
+  session = _rembg_sessions.get(model_name)
+  if session is None:
+    # Pipeline threads may ask for the session at once; only load the model once
+    with _rembg_lock:
+      session = _rembg_sessions.get(model_name)
+      if session is None:
+        try:
+          session = rembg.new_session(REMBG_MODELS[model_name])
+        except Exception as e:
+          raise ValueError(f"Failed to load rembg model '{model_name}': {e}")
+        _rembg_sessions[model_name] = session
+  return session
+
+def warm_up_rembg(model_name: str = REMBG_MODEL):
+  """
+  Load the background removal model and run it once, so the first upload doesn't pay for it.
+
+  :param model_name: One of "u2net", "u2netp", "isnet" or "silueta".
+  :type model_name: str
+  :raise ValueError: If the model fails to load.
+  :return: None
+  :rtype: None
+  """
+  rembg.remove(np.zeros((32, 32, 3), dtype=np.uint8), session=get_rembg_session(model_name))
+
+def fit_image(image: Image.Image, max_size: int, resample: int = Image.Resampling.LANCZOS) -> Image.Image:
+  """
+  Scale an image down so its longest side is at most `max_size`, keeping its aspect ratio.
+
+  :param image: The input PIL Image.
+  :type image: Image.Image
+  :param max_size: The maximum length of the longest side, or 0 to keep the image as is.
+  :type max_size: int
+  :param resample: The PIL resampling filter.
+  :type resample: int
+  :return: The scaled image, or the input image if it already fits.
+  :rtype: Image.Image
+  """
+  width, height = image.size
+  if max_size <= 0 or max(width, height) <= max_size:
+    return image
+
+  scale = max_size / max(width, height)
+  size = (max(1, round(width * scale)), max(1, round(height * scale)))
+  return image.resize(size, resample, reducing_gap=3.0)
+
+def upsample_mask(mask: Image.Image, size: Tuple[int, int]) -> Image.Image:
+  """
+  Scale a low-resolution alpha mask up to `size` and sharpen its edges again.
+
+  Bilinear upsampling spreads each mask edge over about as many pixels as the
+  scale factor; stretching the alpha contrast by the same factor brings it back
+  to about one pixel.
+
+  :param mask: The greyscale ("L") mask.
+  :type mask: Image.Image
+  :param size: The target (width, height).
+  :type size: Tuple[int, int]
+  :return: The upsampled mask.
+  :rtype: Image.Image
+  """
+  scale = max(size[0] / mask.size[0], size[1] / mask.size[1])
+  upsampled = mask.resize(size, Image.Resampling.BILINEAR)
+  if scale <= 1:
+    return upsampled
+  return upsampled.point(lambda a: min(255, max(0, round((a - 127.5) * scale + 127.5))))
+
+def predict_mask(image: Image.Image) -> Image.Image:
+  """
+  Run the background removal model and return its alpha mask.
+
+  Calls the rembg session directly: `rembg.remove` would first copy the whole
+  image to apply its EXIF orientation, which the pipeline never relied on.
+
+  :param image: The input PIL Image.
+  :type image: Image.Image
+  :return: The greyscale ("L") mask, the same size as the image.
+  :rtype: Image.Image
+  """
+  return get_rembg_session().predict(image)[0]
+
+def cut_out(image: Image.Image, mask: Image.Image, rows: int = CUTOUT_ROWS) -> NDArray[np.uint8]:
+  """
+  Cut an image out along an alpha mask, into a new RGBA array.
+
+  Gives the same pixels as rembg's cutout (the image composited onto a
+  transparent background), but writes them straight into the output array a
+  band of rows at a time, so no other full-size image is created.
+
+  :param image: The input PIL Image.
+  :type image: Image.Image
+  :param mask: The greyscale ("L") mask, the same size as the image.
+  :type mask: Image.Image
+  :param rows: The number of rows processed at a time.
+  :type rows: int
+  :return: An (height, width, 4) array.
+  :rtype: NDArray[np.uint8]
+  """
+  width, height = image.size
+  output = np.empty((height, width, 4), dtype=np.uint8)
+  for top in range(0, height, max(rows, 1)):
+    box = (0, top, width, min(top + rows, height))
+    pixels = np.asarray(image.crop(box).convert("RGBA"), dtype=np.uint16)
+    alpha = np.asarray(mask.crop(box), dtype=np.uint16)[..., None]
+    # Pillow's rounded division by 255, so every channel matches Image.composite exactly
+    blended = pixels * alpha + 128
+    output[top:box[3]] = (blended + (blended >> 8)) >> 8
+  return output
+
+def remove_background(
+  image: Any,
+  mask_size: int = REMBG_MASK_SIZE,
+  max_size: int = IMAGE_MAX_SIZE,
+) -> tuple[NDArray[Any], Image.Image]:
   """
   Remove background from image array and return cleaned array and image.
 
-  :param image_array: The input NumPy array of the image.
-  :type image_array: NDArray[Any]
+  The two results share one buffer: the image is a view of the array.
+
+  :param image: The input PIL Image, or a NumPy array of the image.
+  :type image: Image.Image | NDArray[Any]
+  :param mask_size: If positive, compute the mask on a copy scaled down to this longest side
+    and scale the mask back up, instead of running rembg at full resolution.
+  :type mask_size: int
+  :param max_size: If positive, scale the output down to at most this longest side.
+  :type max_size: int
   :raise ValueError: If image is invalid or background removal fails.
   :return: A tuple containing the cleaned image array and PIL Image.
   :rtype: tuple[NDArray[Any], Image.Image]
   """
-  if image_array is None or image_array.size == 0:
+  if image is None or (isinstance(image, np.ndarray) and image.size == 0):
     raise ValueError("Input image array is None or empty.")
 
   try:
-    output_array = rembg.remove(image_array)
+    if isinstance(image, np.ndarray):
+      image = Image.fromarray(image)
+    image = fit_image(image, max_size)
+
+    if mask_size > 0 and max(image.size) > mask_size:
+      # rembg's network runs at a fixed input size, so a smaller copy loses little detail
+      small_image = fit_image(image, mask_size, Image.Resampling.BILINEAR)
+      mask = upsample_mask(predict_mask(small_image), image.size)
+    else:
+      mask = predict_mask(image)
+
+    output_array = cut_out(image, mask)
+    # RGBA arrays are wrapped, not copied
     output_image = Image.fromarray(output_array)
   except Exception as e:
     raise ValueError(f"Failed to remove background from the image: {e}")
@@ -80,19 +309,47 @@ def remove_background(image_array: NDArray[Any]) -> tuple[NDArray[Any], Image.Im
   return output_array, output_image
 
 
-def to_bytes_image(image: Image.Image) -> io.BytesIO:
+def to_bytes_image(
+  image: Image.Image,
+  image_format: str = IMAGE_FORMAT,
+  quality: int = IMAGE_QUALITY,
+  compress_level: int = IMAGE_PNG_COMPRESS_LEVEL,
+) -> io.BytesIO:
   """
   Convert a PIL Image to a BytesIO object.
 
   :param image: The input PIL Image.
   :type image: Image.Image
-  :raise ValueError: If conversion to bytes fails.
+  :param image_format: "png", "webp" or "avif".
+  :type image_format: str
+  :param quality: 1-100 for lossy WebP or AVIF, 0 for lossless. Ignored for PNG.
+  :type quality: int
+  :param compress_level: The PNG zlib level, 0-9.
+  :type compress_level: int
+  :raise ValueError: If the format or quality is invalid or conversion to bytes fails.
   :return: The image as a BytesIO object.
   :rtype: io.BytesIO
   """
+  if image_format not in IMAGE_FORMATS:
+    raise ValueError(f"Invalid image format: '{image_format}'. Expected one of: {', '.join(IMAGE_FORMATS)}.")
+  if not 0 <= quality <= 100:
+    raise ValueError("quality must be between 0 and 100.")
+
+  if image_format == "png":
+    options = {"compress_level": compress_level}
+  elif quality:
+    # WebP keeps the alpha channel lossless even when the colours are lossy
+    options = {"quality": quality}
+  elif image_format == "webp":
+    options = {"lossless": True}
+  else:
+    raise ValueError("AVIF output is lossy only; set a quality between 1 and 100.")
+  if image_format == "avif" and not avif_supported():
+    raise ValueError("AVIF output needs Pillow 11.2 or later built with libavif.")
+
   try:
     bytes_image = io.BytesIO()
-    image.save(bytes_image, format='PNG')
+    image.save(bytes_image, format=IMAGE_FORMATS[image_format][0], **options)
     bytes_image.seek(0)
     return bytes_image
   
@@ -143,34 +400,126 @@ def to_base64(image: Image.Image) -> str:
 
 
 
-def get_rgb_colour(image_array: NDArray[Any]) -> Tuple[int, int, int]:
+def visible_pixels(image_array: NDArray[Any], max_pixels: int = 0, rng: Optional[np.random.Generator] = None) -> NDArray[np.uint8]:
   """
-  Find the dominant RGB colour of an image array.
+  Return the RGB values of the visible pixels of an RGBA image array.
 
   :param image_array: The input NumPy image array.
   :type image_array: NDArray[Any]
-  :raise ValueError: If no visible pixels are found or the input is invalid.
-  :return: The RGB tuple of the dominant colour.
-  :rtype: Tuple[int, int, int]
+  :param max_pixels: If positive and the image is larger, sample evenly spaced pixels down to about this many.
+  :type max_pixels: int
+  :param rng: If given, sample random pixels instead, which cannot line up with a regular pattern in the fabric.
+  :type rng: np.random.Generator | None
+  :raise ValueError: If the array is not RGBA or no visible pixels are found.
+  :return: An (N, 3) array of RGB values.
+  :rtype: NDArray[np.uint8]
   """
-  
   if image_array.shape[-1] != 4:
     raise ValueError("Expected an RGBA image array.")
 
   pixels = image_array.reshape(-1, 4)
+  if max_pixels > 0 and len(pixels) > max_pixels:
+    if rng is None:
+      pixels = pixels[::-(-len(pixels) // max_pixels)]
+    else:
+      pixels = pixels[np.sort(rng.integers(len(pixels), size=max_pixels))]
+
   non_transparent_pixels = pixels[pixels[:, 3] > 10, :3]  # Alpha > 10 to filter near-transparent pixels
 
   # If only transparent pixels
   if len(non_transparent_pixels) == 0:
     raise ValueError("No visible pixels found in the image.")
 
-  # Get as RBG
-  most_common = Counter(map(tuple, non_transparent_pixels)).most_common(1)
-  rgb = most_common[0][0]  # (R, G, B)
-  r, g, b = rgb
-  output = (int(r), int(g), int(b))
+  return non_transparent_pixels
+
+
+def visible_colours(image_array: NDArray[Any], max_pixels: int = 0) -> NDArray[np.uint32]:
+  """
+  Return the colours of the visible pixels of an RGBA image array, packed as 0xBBGGRR integers.
+
+  Each RGBA pixel is read as one little-endian 32-bit word through a view of
+  the array, so the visible pixels are copied once and never widened per channel.
+
+  :param image_array: The input NumPy image array.
+  :type image_array: NDArray[Any]
+  :param max_pixels: If positive and the image is larger, sample evenly spaced pixels down to about this many.
+  :type max_pixels: int
+  :raise ValueError: If the array is not RGBA or no visible pixels are found.
+  :return: An (N,) array of packed colours.
+  :rtype: NDArray[np.uint32]
+  """
+  if image_array.shape[-1] != 4:
+    raise ValueError("Expected an RGBA image array.")
+
+  pixels = np.ascontiguousarray(image_array, dtype=np.uint8).reshape(-1, 4)
+  words = pixels.view("<u4").reshape(-1)
+  if max_pixels > 0 and len(pixels) > max_pixels:
+    step = -(-len(pixels) // max_pixels)
+    pixels, words = pixels[::step], words[::step]
+
+  colours = words[pixels[:, 3] > 10]  # Alpha > 10 to filter near-transparent pixels
+  if len(colours) == 0:
+    raise ValueError("No visible pixels found in the image.")
+
+  # Drop the alpha byte
+  colours &= 0xFFFFFF
+  return colours
+
+
+def pack_rgb(pixels: NDArray[Any]) -> NDArray[np.uint32]:
+  """
+  Pack (N, 3) RGB values into single 0xRRGGBB integers.
+
+  :param pixels: An (N, 3) array of RGB values.
+  :type pixels: NDArray[Any]
+  :return: An (N,) array of packed colours.
+  :rtype: NDArray[np.uint32]
+  """
+  pixels = pixels.astype(np.uint32, copy=False)
+  return (pixels[:, 0] << 16) | (pixels[:, 1] << 8) | pixels[:, 2]
+
+
+def get_rgb_colour(image_array: NDArray[Any], max_pixels: int = 0, quantise_bits: int = 8) -> Tuple[int, int, int]:
+  """
+  Find the dominant RGB colour of an image array.
+
+  Counts colours on packed 24-bit integers rather than Python tuples. Ties go
+  to the colour seen first, as with `collections.Counter`.
+
+  :param image_array: The input NumPy image array.
+  :type image_array: NDArray[Any]
+  :param max_pixels: If positive, only sample about this many pixels of larger images.
+  :type max_pixels: int
+  :param quantise_bits: Bits kept per channel (1-8). Below 8, similar colours are binned
+    together and the mean colour of the most common bin is returned.
+  :type quantise_bits: int
+  :raise ValueError: If no visible pixels are found or the input is invalid.
+  :return: The RGB tuple of the dominant colour.
+  :rtype: Tuple[int, int, int]
+  """
+  if not 1 <= quantise_bits <= 8:
+    raise ValueError("quantise_bits must be between 1 and 8.")
+
+  if quantise_bits == 8:
+    colours = visible_colours(image_array, max_pixels)
+    keys, counts = np.unique(colours, return_counts=True)
+    # Most frequent colour, earliest first occurrence on ties
+    tied = keys[counts == counts.max()]
+    key = int(tied[0] if len(tied) == 1 else colours[np.argmax(np.isin(colours, tied))])
+    return (key & 0xFF, (key >> 8) & 0xFF, key >> 16)
+
+  non_transparent_pixels = visible_pixels(image_array, max_pixels)
+
+  # Bin colours by their top `quantise_bits` bits per channel
+  quantised = (non_transparent_pixels >> (8 - quantise_bits)).astype(np.uint32)
+  bins = (quantised[:, 0] << (2 * quantise_bits)) | (quantised[:, 1] << quantise_bits) | quantised[:, 2]
+  counts = np.bincount(bins, minlength=1 << (3 * quantise_bits))
+  tied = np.flatnonzero(counts == counts.max())
+  top_bin = tied[0] if len(tied) == 1 else bins[np.flatnonzero(np.isin(bins, tied))[0]]
+
+  r, g, b = np.rint(non_transparent_pixels[bins == top_bin].mean(axis=0))
   # Return RGB
-  return output
+  return (int(r), int(g), int(b))
 
 def get_hex_colour(image_array: NDArray[Any]) -> str:
   """
@@ -243,31 +592,318 @@ def calculate_distance(colour1: tuple, colour2: tuple) -> float:
   
   return (sum((a - b) ** 2 for a, b in zip(colour1, colour2))) ** 0.5
 
-def match_colour(rgb: Tuple[int, int, int]) -> Dict[str, str]:
+def rgb_to_lab(rgb: NDArray[Any]) -> NDArray[np.float64]:
+  """
+  Convert sRGB colours to CIELAB (D65 white point).
+
+  :param rgb: Array of RGB values in 0-255, with the channels in the last axis.
+  :type rgb: NDArray[Any]
+  :return: The L*, a*, b* values, in the same shape as the input.
+  :rtype: NDArray[np.float64]
+  """
+  srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+  linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+
+  # Linear sRGB to XYZ, normalised by the D65 reference white
+  xyz = linear @ np.array([
+    [0.4124564, 0.2126729, 0.0193339],
+    [0.3575761, 0.7151522, 0.1191920],
+    [0.1804375, 0.0721750, 0.9503041],
+  ]) / np.array([0.95047, 1.0, 1.08883])
+
+  f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+  l = 116 * f[..., 1] - 16
+  a = 500 * (f[..., 0] - f[..., 1])
+  b = 200 * (f[..., 1] - f[..., 2])
+  return np.stack([l, a, b], axis=-1)
+
+def get_palette() -> Dict[str, Any]:
+  """
+  Load and return the colour map as arrays for vectorised matching.
+
+  The arrays are built once and rebuilt only when `COLOUR_MAP` has been changed.
+
+  :return: The colour names, hex codes, and RGB and CIELAB matrices of the colour map.
+  :rtype: Dict[str, Any]
+  """
+  global _palette
+  if _palette is None or _palette["colour_map"] != COLOUR_MAP:
+    colour_map = dict(COLOUR_MAP)
+    rgb = np.array([hex_to_rgb(hex_code) for hex_code in colour_map.values()], dtype=np.int64).reshape(-1, 3)
+    _palette = {
+      "colour_map": colour_map,
+      "names": list(colour_map.keys()),
+      "values": list(colour_map.values()),
+      "rgb": rgb,
+      "lab": rgb_to_lab(rgb),
+      "digest": hashlib.sha1(repr(sorted(colour_map.items())).encode()).hexdigest()[:12],
+    }
+  return _palette
+
+def _nearest_indices(colours: NDArray[np.float64], palette: Dict[str, Any], metric: str) -> NDArray[np.intp]:
+  if metric == "lab":
+    colours, targets = rgb_to_lab(colours), palette["lab"]
+  else:
+    targets = palette["rgb"]
+
+  # Squared distance from every colour to every palette entry in one operation
+  distances = ((colours[:, None, :] - targets[None, :, :]) ** 2).sum(axis=-1)
+  return distances.argmin(axis=1)
+
+def match_colours(rgbs: Any, metric: str = COLOUR_METRIC) -> List[Optional[Dict[str, str]]]:
+  """
+  Match several RGB colours to their closest colours in the colour map at once.
+
+  :param rgbs: A sequence or (n, 3) array of RGB values.
+  :type rgbs: Any
+  :param metric: "rgb" for Euclidean RGB distance or "lab" for CIELAB delta E (CIE76).
+  :type metric: str
+  :raise ValueError: If the colours are not RGB values or the metric is unknown.
+  :return: For each colour, a dictionary with the name and hex code of the closest match, or None if the colour map is empty.
+  :rtype: List[Optional[Dict[str, str]]]
+  """
+  if metric not in ("rgb", "lab"):
+    raise ValueError(f"Invalid colour metric: '{metric}'. Expected 'rgb' or 'lab'.")
+
+  try:
+    colours = np.asarray(rgbs, dtype=np.float64)
+  except (TypeError, ValueError):
+    raise ValueError(f"Invalid RGB values: {rgbs}")
+  if colours.ndim not in (1, 2) or colours.shape[-1] != 3:
+    raise ValueError(f"Invalid RGB values: {rgbs}")
+  colours = colours.reshape(-1, 3)
+
+  palette = get_palette()
+  if not palette["names"]:
+    return [None] * len(colours)
+
+  closest = _nearest_indices(colours, palette, metric)
+  return [{"name": palette["names"][i], "value": palette["values"][i]} for i in closest]
+
+def match_colour(rgb: Tuple[int, int, int], metric: str = COLOUR_METRIC) -> Dict[str, str]:
   """
   Match RGB colour to the closest in the colour map.
 
   :param rgb: The RGB tuple to match.
   :type rgb: Tuple[int, int, int]
+  :param metric: "rgb" for Euclidean RGB distance or "lab" for CIELAB delta E (CIE76).
+  :type metric: str
+  :raise ValueError: If the input is not an RGB value or the metric is unknown.
   :return: A dictionary containing the name and hex code of the closest matching colour.
   :rtype: Dict[str, str]
   """
+  if np.ndim(rgb) != 1:
+    raise ValueError(f"Invalid RGB tuple: {rgb}")
+  return match_colours(rgb, metric)[0]
 
-  closest_colour = None
-  smallest_distance = float('inf')
-  
-  for colour_name, hex_code in COLOUR_MAP.items():
-    colour_rgb = hex_to_rgb(hex_code)
-    distance = calculate_distance(rgb, colour_rgb)
-    
-    if distance < smallest_distance:
-      smallest_distance = distance
-      closest_colour = {
-        "name": colour_name,
-        "value": hex_code
-      }
-  
-  return closest_colour
+def _build_lookup_table(bits: int, palette: Dict[str, Any], metric: str) -> NDArray[Any]:
+  # Match the centre of every quantised RGB cell, in chunks to bound memory
+  levels = (np.arange(1 << bits) << (8 - bits)) + ((1 << (8 - bits)) >> 1)
+  r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+  centres = np.stack([r.ravel(), g.ravel(), b.ravel()], axis=1).astype(np.float64)
+
+  dtype = np.uint8 if len(palette["names"]) <= 256 else np.uint16
+  table = np.empty(len(centres), dtype=dtype)
+  for start in range(0, len(centres), 1 << 15):
+    table[start:start + (1 << 15)] = _nearest_indices(centres[start:start + (1 << 15)], palette, metric)
+  return table
+
+def get_lookup_table(bits: int = 6, metric: str = COLOUR_METRIC, directory: Optional[str] = COLOUR_LOOKUP_DIR) -> NDArray[Any]:
+  """
+  Load and return a table mapping quantised RGB values to colour map indices.
+
+  The table has an entry for every RGB value with `bits` bits per channel and
+  is built on first use. With a `directory`, the built table is saved there
+  and later loads memory-map it instead of building it again.
+
+  :param bits: Bits kept per channel, between 1 and 8.
+  :type bits: int
+  :param metric: "rgb" for Euclidean RGB distance or "lab" for CIELAB delta E (CIE76).
+  :type metric: str
+  :param directory: Directory to save and memory-map tables in, or None to keep them in memory only.
+  :type directory: str | None
+  :raise ValueError: If the bits or metric are invalid, or the colour map is empty.
+  :return: The palette index for each quantised colour, indexed by `(r << 2 * bits) | (g << bits) | b`.
+  :rtype: NDArray[Any]
+  """
+  if not 1 <= bits <= 8:
+    raise ValueError(f"Invalid lookup table bits: {bits}. Expected a value between 1 and 8.")
+  if metric not in ("rgb", "lab"):
+    raise ValueError(f"Invalid colour metric: '{metric}'. Expected 'rgb' or 'lab'.")
+
+  palette = get_palette()
+  if not palette["names"]:
+    raise ValueError("The colour map is empty.")
+
+  key = (bits, metric, palette["digest"])
+  if key not in _lookup_tables:
+    path = os.path.join(directory, f"colour_lut_{metric}_{bits}_{palette['digest']}.npy") if directory else None
+    if path and os.path.exists(path):
+      table = np.load(path, mmap_mode="r")
+    else:
+      table = _build_lookup_table(bits, palette, metric)
+      if path:
+        # Write to a temporary file first so other processes never load a partial table
+        os.makedirs(directory, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+          np.save(f, table)
+        os.replace(temp_path, path)
+    _lookup_tables[key] = table
+  return _lookup_tables[key]
+
+def lookup_indices(rgbs: NDArray[Any], bits: int = 6, metric: str = COLOUR_METRIC) -> NDArray[Any]:
+  """
+  Map RGB values to colour map indices through the lookup table.
+
+  :param rgbs: Array of RGB values in 0-255, with the channels in the last axis.
+  :type rgbs: NDArray[Any]
+  :param bits: Bits kept per channel.
+  :type bits: int
+  :param metric: "rgb" or "lab".
+  :type metric: str
+  :return: The palette index of each colour, in the shape of the input without the channel axis.
+  :rtype: NDArray[Any]
+  """
+  table = get_lookup_table(bits, metric)
+  quantised = np.asarray(rgbs, dtype=np.uint8) >> (8 - bits)
+  index = quantised[..., 0].astype(np.uint32) << (2 * bits)
+  index |= quantised[..., 1].astype(np.uint32) << bits
+  index |= quantised[..., 2]
+  return table[index]
+
+def lookup_colour(rgb: Tuple[int, int, int], bits: int = 6, metric: str = COLOUR_METRIC) -> Dict[str, str]:
+  """
+  Match RGB colour to the colour map through the lookup table.
+
+  :param rgb: The RGB tuple to match.
+  :type rgb: Tuple[int, int, int]
+  :param bits: Bits kept per channel.
+  :type bits: int
+  :param metric: "rgb" or "lab".
+  :type metric: str
+  :raise ValueError: If the input is not an RGB value.
+  :return: A dictionary containing the name and hex code of the closest matching colour.
+  :rtype: Dict[str, str]
+  """
+  if np.shape(rgb) != (3,):
+    raise ValueError(f"Invalid RGB tuple: {rgb}")
+  palette = get_palette()
+  index = int(lookup_indices(np.array(rgb), bits, metric))
+  return {"name": palette["names"][index], "value": palette["values"][index]}
+
+def colour_histogram(image_array: NDArray[Any], bits: int = 6, metric: str = COLOUR_METRIC, max_pixels: int = 0) -> List[Dict[str, Any]]:
+  """
+  Count how much of the visible garment falls on each colour in the colour map.
+
+  :param image_array: The input NumPy image array, RGBA.
+  :type image_array: NDArray[Any]
+  :param bits: Bits kept per channel in the lookup table.
+  :type bits: int
+  :param metric: "rgb" or "lab".
+  :type metric: str
+  :param max_pixels: Sample at most this many pixels, or 0 to use them all.
+  :type max_pixels: int
+  :raise ValueError: If no visible pixels are found or the input is invalid.
+  :return: The name, hex code and coverage fraction of each colour present, most common first.
+  :rtype: List[Dict[str, Any]]
+  """
+  pixels = visible_pixels(image_array, max_pixels)
+  palette = get_palette()
+  counts = np.bincount(lookup_indices(pixels, bits, metric), minlength=len(palette["names"]))
+
+  return [
+    {"name": palette["names"][i], "value": palette["values"][i], "coverage": float(counts[i] / len(pixels))}
+    for i in np.argsort(-counts, kind="stable") if counts[i]
+  ]
+
+def _init_centres(pixels: NDArray[np.float32], k: int, rng: np.random.Generator) -> NDArray[np.float32]:
+  # k-means++: pick each new centre with probability proportional to its squared distance
+  centres = [pixels[rng.integers(len(pixels))]]
+  distances = ((pixels - centres[0]) ** 2).sum(axis=1)
+  for _ in range(1, k):
+    total = distances.sum()
+    if total == 0:
+      # Fewer distinct colours than clusters
+      break
+    centres.append(pixels[rng.choice(len(pixels), p=distances / total)])
+    distances = np.minimum(distances, ((pixels - centres[-1]) ** 2).sum(axis=1))
+  return np.array(centres, dtype=np.float32)
+
+def _assign(pixels: NDArray[np.float32], centres: NDArray[np.float32]) -> NDArray[np.intp]:
+  return ((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=-1).argmin(axis=1)
+
+def extract_palette(
+  image_array: NDArray[Any],
+  k: int = 5,
+  sample_size: int = COLOUR_PALETTE_SAMPLE,
+  batch_size: int = 1024,
+  max_iter: int = 100,
+  time_budget: float = COLOUR_PALETTE_BUDGET,
+  seed: int = 0,
+) -> List[Dict[str, Any]]:
+  """
+  Find the main colours of a garment with mini-batch k-means over its visible pixels.
+
+  At most `sample_size` pixels are clustered and updates stop once `max_iter`
+  batches have run, the centres settle, or `time_budget` seconds have passed,
+  so the cost does not grow with the image size.
+
+  :param image_array: The input NumPy image array, RGBA.
+  :type image_array: NDArray[Any]
+  :param k: The maximum number of palette colours.
+  :type k: int
+  :param sample_size: The maximum number of visible pixels to cluster.
+  :type sample_size: int
+  :param batch_size: Pixels per mini-batch update.
+  :type batch_size: int
+  :param max_iter: The maximum number of mini-batch updates.
+  :type max_iter: int
+  :param time_budget: Seconds after which no further updates are made.
+  :type time_budget: float
+  :param seed: Seed for sampling, so the same image gives the same palette.
+  :type seed: int
+  :raise ValueError: If `k` is not positive, no visible pixels are found or the input is invalid.
+  :return: For each cluster, most coverage first, the closest colour map name and hex code,
+    the cluster's own hex colour and the fraction of the garment it covers.
+  :rtype: List[Dict[str, Any]]
+  """
+  if k < 1:
+    raise ValueError(f"Invalid palette size: {k}. Expected a positive integer.")
+
+  deadline = time.perf_counter() + time_budget
+  rng = np.random.default_rng(seed)
+  pixels = visible_pixels(image_array, sample_size, rng).astype(np.float32)
+
+  centres = _init_centres(pixels, k, rng)
+  counts = np.zeros(len(centres))
+  for _ in range(max_iter):
+    if time.perf_counter() >= deadline:
+      break
+
+    batch = pixels[rng.integers(len(pixels), size=min(batch_size, len(pixels)))]
+    labels = _assign(batch, centres)
+    batch_counts = np.bincount(labels, minlength=len(centres))
+    sums = np.stack([np.bincount(labels, weights=batch[:, c], minlength=len(centres)) for c in range(3)], axis=1)
+
+    # Move each centre towards its batch mean, by less as it sees more pixels
+    seen = batch_counts > 0
+    counts += batch_counts
+    rate = (batch_counts[seen] / counts[seen])[:, None]
+    previous = centres.copy()
+    centres[seen] += rate * (sums[seen] / batch_counts[seen][:, None] - centres[seen])
+
+    if np.abs(centres - previous).max() < 0.5:
+      break
+
+  coverage = np.bincount(_assign(pixels, centres), minlength=len(centres)) / len(pixels)
+  order = [i for i in np.argsort(-coverage, kind="stable") if coverage[i] > 0]
+  rgbs = [tuple(int(c) for c in np.clip(np.rint(centres[i]), 0, 255)) for i in order]
+
+  return [
+    {**match, "hex": rgb_to_hex(rgb), "coverage": float(coverage[i])}
+    for i, rgb, match in zip(order, rgbs, match_colours(rgbs))
+  ]
 
 def get_colour(image_array: NDArray[Any]) -> Dict[str, str]:
   """
@@ -278,5 +914,7 @@ def get_colour(image_array: NDArray[Any]) -> Dict[str, str]:
   :return: A dictionary containing the name and hex code of the closest matching colour.
   :rtype: Dict[str, str]
   """
-  dominant_rgb = get_rgb_colour(image_array)
+  dominant_rgb = get_rgb_colour(image_array, COLOUR_MAX_PIXELS, COLOUR_QUANTISE_BITS)
+  if COLOUR_LOOKUP_BITS:
+    return lookup_colour(dominant_rgb, COLOUR_LOOKUP_BITS)
   return match_colour(dominant_rgb)
\ No newline at end of file
@@ -0,0 +1,145 @@
+from typing import Any, Callable, Dict, Optional
+from clothing_processor.utils.executor import get_executor
+from clothing_processor.utils.predictions import load_classifier
+from clothing_processor.utils.image import warm_up_rembg
+import asyncio
+import time
+import os
+
+# Load the models in the background after startup instead of before it ("1" to enable);
+# the server answers readiness checks straight away and uploads wait for the models
+BACKGROUND_MODEL_LOADING = (os.getenv("BACKGROUND_MODEL_LOADING") or "0") == "1"
+
+# Cache the model loader
+_model_loader = None
+
+
+class _Model:
+  """One model, its loading state and the run loading it."""
+
+  def __init__(self, name: str, load: Callable[[], Any]):
+    self.name = name
+    self.load = load
+    self.state = "pending"
+    self.error: Optional[str] = None
+    self.load_seconds: Optional[float] = None
+    self.task: Optional[asyncio.Task] = None
+
+
+class ModelLoader:
+  """
+  Loads models off the event loop, once each.
+
+  Every caller asking for a model that is still loading waits on the same
+  run. A failed load is reported by `status()` and tried again by the next
+  caller.
+  """
+
+  def __init__(self, loaders: Dict[str, Callable[[], Any]]):
+    """
+    :param loaders: Function loading each model and returning it, by model name.
+    :type loaders: Dict[str, Callable[[], Any]]
+    """
+    self._models = {name: _Model(name, load) for name, load in loaders.items()}
+
+  def start(self):
+    """Start loading every model that isn't loaded or loading yet. Must be called from the event loop."""
+    for model in self._models.values():
+      self._load(model)
+
+  def _load(self, model: _Model) -> asyncio.Task:
+    if model.task is None:
+      model.state = "loading"
+      model.error = None
+      model.task = asyncio.ensure_future(self._run(model))
+      # Failures are reported by status(), whether or not a request was waiting
+      model.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return model.task
+
+  async def _run(self, model: _Model) -> Any:
+    started = time.perf_counter()
+    try:
+      value = await get_executor().run_io(model.load)
+    except Exception as e:
+      model.state = "failed"
+      model.error = str(e)
+      # Let the next caller try again
+      model.task = None
+      print(f"Warning: Couldn't load the {model.name} model: {e}")
+      raise
+
+    model.state = "ready"
+    model.load_seconds = time.perf_counter() - started
+    return value
+
+  async def get(self, name: str) -> Any:
+    """
+    Return a model, waiting for it to load if needed.
+
+    :param name: The model name.
+    :type name: str
+    :raise ValueError: If the model is unknown or fails to load.
+    :return: The loaded model.
+    :rtype: Any
+    """
+    model = self._models.get(name)
+    if model is None:
+      raise ValueError(f"Unknown model: '{name}'.")
+
+    # Shield the shared run so one client disconnecting doesn't cancel it for the others
+    return await asyncio.shield(self._load(model))
+
+  async def wait(self):
+    """
+    Load every model and wait until all of them are ready.
+
+    :raise ValueError: If a model fails to load.
+    :return: None
+    :rtype: None
+    """
+    await asyncio.gather(*(self.get(name) for name in self._models))
+
+  def ready(self) -> bool:
+    """
+    Return whether every model is loaded.
+
+    :return: True once every model is ready.
+    :rtype: bool
+    """
+    return all(model.state == "ready" for model in self._models.values())
+
+  def status(self) -> Dict[str, Any]:
+    """
+    Return the loading state of every model.
+
+    :return: Overall readiness and, per model, its state ("pending", "loading", "ready" or "failed"),
+      the last error and how long loading took.
+    :rtype: Dict[str, Any]
+    """
+    return {
+      "ready": self.ready(),
+      "models": {
+        name: {
+          "state": model.state,
+          "error": model.error,
+          "load_seconds": model.load_seconds,
+        }
+        for name, model in self._models.items()
+      },
+    }
+
+
+def get_model_loader() -> ModelLoader:
+  """
+  Load and return the model loader for the clothing classifier and the background removal model.
+
+  :return: The shared model loader.
+  :rtype: ModelLoader
+  """
+  global _model_loader
+  if _model_loader is None:
+    _model_loader = ModelLoader({
+      "classifier": load_classifier,
+      "rembg": warm_up_rembg,
+    })
+  return _model_loader
@@ -0,0 +1,288 @@
+from typing import Any, Dict, List, Optional, Union
+import asyncio
+import time
+import os
+from fastapi import UploadFile
+from clothing_processor.utils.files import read_upload, open_image
+from clothing_processor.utils.image import remove_background, preprocess_image, get_colour, extract_palette, IMAGE_MAX_SIZE
+from clothing_processor.utils.batcher import get_batcher
+from clothing_processor.utils.s3 import s3_upload, thumbnail_sizes, thumbnail_urls
+from clothing_processor.utils.upload_queue import get_upload_queue
+from clothing_processor.utils.executor import get_executor
+from clothing_processor.utils.result_cache import get_result_cache, content_digest, result_key
+from clothing_processor.utils.timing import Trace, span, timed
+
+# Maximum number of images accepted in one batch request
+MAX_BATCH_SIZE = 50
+# Maximum number of colours that can be requested in an image's palette
+MAX_PALETTE_SIZE = 10
+# Respond before the S3 upload finishes and leave it to the upload queue ("1" to enable)
+BACKGROUND_UPLOADS = (os.getenv("BACKGROUND_UPLOADS") or "0") == "1"
+
+
+def prepare_image(content: bytes, max_size: int = 0, palette_size: int = 0, with_spans: bool = False) -> Dict[str, Any]:
+  """
+  Run the per-image stages that come before inference.
+
+  The upload is opened and decoded here rather than by the caller, so with a
+  process pool only its compressed bytes are sent to the worker and the
+  decode doesn't run on the event loop.
+
+  :param content: The content of the uploaded file.
+  :type content: bytes
+  :param max_size: If positive, the longest side the image will be scaled down to, see `open_image`.
+  :type max_size: int
+  :param palette_size: If positive, also extract a palette of up to this many colours.
+  :type palette_size: int
+  :param with_spans: If True, also return the duration and size of each stage.
+  :type with_spans: bool
+  :raise UploadTooLargeError: If the image has too many pixels.
+  :raise ValueError: If the content is not a readable image or any stage fails.
+  :return: The background-removed image, the model input, the dominant colour, if requested,
+    the palette and, if `with_spans`, the stage spans.
+  :rtype: Dict[str, Any]
+  """
+  # Spans are collected here and sent back with the result, since this may run in a worker process
+  trace = Trace() if with_spans else None
+
+  with span(trace, "decode") as decode:
+    content_image = open_image(content, max_size)
+    content_image.load()
+    decode.size = content_image.width * content_image.height * len(content_image.getbands())
+
+  # Remove image background; the decoded image goes straight in, and the cleaned
+  # array and image share one buffer that the later stages only read
+  with span(trace, "remove_background") as removal:
+    array_bg_removed, image_bg_removed = remove_background(content_image)
+    removal.size = array_bg_removed.nbytes
+
+  prepared = {"image": image_bg_removed}
+  with span(trace, "preprocess_image"):
+    prepared["model_input"] = preprocess_image(image_bg_removed)
+  with span(trace, "get_colour", array_bg_removed.nbytes):
+    prepared["colour"] = get_colour(array_bg_removed)
+  if palette_size > 0:
+    with span(trace, "extract_palette", array_bg_removed.nbytes):
+      prepared["palette"] = extract_palette(array_bg_removed, palette_size)
+
+  if trace is not None:
+    prepared["spans"] = trace.spans
+  return prepared
+
+
+async def _prepare(content: bytes, palette_size: int, trace: Optional[Trace]) -> Dict[str, Any]:
+  executor = get_executor()
+
+  # Wait for a free pipeline slot so CPU-heavy work is bounded per worker
+  waiting = time.perf_counter()
+  async with executor.limit():
+    if trace is not None:
+      trace.add("wait_for_slot", time.perf_counter() - waiting)
+
+    # Decode, remove background, preprocess for model (convert 28x28, greyscale, etc.)
+    # and get dominant colour on the CPU pool
+    prepared = await executor.run_cpu(prepare_image, content, IMAGE_MAX_SIZE, palette_size, trace is not None)
+  if trace is not None:
+    trace.extend(prepared.pop("spans"))
+  return prepared
+
+
+async def _store(prepared: Dict[str, Any], digest: str, predicted_class: str, trace: Optional[Trace]) -> Dict[str, Any]:
+  if BACKGROUND_UPLOADS:
+    s3_url = await timed(trace, "upload_queue", get_upload_queue().put(prepared["image"], digest, trace))
+  else:
+    s3_url = await timed(trace, "s3_upload", get_executor().run_io(s3_upload, prepared["image"], digest, trace))
+
+  result = {
+    "class": predicted_class,
+    "colour": prepared["colour"],
+    "image_url": s3_url,
+  }
+  if thumbnail_sizes():
+    result["thumbnail_urls"] = thumbnail_urls(s3_url)
+  if "palette" in prepared:
+    result["palette"] = prepared["palette"]
+  return result
+
+
+async def run_pipeline(model: Any, content: bytes, digest: str, palette_size: int = 0, trace: Optional[Trace] = None) -> Dict[str, Any]:
+  """
+  Run every stage of the pipeline for one image.
+
+  The CPU-heavy stages wait for a free slot of the executor. Inference is
+  batched with other images by the inference batcher. With `BACKGROUND_UPLOADS`
+  the image is handed to the upload queue and the result is returned before it is stored.
+
+  :param model: The loaded TensorFlow model.
+  :type model: tf.keras.Model
+  :param content: The content of the uploaded file.
+  :type content: bytes
+  :param digest: The content hash, which the stored image is named after.
+  :type digest: str
+  :param palette_size: If positive, also return a palette of up to this many colours.
+  :type palette_size: int
+  :param trace: The request's trace to time each stage in, or None.
+  :type trace: Trace | None
+  :raise ValueError: If the image is invalid or any stage fails.
+  :return: The predicted class, dominant colour, image URL, thumbnail URLs if configured and, if requested, the palette.
+  :rtype: Dict[str, Any]
+  """
+  prepared = await _prepare(content, palette_size, trace)
+
+  # Make predictions together with other images arriving at the same time;
+  # the slot is released first so waiting images can join the batch
+  predicted_class = await timed(trace, "predict_class", get_batcher(model).predict(prepared["model_input"]))
+
+  return await _store(prepared, digest, predicted_class, trace)
+
+
+async def run_batch_pipeline(model: Any, contents: List[bytes], digests: List[str], palette_size: int = 0, trace: Optional[Trace] = None) -> List[Union[Dict[str, Any], Exception]]:
+  """
+  Run every stage of the pipeline for several images, classifying them in one model call.
+
+  Each image is prepared in its own executor slot, like `run_pipeline`. Once
+  all of them are prepared, the ones that succeeded are classified together
+  and then stored. The images are timed apart and added to `trace` with
+  `Trace.extend_longest`, so their overlapping stages aren't summed.
+
+  :param model: The loaded TensorFlow model.
+  :type model: tf.keras.Model
+  :param contents: The content of each uploaded file.
+  :type contents: List[bytes]
+  :param digests: The content hash of each file, which its stored image is named after.
+  :type digests: List[str]
+  :param palette_size: If positive, also return a palette of up to this many colours for each image.
+  :type palette_size: int
+  :param trace: The request's trace to time each stage in, or None.
+  :type trace: Trace | None
+  :return: For each image, in order, its result as from `run_pipeline` or the exception that stopped it.
+  :rtype: List[Dict[str, Any] | Exception]
+  """
+  traces = [Trace() if trace is not None else None for _ in contents]
+  try:
+    outcomes = list(await asyncio.gather(
+      *(_prepare(content, palette_size, image_trace) for content, image_trace in zip(contents, traces)),
+      return_exceptions=True,
+    ))
+
+    prepared = [i for i, outcome in enumerate(outcomes) if not isinstance(outcome, BaseException)]
+    if not prepared:
+      return outcomes
+
+    try:
+      # One model call for the whole batch, so it is timed once
+      labels = await timed(trace, "predict_class", get_batcher(model).predict_batch([outcomes[i]["model_input"] for i in prepared]))
+    except Exception as e:
+      for i in prepared:
+        outcomes[i] = e
+      return outcomes
+
+    stored = await asyncio.gather(
+      *(_store(outcomes[i], digests[i], label, traces[i]) for i, label in zip(prepared, labels)),
+      return_exceptions=True,
+    )
+    for i, outcome in zip(prepared, stored):
+      outcomes[i] = outcome
+    return outcomes
+  finally:
+    if trace is not None:
+      trace.extend_longest(traces)
+
+
+async def process_upload(model: Any, upload_file: UploadFile, palette_size: int = 0, trace: Optional[Trace] = None) -> Dict[str, Any]:
+  """
+  Process one upload, reusing the earlier result if the same image was processed before.
+
+  Identical uploads arriving at the same time, through either endpoint, share
+  one run of the pipeline, see `run_pipeline`.
+
+  :param model: The loaded TensorFlow model.
+  :type model: tf.keras.Model
+  :param upload_file: The uploaded image file.
+  :type upload_file: UploadFile
+  :param palette_size: If positive, also return a palette of up to this many colours.
+  :type palette_size: int
+  :param trace: The request's trace to time each stage in, or None.
+  :type trace: Trace | None
+  :raise ValueError: If the file is invalid or any stage fails.
+  :return: The predicted class, dominant colour, image URL, thumbnail URLs if configured and, if requested, the palette.
+  :rtype: Dict[str, Any]
+  """
+  with span(trace, "read") as read:
+    content = await read_upload(upload_file)
+    read.size = len(content)
+  digest = content_digest(content)
+
+  return await get_result_cache().get_or_compute(
+    result_key(digest, palette_size),
+    lambda: run_pipeline(model, content, digest, palette_size, trace),
+  )
+
+
+async def process_batch(model: Any, upload_files: List[UploadFile], palette_size: int = 0, trace: Optional[Trace] = None) -> List[Dict[str, Any]]:
+  """
+  Process several uploads, each like `process_upload`.
+
+  Every image takes its own pipeline slot, so a batch is admitted at the same
+  rate as single uploads rather than queueing all of its images at once.
+  The images that aren't cached are classified together in one model call,
+  see `run_batch_pipeline`. A failure only affects the file it happened on;
+  its result carries an `error` instead.
+
+  :param model: The loaded TensorFlow model.
+  :type model: tf.keras.Model
+  :param upload_files: The uploaded image files.
+  :type upload_files: List[UploadFile]
+  :param palette_size: If positive, also return a palette of up to this many colours for each image.
+  :type palette_size: int
+  :param trace: The request's trace to time the batch's stages in, or None. Each stage is
+    reported once, as the longest time any image spent in it.
+  :type trace: Trace | None
+  :return: One result per file, in upload order, with the class, colour and image URL or an error.
+  :rtype: List[Dict[str, Any]]
+  """
+  async def read(upload_file: UploadFile, read_trace: Optional[Trace]) -> bytes:
+    with span(read_trace, "read") as read_span:
+      content = await read_upload(upload_file)
+      read_span.size = len(content)
+    return content
+
+  read_traces = [Trace() if trace is not None else None for _ in upload_files]
+  outcomes = list(await asyncio.gather(
+    *(read(upload_file, read_trace) for upload_file, read_trace in zip(upload_files, read_traces)),
+    return_exceptions=True,
+  ))
+  if trace is not None:
+    trace.extend_longest(read_traces)
+
+  # Identical files share one run, so each key maps to the content it was read from
+  contents: Dict[str, bytes] = {}
+  digests: Dict[str, str] = {}
+  keys: Dict[int, str] = {}
+  for i, outcome in enumerate(outcomes):
+    if not isinstance(outcome, BaseException):
+      digest = content_digest(outcome)
+      keys[i] = result_key(digest, palette_size)
+      contents[keys[i]] = outcome
+      digests[keys[i]] = digest
+
+  def compute(missing: List[str]):
+    return run_batch_pipeline(
+      model,
+      [contents[key] for key in missing],
+      [digests[key] for key in missing],
+      palette_size,
+      trace,
+    )
+
+  computed = await get_result_cache().get_or_compute_many(list(keys.values()), compute)
+  for i, outcome in zip(keys, computed):
+    outcomes[i] = outcome
+
+  results = []
+  for upload_file, outcome in zip(upload_files, outcomes):
+    if isinstance(outcome, Exception):
+      results.append({"filename": upload_file.filename, "error": f"Couldn't process image: {str(outcome)}"})
+    else:
+      results.append({"filename": upload_file.filename, **outcome})
+  return results
@@ -1,15 +1,69 @@
-import tensorflow as tf
+from __future__ import annotations
 import numpy as np
 from numpy.typing import NDArray
-from typing import Any
+from typing import Any, Dict, List
+from shared_utils.lazy import lazy_import
+import hashlib
 import os
 
+# Imported on first use, so the ONNX backends never load TensorFlow
+tf = lazy_import("tensorflow")
+
 # Define class names for the Fashion MNIST model
 class_names = [
   'T-shirt/top', 'Trouser', 'Pullover', 'Dress', 'Coat',
   'Sandal', 'Shirt', 'Sneaker', 'Bag', 'Ankle boot'
 ]
 
+# The trained model and its ONNX exports (written by the convert-model script)
+KERAS_MODEL_PATH = "clothing_processor/data/models/fashion_mnist_model.h5"
+ONNX_MODEL_PATH = "clothing_processor/data/models/fashion_mnist_model.onnx"
+ONNX_INT8_MODEL_PATH = "clothing_processor/data/models/fashion_mnist_model.int8.onnx"
+
+# How predictions are run: "function" (traced graph function), "keras" (model.predict),
+# or "onnx" / "onnx-int8" (ONNX Runtime, without TensorFlow)
+INFERENCE_BACKENDS = ("function", "keras", "onnx", "onnx-int8")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND") or "function"
+
+# Cache the model file hashes
+_model_hashes: Dict[str, str] = {}
+
+
+def model_path(backend: str = INFERENCE_BACKEND) -> str:
+  """
+  Return the model file the given inference backend loads.
+
+  :param backend: One of "function", "keras", "onnx" or "onnx-int8".
+  :type backend: str
+  :return: The path of the model file.
+  :rtype: str
+  """
+  if backend == "onnx-int8":
+    return ONNX_INT8_MODEL_PATH
+  if backend == "onnx":
+    return ONNX_MODEL_PATH
+  return KERAS_MODEL_PATH
+
+def model_hash(backend: str = INFERENCE_BACKEND) -> str:
+  """
+  Hash the model file the given inference backend loads, so a retrained or re-exported model can be told apart.
+
+  :param backend: One of "function", "keras", "onnx" or "onnx-int8".
+  :type backend: str
+  :return: The SHA-256 hex digest of the model file, or "missing" if it can't be read.
+  :rtype: str
+  """
+  path = model_path(backend)
+  if path not in _model_hashes:
+    digest = hashlib.sha256()
+    try:
+      with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+          digest.update(chunk)
+      _model_hashes[path] = digest.hexdigest()
+    except OSError:
+      return "missing"
+  return _model_hashes[path]
 
 def load_model() -> tf.keras.Model:
   """
@@ -22,16 +76,136 @@ def load_model() -> tf.keras.Model:
   try:
     import os
     os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
-    return tf.keras.models.load_model('clothing_processor/data/models/fashion_mnist_model.h5')
+    return tf.keras.models.load_model(KERAS_MODEL_PATH)
   except Exception as e:
     raise ValueError(f"Failed to load model: {e}")
 
+class CompiledModel:
+  """
+  A Keras model traced once into a graph function with a fixed input signature.
+
+  Calling the concrete function skips the per-call setup of `model.predict`
+  (data adapters, callbacks, step functions), which dominates for the few
+  small images of a request. Only the batch size may vary, so the function is
+  never retraced. Exposes `predict` like the Keras model it wraps.
+  """
+
+  def __init__(self, model: tf.keras.Model):
+    """
+    :param model: The loaded TensorFlow model.
+    :type model: tf.keras.Model
+    """
+    self.model = model
+    self.input_shape = (None, *model.input_shape[1:])
+    signature = tf.TensorSpec(self.input_shape, tf.float32)
+    self._function = tf.function(lambda images: model(images, training=False)).get_concrete_function(signature)
+
+  def predict(self, images: NDArray[Any]) -> NDArray[Any]:
+    """
+    Run the model on a batch of preprocessed images.
+
+    :param images: The preprocessed images stacked along the first axis.
+    :type images: NDArray[Any]
+    :return: The class probabilities of each image.
+    :rtype: NDArray[Any]
+    """
+    return self._function(tf.convert_to_tensor(images, tf.float32)).numpy()
+
+  def warm_up(self):
+    """Run the function once so the first request doesn't pay for its first execution."""
+    self.predict(np.zeros((1, *self.input_shape[1:]), dtype=np.float32))
+
+class OnnxModel:
+  """
+  The classifier exported to ONNX, run with ONNX Runtime instead of TensorFlow.
+
+  Exposes `predict` like the Keras model it was converted from.
+  """
+
+  def __init__(self, path: str):
+    """
+    :param path: Path to the ONNX model.
+    :type path: str
+    """
+    import onnxruntime as ort
+
+    self.path = path
+    self._session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    model_input = self._session.get_inputs()[0]
+    self._input_name = model_input.name
+    self.input_shape = (None, *model_input.shape[1:])
+
+  def predict(self, images: NDArray[Any]) -> NDArray[Any]:
+    """
+    Run the model on a batch of preprocessed images.
+
+    :param images: The preprocessed images stacked along the first axis.
+    :type images: NDArray[Any]
+    :return: The class probabilities of each image.
+    :rtype: NDArray[Any]
+    """
+    return self._session.run(None, {self._input_name: np.asarray(images, dtype=np.float32)})[0]
+
+  def warm_up(self):
+    """Run the model once so the first request doesn't pay for its first execution."""
+    self.predict(np.zeros((1, *self.input_shape[1:]), dtype=np.float32))
+
+def compile_model(model: tf.keras.Model, backend: str = INFERENCE_BACKEND) -> Any:
+  """
+  Prepare a loaded Keras model for serving with the given TensorFlow backend.
+
+  :param model: The loaded TensorFlow model.
+  :type model: tf.keras.Model
+  :param backend: "function" to trace the model into a warmed graph function, or "keras" to keep `model.predict`.
+  :type backend: str
+  :raise ValueError: If the backend is not a TensorFlow backend or the model can't be traced.
+  :return: An object with a `predict` method taking a batch of preprocessed images.
+  :rtype: CompiledModel | tf.keras.Model
+  """
+  if backend not in ("function", "keras"):
+    raise ValueError(f"Invalid TensorFlow inference backend: '{backend}'. Expected function or keras.")
+
+  if backend == "keras":
+    return model
+
+  try:
+    compiled = CompiledModel(model)
+    compiled.warm_up()
+    return compiled
+  except Exception as e:
+    raise ValueError(f"Failed to compile model: {e}")
+
+def load_classifier(backend: str = INFERENCE_BACKEND) -> Any:
+  """
+  Load the clothing classifier for the given inference backend, warmed up and ready to serve.
+
+  The ONNX backends read the exported model and never import TensorFlow.
+
+  :param backend: One of "function", "keras", "onnx" or "onnx-int8".
+  :type backend: str
+  :raise ValueError: If the backend is unknown or the model fails to load.
+  :return: An object with a `predict` method taking a batch of preprocessed images.
+  :rtype: CompiledModel | OnnxModel | tf.keras.Model
+  """
+  if backend not in INFERENCE_BACKENDS:
+    raise ValueError(f"Invalid inference backend: '{backend}'. Expected one of {', '.join(INFERENCE_BACKENDS)}.")
+
+  if backend in ("onnx", "onnx-int8"):
+    try:
+      model = OnnxModel(model_path(backend))
+      model.warm_up()
+      return model
+    except Exception as e:
+      raise ValueError(f"Failed to load model: {e}")
+
+  return compile_model(load_model(), backend)
+
 def predict_class(model: tf.keras.Model, image: NDArray[Any]) -> str:
   """
   Predict the class of a preprocessed image using the given model.
 
-  :param model: The pre-trained TensorFlow model to use for prediction.
-  :type model: tf.keras.Model
+  :param model: The pre-trained TensorFlow model to use for prediction, or its compiled or ONNX form.
+  :type model: tf.keras.Model | CompiledModel | OnnxModel
   :param image: The preprocessed image to predict, in the form of a numpy array.
   :type image: NDArray[Any]
   :raise ValueError: If the input image is not a valid numpy array or if the prediction fails.
@@ -46,4 +220,26 @@ def predict_class(model: tf.keras.Model, image: NDArray[Any]) -> str:
     predicted_label = np.argmax(predictions)
     return class_names[predicted_label]
   except Exception as e:
-    raise ValueError(f"Error during prediction: {e}")
\ No newline at end of file
+    raise ValueError(f"Error during prediction: {e}")
+
+def predict_classes(model: tf.keras.Model, images: NDArray[Any]) -> List[str]:
+  """
+  Predict the classes of a batch of preprocessed images in a single model call.
+
+  :param model: The pre-trained TensorFlow model to use for prediction, or its compiled or ONNX form.
+  :type model: tf.keras.Model | CompiledModel | OnnxModel
+  :param images: The preprocessed images stacked along the first axis, shape (N, 28, 28, 1).
+  :type images: NDArray[Any]
+  :raise ValueError: If the input is not a batch of images or if the prediction fails.
+  :return: The predicted class label of each image, in input order.
+  :rtype: List[str]
+  """
+  if images is None or not isinstance(images, np.ndarray) or images.ndim != 4:
+    raise ValueError("Input images must be a numpy array of shape (N, 28, 28, 1).")
+
+  try:
+    predictions = model.predict(images)
+    predicted_labels = np.argmax(predictions, axis=-1)
+    return [class_names[label] for label in predicted_labels]
+  except Exception as e:
+    raise ValueError(f"Error during prediction: {e}")
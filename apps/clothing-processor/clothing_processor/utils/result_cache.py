@@ -0,0 +1,347 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from shared_utils.cache import LRUCache
+from clothing_processor.utils import image
+from clothing_processor.utils import predictions
+import hashlib
+import asyncio
+import json
+import os
+
+# Bump when a pipeline change should stop earlier results from being reused
+PIPELINE_VERSION = os.getenv("PIPELINE_VERSION") or "1"
+# Number of results kept in memory (0 = no caching)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE") or 1024)
+# Optional directory to also keep results in, so they survive restarts
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR") or None
+
+# Cache the result cache
+_result_cache = None
+
+
+def pipeline_fingerprint() -> str:
+  """
+  Describe the pipeline version and the settings that change its output.
+
+  :return: The version followed by the inference backend and model file hash and
+    the background removal, colour and output settings.
+  :rtype: str
+  """
+  return ":".join(str(part) for part in (
+    PIPELINE_VERSION,
+    predictions.INFERENCE_BACKEND,
+    predictions.model_hash(predictions.INFERENCE_BACKEND),
+    image.REMBG_MODEL,
+    image.REMBG_MASK_SIZE,
+    image.IMAGE_MAX_SIZE,
+    image.COLOUR_METRIC,
+    image.COLOUR_LOOKUP_BITS,
+    image.COLOUR_MAX_PIXELS,
+    image.COLOUR_QUANTISE_BITS,
+    image.IMAGE_FORMAT,
+    image.IMAGE_QUALITY,
+    ",".join(map(str, image.IMAGE_THUMBNAIL_SIZES)),
+  ))
+
+
+def content_digest(content: bytes) -> str:
+  """
+  Hash the raw bytes of an upload together with the pipeline fingerprint.
+
+  The digest also names the processed image in S3, so the same photo is
+  never stored twice.
+
+  :param content: The raw upload.
+  :type content: bytes
+  :return: The SHA-256 hex digest.
+  :rtype: str
+  """
+  digest = hashlib.sha256(pipeline_fingerprint().encode())
+  digest.update(b"\0")
+  digest.update(content)
+  return digest.hexdigest()
+
+
+def result_key(digest: str, palette_size: int = 0) -> str:
+  """
+  Build the cache key of a result from its content digest and request options.
+
+  :param digest: The content digest of the upload.
+  :type digest: str
+  :param palette_size: The number of palette colours requested.
+  :type palette_size: int
+  :return: The cache key.
+  :rtype: str
+  """
+  return f"{digest}-p{palette_size}" if palette_size else digest
+
+
+class ResultCache:
+  """
+  Pipeline results by content hash, in an in-memory LRU and optionally on local disk.
+
+  Results are JSON-serialisable dictionaries. Disk entries are read back into
+  memory on first use. Concurrent requests for the same key share one run of
+  the pipeline.
+  """
+
+  def __init__(self, max_size: int = RESULT_CACHE_SIZE, directory: Optional[str] = RESULT_CACHE_DIR):
+    """
+    :param max_size: The maximum number of results kept in memory; 0 disables caching.
+    :type max_size: int
+    :param directory: Directory to also store results in, or None for memory only.
+    :type directory: str | None
+    """
+    self.enabled = max_size > 0
+    self.directory = directory if self.enabled else None
+    self._memory = LRUCache(max_size) if self.enabled else None
+    self._in_flight: Dict[str, asyncio.Future] = {}
+    self.disk_hits = 0
+    self.disk_misses = 0
+    self.disk_errors = 0
+    self.coalesced = 0
+
+  def _path(self, key: str) -> str:
+    return os.path.join(self.directory, key[:2], f"{key}.json")
+
+  def _read(self, key: str) -> Optional[Dict[str, Any]]:
+    try:
+      with open(self._path(key)) as f:
+        result = json.load(f)
+    except FileNotFoundError:
+      self.disk_misses += 1
+      return None
+    except Exception as e:
+      self.disk_errors += 1
+      print(f"Warning: Couldn't read cached result {key}: {e}")
+      return None
+
+    self.disk_hits += 1
+    return result
+
+  def _write(self, key: str, result: Dict[str, Any]):
+    path = self._path(key)
+    try:
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      # Write to a temporary file first so readers never see a partial result
+      temp_path = f"{path}.{os.getpid()}.tmp"
+      with open(temp_path, "w") as f:
+        json.dump(result, f)
+      os.replace(temp_path, path)
+    except Exception as e:
+      self.disk_errors += 1
+      print(f"Warning: Couldn't store cached result {key}: {e}")
+
+  def get(self, key: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the cached result for `key`.
+
+    :param key: The result key.
+    :type key: str
+    :return: A copy of the result, or None on a miss.
+    :rtype: Dict[str, Any] | None
+    """
+    if not self.enabled:
+      return None
+
+    result = self._memory.get(key)
+    if result is None and self.directory:
+      result = self._read(key)
+      if result is not None:
+        self._memory.set(key, result)
+
+    return dict(result) if result is not None else None
+
+  def set(self, key: str, result: Dict[str, Any]):
+    """
+    Store a result under `key`.
+
+    :param key: The result key.
+    :type key: str
+    :param result: The JSON-serialisable result.
+    :type result: Dict[str, Any]
+    :return: None
+    :rtype: None
+    """
+    if not self.enabled:
+      return
+
+    self._memory.set(key, dict(result))
+    if self.directory:
+      self._write(key, result)
+
+  def delete(self, key: str):
+    """
+    Remove the result for `key` from memory and disk.
+
+    :param key: The result key.
+    :type key: str
+    :return: None
+    :rtype: None
+    """
+    if not self.enabled:
+      return
+
+    self._memory.delete(key)
+    if self.directory:
+      try:
+        os.remove(self._path(key))
+      except FileNotFoundError:
+        pass
+      except Exception as e:
+        self.disk_errors += 1
+        print(f"Warning: Couldn't remove cached result {key}: {e}")
+
+  async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Return the cached result for `key`, or compute and cache it.
+
+    If the same key is already being computed, wait for that run instead of
+    starting another one. Failed runs are not cached.
+
+    :param key: The result key.
+    :type key: str
+    :param compute: Coroutine function producing the result.
+    :type compute: Callable[[], Awaitable[Dict[str, Any]]]
+    :return: A copy of the result.
+    :rtype: Dict[str, Any]
+    """
+    result = self.get(key)
+    if result is not None:
+      return result
+
+    task = self._in_flight.get(key)
+    if task is not None:
+      self.coalesced += 1
+    else:
+      async def run():
+        try:
+          result = await compute()
+          self.set(key, result)
+          return result
+        finally:
+          self._in_flight.pop(key, None)
+
+      task = asyncio.ensure_future(run())
+      self._in_flight[key] = task
+
+    # Shield the shared run so one client disconnecting doesn't cancel it for the others
+    return dict(await asyncio.shield(task))
+
+  async def get_or_compute_many(
+    self,
+    keys: List[str],
+    compute: Callable[[List[str]], Awaitable[List[Union[Dict[str, Any], Exception]]]],
+  ) -> List[Union[Dict[str, Any], Exception]]:
+    """
+    Return the cached results for `keys`, computing every missing one in a single call.
+
+    Keys already being computed, by this call or another, are waited for
+    rather than computed again. `compute` receives the keys it should produce,
+    in order, and returns one result or exception for each; failures are
+    returned in place of their result and not cached.
+
+    :param keys: The result keys.
+    :type keys: List[str]
+    :param compute: Coroutine function producing the results of several keys.
+    :type compute: Callable[[List[str]], Awaitable[List[Dict[str, Any] | Exception]]]
+    :return: A copy of the result, or the exception that stopped it, for each key.
+    :rtype: List[Dict[str, Any] | Exception]
+    """
+    outcomes: Dict[str, Union[Dict[str, Any], Exception]] = {}
+    waiting: Dict[str, asyncio.Future] = {}
+    missing: List[str] = []
+    for key in keys:
+      if key in outcomes or key in waiting or key in missing:
+        self.coalesced += 1
+        continue
+      result = self.get(key)
+      if result is not None:
+        outcomes[key] = result
+      elif key in self._in_flight:
+        self.coalesced += 1
+        waiting[key] = self._in_flight[key]
+      else:
+        missing.append(key)
+
+    if missing:
+      loop = asyncio.get_running_loop()
+      futures = {key: loop.create_future() for key in missing}
+      self._in_flight.update(futures)
+
+      async def run():
+        try:
+          computed = await compute(missing)
+        except Exception as e:
+          computed = [e] * len(missing)
+        finally:
+          for key in missing:
+            self._in_flight.pop(key, None)
+
+        for key, outcome in zip(missing, computed):
+          if isinstance(outcome, Exception):
+            futures[key].set_exception(outcome)
+          else:
+            self.set(key, outcome)
+            futures[key].set_result(outcome)
+
+      def cancel_unfinished(task: asyncio.Future):
+        for future in futures.values():
+          if not future.done():
+            future.cancel()
+
+      # Kept apart from the caller, so one client disconnecting doesn't cancel it for the others
+      task = asyncio.ensure_future(run())
+      task.add_done_callback(cancel_unfinished)
+      waiting.update(futures)
+
+    if waiting:
+      finished = await asyncio.shield(asyncio.gather(*waiting.values(), return_exceptions=True))
+      outcomes.update(zip(waiting, finished))
+
+    return [dict(outcomes[key]) if isinstance(outcomes[key], dict) else outcomes[key] for key in keys]
+
+  def clear(self):
+    """Remove every result from memory and reset the counters. Disk entries are kept."""
+    if self.enabled:
+      self._memory.clear()
+    self.disk_hits = self.disk_misses = self.disk_errors = self.coalesced = 0
+
+  def stats(self) -> Dict[str, Any]:
+    """
+    Return the cache counters.
+
+    :return: Memory LRU counters, disk counters, coalesced requests and the overall hit rate.
+    :rtype: dict[str, Any]
+    """
+    if not self.enabled:
+      return {"enabled": False}
+
+    memory = self._memory.stats()
+    hits = memory["hits"] + self.disk_hits
+    # Disk lookups only happen after a memory miss, so memory lookups count every request
+    lookups = memory["hits"] + memory["misses"]
+    return {
+      "enabled": True,
+      "memory": memory,
+      "disk": {
+        "directory": self.directory,
+        "hits": self.disk_hits,
+        "misses": self.disk_misses,
+        "errors": self.disk_errors,
+      } if self.directory else None,
+      "coalesced": self.coalesced,
+      "hit_rate": hits / lookups if lookups else 0.0,
+    }
+
+
+def get_result_cache() -> ResultCache:
+  """
+  Load and return the result cache.
+
+  :return: The shared result cache.
+  :rtype: ResultCache
+  """
+  global _result_cache
+  if _result_cache is None:
+    _result_cache = ResultCache()
+  return _result_cache
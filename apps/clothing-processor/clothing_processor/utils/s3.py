@@ -1,8 +1,20 @@
-import boto3
+from __future__ import annotations
 from dotenv import load_dotenv
+from shared_utils.lazy import lazy_import
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import io
+import time
 import uuid
+import os
 from PIL import Image
-from clothing_processor.utils.image import to_bytes_image
+from clothing_processor.utils.image import to_bytes_image, fit_image, IMAGE_FORMAT, IMAGE_FORMATS, IMAGE_THUMBNAIL_SIZES
+from clothing_processor.utils.timing import Trace
+
+# Imported on first use, when the first upload creates the client
+boto3 = lazy_import("boto3")
+boto3_transfer = lazy_import("boto3.s3.transfer")
+botocore_config = lazy_import("botocore.config")
 
 # Load .env for `boto3`
 load_dotenv()
@@ -10,21 +22,82 @@ load_dotenv()
 # Cache the instance s3
 _s3 = None
 
-BUCKET_NAME = "wfits-bucket"
+BUCKET_NAME = os.getenv("S3_BUCKET_NAME") or "wfits-bucket"
+# S3-compatible endpoint to use instead of AWS, e.g. a local MinIO or moto server
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+# Pooled connections, shared by every I/O worker and their multipart threads
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS") or 32)
+# Attempts per request, including the first; retries back off and adapt to throttling
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS") or 5)
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT") or 5)
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT") or 30)
+# Objects larger than the threshold are uploaded in parts, several at a time
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD") or 8 * 1024 * 1024)
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE") or 8 * 1024 * 1024)
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY") or 4)
+
+# Cache the multipart transfer settings
+_transfer_config = None
+
+# Encode time and size of the stored images, by rendition ("full" or the thumbnail size)
+_encode_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
 
 def load_s3_client():
   """
   Load and return the S3 client.
 
+  The client keeps a pool of connections sized for concurrent uploads and
+  retries failed requests. It talks to `S3_ENDPOINT_URL` instead of AWS if set.
+
   :return: The S3 client.
   :rtype: boto3.client
   """
   global _s3
   if _s3 is None:
-    _s3 = boto3.client('s3')
+    config = botocore_config.Config(
+      max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+      retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "adaptive"},
+      connect_timeout=S3_CONNECT_TIMEOUT,
+      read_timeout=S3_READ_TIMEOUT,
+      # Local stand-ins serve buckets by path rather than by subdomain
+      s3={"addressing_style": "path"} if S3_ENDPOINT_URL else None,
+    )
+    _s3 = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, config=config)
   return _s3
 
 
+def transfer_config() -> boto3_transfer.TransferConfig:
+  """
+  Load and return the multipart settings used for uploads.
+
+  :return: The transfer configuration.
+  :rtype: boto3.s3.transfer.TransferConfig
+  """
+  global _transfer_config
+  if _transfer_config is None:
+    _transfer_config = boto3_transfer.TransferConfig(
+      multipart_threshold=S3_MULTIPART_THRESHOLD,
+      multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+      max_concurrency=S3_UPLOAD_CONCURRENCY,
+    )
+  return _transfer_config
+
+
+def object_url(file_name: str) -> str:
+  """
+  Return the URL of an object in the bucket.
+
+  :param file_name: The object key.
+  :type file_name: str
+  :return: The object's URL on S3, or on `S3_ENDPOINT_URL` if set.
+  :rtype: str
+  """
+  if S3_ENDPOINT_URL:
+    return f"{S3_ENDPOINT_URL.rstrip('/')}/{BUCKET_NAME}/{file_name}"
+  return f"https://{BUCKET_NAME}.s3.amazonaws.com/{file_name}"
+
+
 def test_s3_connection():
   """
   Test connection to a specific S3 bucket to check if the credentials are correct.
@@ -50,38 +123,138 @@ def test_s3_connection():
   except Exception as e:
     print(f"Error: {e}")
 
-def s3_upload(image: Image.Image) -> str:
+def thumbnail_sizes() -> List[int]:
   """
-  Uploads a PIL Image to S3 and returns the image's S3 URL.
+  Return the configured thumbnail sizes, largest first.
 
-  :param image: The PIL Image to upload.
+  :return: The longest side of each thumbnail.
+  :rtype: List[int]
+  """
+  return sorted(set(IMAGE_THUMBNAIL_SIZES), reverse=True)
+
+def thumbnail_urls(image_url: str) -> Dict[str, str]:
+  """
+  Return the URLs of the thumbnails stored next to an image.
+
+  :param image_url: The S3 URL of the full image.
+  :type image_url: str
+  :return: The thumbnail URLs, by longest side.
+  :rtype: Dict[str, str]
+  """
+  base, extension = image_url.rsplit(".", 1)
+  return {str(size): f"{base}_{size}.{extension}" for size in thumbnail_sizes()}
+
+def _record_encode(rendition: str, seconds: float, size: int):
+  with _stats_lock:
+    stats = _encode_stats.setdefault(rendition, {"count": 0, "bytes": 0, "seconds": 0.0})
+    stats["count"] += 1
+    stats["bytes"] += size
+    stats["seconds"] += seconds
+
+def encode_stats() -> Dict[str, Any]:
+  """
+  Return the encode time and size of the stored images, to weigh storage and CDN cost against CPU.
+
+  :return: The output settings and per-rendition totals and means.
+  :rtype: Dict[str, Any]
+  """
+  with _stats_lock:
+    renditions = {
+      rendition: {
+        **stats,
+        "mean_bytes": stats["bytes"] / stats["count"],
+        "mean_seconds": stats["seconds"] / stats["count"],
+      }
+      for rendition, stats in _encode_stats.items()
+    }
+
+  return {
+    "format": IMAGE_FORMAT,
+    "thumbnail_sizes": thumbnail_sizes(),
+    "renditions": renditions,
+  }
+
+def encode_objects(image: Image.Image, name: str, trace: Optional[Trace] = None) -> List[Tuple[str, io.BytesIO]]:
+  """
+  Encode an image and its thumbnails into the objects stored for it.
+
+  Each thumbnail is scaled from the previous, larger rendition. The encode
+  time and size of each are recorded, see `encode_stats`, and added to
+  `trace` as an "encode_full" or "encode_<size>" span.
+
+  :param image: The PIL Image.
   :type image: Image.Image
-  :raise ValueError: If the upload fails due to an error.
-  :return: The S3 URL of the uploaded image.
-  :rtype: str
+  :param name: The object name, without extension.
+  :type name: str
+  :param trace: The request's trace, or None when timing is off.
+  :type trace: Trace | None
+  :return: (object key, encoded bytes) pairs, the thumbnails first and the full image last.
+  :rtype: List[Tuple[str, io.BytesIO]]
   """
-  try:
-    # Initialize the S3 client
-    s3 = load_s3_client()
+  objects = []
+  rendition = image
+  for size in [0] + thumbnail_sizes():
+    if size:
+      rendition = fit_image(rendition, size)
+    start = time.perf_counter()
+    bytes_image = to_bytes_image(rendition)
+    seconds, encoded_size = time.perf_counter() - start, bytes_image.getbuffer().nbytes
+    _record_encode(str(size) if size else "full", seconds, encoded_size)
+    if trace is not None:
+      trace.add(f"encode_{size or 'full'}", seconds, encoded_size)
+    objects.append((f"{name}_{size}.{IMAGE_FORMAT}" if size else f"{name}.{IMAGE_FORMAT}", bytes_image))
 
-    file_name = str(uuid.uuid4()) + ".png"
-    
-    bytes_image = to_bytes_image(image)
+  # Thumbnails first: once the full image is stored, the others are too
+  return objects[::-1]
 
-    # Upload the image to the specified bucket
+def upload_objects(objects: List[Tuple[str, Any]]):
+  """
+  Upload encoded objects to the bucket, in order.
+
+  :param objects: (object key, file-like object) pairs. The content type follows the key's extension.
+  :type objects: List[Tuple[str, Any]]
+  :return: None
+  :rtype: None
+  """
+  s3 = load_s3_client()
+  for object_name, bytes_image in objects:
     s3.upload_fileobj(
       bytes_image,
-      "wfits-bucket",
-      file_name,
+      BUCKET_NAME,
+      object_name,
       ExtraArgs={
-        "ContentType": "image/png",
+        "ContentType": IMAGE_FORMATS[object_name.rsplit(".", 1)[-1]][1],
         "ContentDisposition": "inline"
-      }
+      },
+      Config=transfer_config(),
     )
 
-    s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{file_name}"
+def s3_upload(image: Image.Image, key: str | None = None, trace: Optional[Trace] = None) -> str:
+  """
+  Uploads a PIL Image and its thumbnails to S3 and returns the image's S3 URL.
+
+  The encode time and size of each upload are recorded, see `encode_objects`.
+
+  :param image: The PIL Image to upload.
+  :type image: Image.Image
+  :param key: Content hash to name the object after, so the same image is always stored
+    under the same name. If not given, a random name is used.
+  :type key: str | None
+  :param trace: The request's trace to add the encode spans to, or None.
+  :type trace: Trace | None
+  :raise ValueError: If the upload fails due to an error.
+  :return: The S3 URL of the uploaded image.
+  :rtype: str
+  """
+  try:
+    name = key or str(uuid.uuid4())
+    s3_url = object_url(f"{name}.{IMAGE_FORMAT}")
 
+    # No HEAD request first: images seen before are served from the result cache,
+    # and uploading the same content again only rewrites identical objects
+    upload_objects(encode_objects(image, name, trace))
     return s3_url
   
   except Exception as e:
     raise ValueError(f"Failed to upload file: {e}")
+
@@ -0,0 +1,198 @@
+from contextlib import contextmanager, nullcontext
+from typing import Any, Awaitable, Dict, Iterator, List, Optional, Tuple
+from prometheus_client import CollectorRegistry, Histogram
+import time
+import os
+
+# Time every pipeline stage and report it on /metrics and in a Server-Timing header ("1" to enable)
+PIPELINE_TIMING = (os.getenv("PIPELINE_TIMING") or "0") == "1"
+
+# Histogram bucket upper bounds, in seconds and in bytes
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))
+
+
+class _Span:
+  """The span being timed; set `size` once the number of bytes handled is known."""
+
+  __slots__ = ("size",)
+
+  def __init__(self, size: int = 0):
+    self.size = size
+
+
+# Returned by `span` when timing is off, so untimed stages cost one function call
+_untimed = nullcontext(_Span())
+
+# The stage histograms, in a registry of their own so /metrics only reports the pipeline
+METRICS_REGISTRY = CollectorRegistry()
+_stage_durations = Histogram(
+  "clothing_processor_stage_duration_seconds",
+  "Time spent in each stage of the upload pipeline.",
+  ["stage"],
+  buckets=DURATION_BUCKETS,
+  registry=METRICS_REGISTRY,
+)
+_stage_sizes = Histogram(
+  "clothing_processor_stage_bytes",
+  "Bytes handled by each stage of the upload pipeline.",
+  ["stage"],
+  buckets=SIZE_BUCKETS,
+  registry=METRICS_REGISTRY,
+)
+
+
+class Trace:
+  """
+  Stage timings of one request.
+
+  Spans are plain tuples, so a trace filled in a worker process can be sent
+  back and merged into the request's trace with `extend`.
+  """
+
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.spans: List[Tuple[str, float, int]] = []
+
+  @contextmanager
+  def span(self, stage: str, size: int = 0) -> Iterator[_Span]:
+    current = _Span(size)
+    start = time.perf_counter()
+    try:
+      yield current
+    finally:
+      self.spans.append((stage, time.perf_counter() - start, current.size))
+
+  def add(self, stage: str, seconds: float, size: int = 0):
+    self.spans.append((stage, seconds, size))
+
+  def extend(self, spans: List[Tuple[str, float, int]]):
+    self.spans.extend(spans)
+
+  def extend_longest(self, traces: List["Trace"]):
+    """
+    Add the spans of traces that ran at the same time, such as the images of a batch.
+
+    Summing overlapping spans would report more time than passed, so each
+    stage is added once, with its longest total across the traces and the
+    bytes it handled in all of them.
+
+    :param traces: The traces of the concurrent work.
+    :type traces: List[Trace]
+    :return: None
+    :rtype: None
+    """
+    longest: Dict[str, Tuple[float, int]] = {}
+    for trace in traces:
+      totals: Dict[str, Tuple[float, int]] = {}
+      for stage, seconds, size in trace.spans:
+        total_seconds, total_size = totals.get(stage, (0.0, 0))
+        totals[stage] = (total_seconds + seconds, total_size + size)
+      for stage, (seconds, size) in totals.items():
+        longest_seconds, all_size = longest.get(stage, (0.0, 0))
+        longest[stage] = (max(longest_seconds, seconds), all_size + size)
+    self.spans.extend((stage, seconds, size) for stage, (seconds, size) in longest.items())
+
+  def finish(self):
+    """Add the time since the trace started as the "total" stage."""
+    self.add("total", time.perf_counter() - self.start)
+
+  def server_timing(self) -> str:
+    """
+    Format the trace as a Server-Timing header value, one entry per stage in first-seen order.
+
+    :return: E.g. "decode;dur=12.1, remove_background;dur=840.3".
+    :rtype: str
+    """
+    totals: Dict[str, float] = {}
+    for stage, seconds, _ in self.spans:
+      totals[stage] = totals.get(stage, 0.0) + seconds
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+  """
+  Read the stage durations back from a Server-Timing header value.
+
+  :param header: E.g. "decode;dur=12.1, remove_background;dur=840.3".
+  :type header: str
+  :return: The duration of each stage in milliseconds; entries without a duration are skipped.
+  :rtype: Dict[str, float]
+  """
+  durations = {}
+  for entry in header.split(","):
+    stage, *params = [part.strip() for part in entry.split(";")]
+    for param in params:
+      if param.startswith("dur="):
+        durations[stage] = float(param[len("dur="):])
+  return durations
+
+
+def new_trace() -> Optional[Trace]:
+  """
+  Start the trace of a request.
+
+  :return: A new trace, or None when `PIPELINE_TIMING` is off.
+  :rtype: Trace | None
+  """
+  return Trace() if PIPELINE_TIMING else None
+
+
+def span(trace: Optional[Trace], stage: str, size: int = 0):
+  """
+  Time a block of code as one stage of a request.
+
+  :param trace: The request's trace, or None when timing is off.
+  :type trace: Trace | None
+  :param stage: The stage name, e.g. "remove_background".
+  :type stage: str
+  :param size: The number of bytes the stage handled, or 0 if it doesn't apply.
+  :type size: int
+  :return: A context manager timing the block, or one doing nothing without a trace. It yields
+    the span, whose `size` can be set inside the block once it is known.
+  :rtype: ContextManager[_Span]
+  """
+  if trace is None:
+    return _untimed
+  return trace.span(stage, size)
+
+
+async def timed(trace: Optional[Trace], stage: str, awaitable: Awaitable[Any]) -> Any:
+  """
+  Await a pipeline stage, timing it as one span.
+
+  :param trace: The request's trace, or None when timing is off.
+  :type trace: Trace | None
+  :param stage: The stage name.
+  :type stage: str
+  :param awaitable: The stage to wait for.
+  :type awaitable: Awaitable[Any]
+  :return: The stage's result.
+  :rtype: Any
+  """
+  with span(trace, stage):
+    return await awaitable
+
+
+def record(trace: Optional[Trace]):
+  """
+  Add the spans of a finished request to the stage histograms.
+
+  :param trace: The request's trace, or None when timing is off.
+  :type trace: Trace | None
+  :return: None
+  :rtype: None
+  """
+  if trace is None:
+    return
+
+  for stage, seconds, size in trace.spans:
+    _stage_durations.labels(stage=stage).observe(seconds)
+    if size:
+      _stage_sizes.labels(stage=stage).observe(size)
+
+
+def reset_metrics():
+  """Forget every observation."""
+  _stage_durations.clear()
+  _stage_sizes.clear()
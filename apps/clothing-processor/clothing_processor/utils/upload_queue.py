@@ -0,0 +1,503 @@
+from typing import Any, Callable, Dict, List, Optional, Union
+from PIL import Image
+from shared_utils.cache import LRUCache
+from clothing_processor.utils.executor import get_executor
+from clothing_processor.utils.image import IMAGE_FORMAT
+from clothing_processor.utils.s3 import s3_upload, encode_objects, upload_objects, object_url
+from clothing_processor.utils.timing import Trace
+import tempfile
+import inspect
+import asyncio
+import shutil
+import fcntl
+import time
+import os
+
+# Memory queued images may take up; beyond it new images are encoded and spilled to disk
+UPLOAD_QUEUE_MAX_BYTES = int(os.getenv("UPLOAD_QUEUE_MAX_BYTES") or 256 * 1024 * 1024)
+# Directory spilled uploads are kept in until stored; each process spills into its own
+# subdirectory, which is picked up by the next process to start once its owner has stopped
+UPLOAD_QUEUE_DIR = os.getenv("UPLOAD_QUEUE_DIR") or os.path.join(tempfile.gettempdir(), "clothing-processor-uploads")
+# Number of uploads running at once
+UPLOAD_QUEUE_WORKERS = int(os.getenv("UPLOAD_QUEUE_WORKERS") or 4)
+# Seconds before the first retry of a failed upload, doubling up to the maximum
+UPLOAD_RETRY_DELAY = float(os.getenv("UPLOAD_RETRY_DELAY") or 1)
+UPLOAD_RETRY_MAX_DELAY = float(os.getenv("UPLOAD_RETRY_MAX_DELAY") or 60)
+# Attempts before an upload is given up on
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS") or 10)
+# Seconds to wait for queued uploads when the server stops
+UPLOAD_DRAIN_TIMEOUT = float(os.getenv("UPLOAD_DRAIN_TIMEOUT") or 30)
+
+# File held locked by the process that owns a spill subdirectory
+LOCK_FILE = ".lock"
+
+# Cache the upload queue
+_upload_queue = None
+
+
+def image_bytes(image: Image.Image) -> int:
+  """
+  Estimate the memory taken up by a decoded image.
+
+  :param image: The PIL Image.
+  :type image: Image.Image
+  :return: The size of its pixel data in bytes.
+  :rtype: int
+  """
+  return image.width * image.height * len(image.getbands())
+
+
+def is_retryable(error: BaseException) -> bool:
+  """
+  Decide whether a failed upload may succeed if tried again.
+
+  Missing spill files and client errors from S3 (4xx other than timeouts and
+  throttling) are final. The whole exception chain is checked, since the
+  upload helpers wrap the error they caught.
+
+  :param error: The error the upload failed with.
+  :type error: BaseException
+  :return: False if retrying can't help, otherwise True.
+  :rtype: bool
+  """
+  while error is not None:
+    if isinstance(error, FileNotFoundError):
+      return False
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+      status = response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+      if 400 <= status < 500 and status not in (408, 429):
+        return False
+    error = error.__cause__ or error.__context__
+  return True
+
+
+def _lock(directory: str):
+  # Returns the open lock file, or None if another process holds it or the directory isn't a spill directory
+  try:
+    lock = open(os.path.join(directory, LOCK_FILE), "rb")
+  except OSError:
+    return None
+  try:
+    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except OSError:
+    lock.close()
+    return None
+  return lock
+
+
+class _Upload:
+  """One queued image, held in memory or spilled to a directory of encoded objects."""
+
+  def __init__(self, key: str, image: Optional[Image.Image] = None, path: Optional[str] = None):
+    self.key = key
+    self.image = image
+    self.path = path
+    self.size = image_bytes(image) if image is not None else 0
+    self.state = "queued"
+    self.attempts = 0
+    self.error: Optional[str] = None
+    self.queued_at = time.time()
+    self.retry: Optional[asyncio.TimerHandle] = None
+
+
+class UploadQueue:
+  """
+  Write-behind queue that stores processed images in S3 after the response is sent.
+
+  Images wait in memory up to `max_bytes`; beyond that they are encoded and
+  spilled to a subdirectory of `directory` that this queue holds locked, or,
+  without a directory, `put` waits until there is room. Failed uploads are
+  retried with exponential backoff up to `max_attempts`; errors retrying can't
+  fix fail them at once. Spilled uploads of queues that have stopped are picked
+  up by `start()`. `on_complete` is told about every upload once it is stored
+  or given up on.
+  """
+
+  def __init__(
+    self,
+    max_bytes: int = UPLOAD_QUEUE_MAX_BYTES,
+    directory: Optional[str] = UPLOAD_QUEUE_DIR,
+    workers: int = UPLOAD_QUEUE_WORKERS,
+    retry_delay: float = UPLOAD_RETRY_DELAY,
+    max_retry_delay: float = UPLOAD_RETRY_MAX_DELAY,
+    max_attempts: int = UPLOAD_MAX_ATTEMPTS,
+    on_complete: Optional[Callable[[str, Union[str, Exception]], Any]] = None,
+  ):
+    """
+    :param max_bytes: Memory queued images may take up before new ones are spilled to disk.
+    :type max_bytes: int
+    :param directory: Directory to spill uploads to, or None to keep every upload in memory
+      and wait for room when over `max_bytes`.
+    :type directory: str | None
+    :param workers: Number of uploads running at once.
+    :type workers: int
+    :param retry_delay: Seconds before the first retry, doubling with every failed attempt.
+    :type retry_delay: float
+    :param max_retry_delay: Longest wait between retries, in seconds.
+    :type max_retry_delay: float
+    :param max_attempts: Attempts before an upload is given up on.
+    :type max_attempts: int
+    :param on_complete: Called with the key and the S3 URL once an upload is stored, or with the
+      key and the error once it is given up on. May be a coroutine function.
+    :type on_complete: Callable[[str, str | Exception], Any] | None
+    :raise ValueError: If the configuration is invalid.
+    """
+    if workers < 1:
+      raise ValueError("Upload queue needs at least one worker.")
+    if max_attempts < 1:
+      raise ValueError("Upload queue needs at least one attempt per upload.")
+
+    self.max_bytes = max_bytes
+    self.directory = directory
+    self.workers = workers
+    self.retry_delay = retry_delay
+    self.max_retry_delay = max_retry_delay
+    self.max_attempts = max_attempts
+    self.on_complete = on_complete
+    self.spill_directory: Optional[str] = None
+    self.memory_bytes = 0
+    self.memory_waits = 0
+    self.spilled = 0
+    self.completed = 0
+    self.failed = 0
+    self.failed_attempts = 0
+    self._uploads: Dict[str, _Upload] = {}
+    self._finished = LRUCache(1024)
+    self._queue: Optional[asyncio.Queue] = None
+    self._workers: List[asyncio.Task] = []
+    self._idle: Optional[asyncio.Event] = None
+    self._freed: Optional[asyncio.Event] = None
+    self._lock = None
+    self._callbacks = set()
+
+  def start(self):
+    """Start the upload workers and queue the spilled uploads of stopped queues. Must be called from the event loop."""
+    if self._queue is not None:
+      return
+
+    self._queue = asyncio.Queue()
+    self._idle = asyncio.Event()
+    self._idle.set()
+    self._freed = asyncio.Event()
+    self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+    if self.directory:
+      try:
+        self._claim()
+      except OSError as e:
+        print(f"Warning: Couldn't use upload spill directory {self.directory}, keeping uploads in memory: {e}")
+        return
+      self._recover()
+
+  def _claim(self):
+    # Spill into a subdirectory of our own, locked for as long as this queue runs
+    os.makedirs(self.directory, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=self.directory)
+    open(os.path.join(path, LOCK_FILE), "wb").close()
+    lock = _lock(path)
+    if lock is None:
+      raise OSError(f"Couldn't lock {path}")
+    self.spill_directory, self._lock = path, lock
+
+  def _release(self):
+    if self._lock is None:
+      return
+    # Nothing left to pick up, so the next start has nothing to look at
+    if os.listdir(self.spill_directory) == [LOCK_FILE]:
+      shutil.rmtree(self.spill_directory, ignore_errors=True)
+    self._lock.close()
+    self.spill_directory, self._lock = None, None
+
+  def _recover(self):
+    for owner in sorted(os.listdir(self.directory)):
+      owner_path = os.path.join(self.directory, owner)
+      if owner_path == self.spill_directory:
+        continue
+      # Only directories whose queue has stopped can be locked
+      lock = _lock(owner_path)
+      if lock is None:
+        continue
+      try:
+        for name in sorted(os.listdir(owner_path)):
+          path = os.path.join(owner_path, name)
+          if name == LOCK_FILE:
+            continue
+          if name.endswith(".tmp") or name in self._uploads:
+            # Interrupted while spilling, the image was lost with the process, or already queued
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+          target = os.path.join(self.spill_directory, name)
+          os.replace(path, target)
+          self._enqueue(_Upload(name, path=target))
+        shutil.rmtree(owner_path, ignore_errors=True)
+      except OSError as e:
+        print(f"Warning: Couldn't pick up spilled uploads in {owner_path}: {e}")
+      finally:
+        lock.close()
+
+  def _enqueue(self, upload: _Upload):
+    self._uploads[upload.key] = upload
+    self._idle.clear()
+    self._queue.put_nowait(upload)
+
+  def _spill(self, image: Image.Image, key: str, trace: Optional[Trace] = None) -> str:
+    path = os.path.join(self.spill_directory, key)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(temp_path, exist_ok=True)
+    for object_name, bytes_image in encode_objects(image, key, trace):
+      with open(os.path.join(temp_path, object_name), "wb") as f:
+        f.write(bytes_image.getbuffer())
+
+    # Move the finished directory into place so a restart never finds half of it
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+    return path
+
+  async def put(self, image: Image.Image, key: str, trace: Optional[Trace] = None) -> str:
+    """
+    Queue an image and its thumbnails for upload and return the URL it will be stored at.
+
+    Only waits when the queue is over its memory budget, to spill the image to
+    disk or, without a spill directory, for earlier uploads to free memory.
+
+    :param image: The PIL Image to upload.
+    :type image: Image.Image
+    :param key: Content hash to name the object after.
+    :type key: str
+    :param trace: The request's trace to add the encode spans of a spilled image to, or None.
+    :type trace: Trace | None
+    :return: The S3 URL of the image.
+    :rtype: str
+    """
+    self.start()
+    s3_url = object_url(f"{key}.{IMAGE_FORMAT}")
+    if key in self._uploads:
+      return s3_url
+
+    upload = _Upload(key, image)
+    if self.memory_bytes + upload.size > self.max_bytes:
+      # Claim the key first so the same image isn't spilled or waited for twice at once
+      self._uploads[key] = upload
+      try:
+        if self.spill_directory:
+          upload.path = await get_executor().run_io(self._spill, image, key, trace)
+          upload.image, upload.size = None, 0
+          self.spilled += 1
+        else:
+          await self._wait_for_memory(upload.size)
+      except BaseException:
+        del self._uploads[key]
+        raise
+
+    self.memory_bytes += upload.size
+
+    self._enqueue(upload)
+    return s3_url
+
+  async def _wait_for_memory(self, size: int):
+    self.memory_waits += 1
+    # An image larger than the whole budget still goes through once the queue is empty
+    while self.memory_bytes and self.memory_bytes + size > self.max_bytes:
+      self._freed.clear()
+      await self._freed.wait()
+
+  def _upload(self, upload: _Upload):
+    if upload.image is not None:
+      s3_upload(upload.image, upload.key)
+      return
+
+    names = sorted(os.listdir(upload.path), key=lambda name: name.startswith(f"{upload.key}."))
+    files = [open(os.path.join(upload.path, name), "rb") for name in names]
+    try:
+      # The full image goes last, as with s3_upload
+      upload_objects(list(zip(names, files)))
+    finally:
+      for f in files:
+        f.close()
+
+  async def _work(self):
+    while True:
+      upload = await self._queue.get()
+      upload.state = "uploading"
+      upload.attempts += 1
+      try:
+        await get_executor().run_io(self._upload, upload)
+      except Exception as e:
+        self.failed_attempts += 1
+        upload.error = str(e)
+        if not is_retryable(e) or upload.attempts >= self.max_attempts:
+          print(f"Warning: Upload of {upload.key} failed (attempt {upload.attempts}), giving up: {e}")
+          self._fail(upload, e)
+          continue
+        upload.state = "retrying"
+        delay = min(self.retry_delay * 2 ** (upload.attempts - 1), self.max_retry_delay)
+        print(f"Warning: Upload of {upload.key} failed (attempt {upload.attempts}), retrying in {delay:.0f}s: {e}")
+        upload.retry = asyncio.get_running_loop().call_later(delay, self._retry, upload)
+      else:
+        self._finish(upload)
+      finally:
+        self._queue.task_done()
+
+  def _retry(self, upload: _Upload):
+    upload.retry = None
+    upload.state = "queued"
+    self._queue.put_nowait(upload)
+
+  def _remove(self, upload: _Upload):
+    del self._uploads[upload.key]
+    self.memory_bytes -= upload.size
+    self._freed.set()
+    upload.image = None
+    if upload.path:
+      shutil.rmtree(upload.path, ignore_errors=True)
+    if not self._uploads:
+      self._idle.set()
+
+  def _finish(self, upload: _Upload):
+    self._remove(upload)
+    self.completed += 1
+    self._finished.set(upload.key, {"state": "stored", "attempts": upload.attempts})
+    self._complete(upload.key, object_url(f"{upload.key}.{IMAGE_FORMAT}"))
+
+  def _fail(self, upload: _Upload, error: Exception):
+    # Nothing left to retry, so the image and its spilled files are let go
+    self._remove(upload)
+    self.failed += 1
+    self._finished.set(upload.key, {"state": "failed", "attempts": upload.attempts, "error": upload.error})
+    self._complete(upload.key, error)
+
+  def _complete(self, key: str, outcome: Union[str, Exception]):
+    if self.on_complete is None:
+      return
+    try:
+      result = self.on_complete(key, outcome)
+      if inspect.isawaitable(result):
+        # Kept until done, and its errors reported like those of a plain callback
+        task = asyncio.ensure_future(result)
+        self._callbacks.add(task)
+        task.add_done_callback(self._callback_done)
+    except Exception as e:
+      print(f"Warning: Upload completion callback failed for {key}: {e}")
+
+  def _callback_done(self, task: asyncio.Future):
+    self._callbacks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+      print(f"Warning: Upload completion callback failed: {task.exception()}")
+
+  async def drain(self, timeout: float = UPLOAD_DRAIN_TIMEOUT):
+    """
+    Wait for the queued uploads and stop the workers.
+
+    Uploads waiting to be retried are tried again at once. Uploads still in
+    memory after `timeout` seconds are spilled to disk for the next start.
+
+    :param timeout: The longest time to wait, in seconds.
+    :type timeout: float
+    :return: None
+    :rtype: None
+    """
+    if self._queue is None:
+      return
+
+    for upload in self._uploads.values():
+      if upload.retry is not None:
+        upload.retry.cancel()
+        self._retry(upload)
+
+    try:
+      await asyncio.wait_for(self._idle.wait(), timeout)
+    except asyncio.TimeoutError:
+      pass
+    if self._callbacks:
+      await asyncio.wait(list(self._callbacks), timeout=timeout)
+
+    for worker in self._workers:
+      worker.cancel()
+    await asyncio.gather(*self._workers, return_exceptions=True)
+
+    lost = 0
+    for upload in self._uploads.values():
+      if upload.retry is not None:
+        upload.retry.cancel()
+      if upload.image is None:
+        continue
+      try:
+        if not self.spill_directory:
+          raise ValueError("no spill directory")
+        self._spill(upload.image, upload.key)
+      except Exception as e:
+        lost += 1
+        print(f"Warning: Couldn't keep upload {upload.key} for the next start: {e}")
+
+    if self._uploads:
+      print(f"Warning: {len(self._uploads) - lost} uploads left for the next start, {lost} lost.")
+
+    self._uploads.clear()
+    self.memory_bytes = 0
+    self._freed.set()
+    self._release()
+    self._queue = None
+    self._workers = []
+
+  def status(self, key: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the upload state of an image.
+
+    :param key: The content hash the image is named after.
+    :type key: str
+    :return: The state ("queued", "uploading", "retrying", "stored" or "failed"), attempts so far
+      and last error, or None if the image isn't queued and wasn't stored or given up on recently.
+    :rtype: Dict[str, Any] | None
+    """
+    upload = self._uploads.get(key)
+    if upload is not None:
+      return {
+        "key": key,
+        "state": upload.state,
+        "attempts": upload.attempts,
+        "error": upload.error,
+        "spilled": upload.path is not None,
+        "queued_seconds": time.time() - upload.queued_at,
+      }
+
+    finished = self._finished.get(key)
+    if finished is not None:
+      return {"key": key, **finished}
+    return None
+
+  def stats(self) -> Dict[str, Any]:
+    """
+    Return the queue counters.
+
+    :return: Pending uploads by where they wait and their state, memory use and totals of stored and failed uploads.
+    :rtype: Dict[str, Any]
+    """
+    uploads = list(self._uploads.values())
+    return {
+      "pending": len(uploads),
+      "in_memory": sum(upload.image is not None for upload in uploads),
+      "on_disk": sum(upload.path is not None for upload in uploads),
+      "retrying": sum(upload.state == "retrying" for upload in uploads),
+      "memory_bytes": self.memory_bytes,
+      "max_bytes": self.max_bytes,
+      "memory_waits": self.memory_waits,
+      "spill_directory": self.spill_directory,
+      "spilled": self.spilled,
+      "completed": self.completed,
+      "failed": self.failed,
+      "failed_attempts": self.failed_attempts,
+      "workers": self.workers,
+    }
+
+
+def get_upload_queue() -> UploadQueue:
+  """
+  Load and return the upload queue.
+
+  :return: The shared upload queue.
+  :rtype: UploadQueue
+  """
+  global _upload_queue
+  if _upload_queue is None:
+    _upload_queue = UploadQueue()
+  return _upload_queue
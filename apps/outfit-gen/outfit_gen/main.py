@@ -1,13 +1,13 @@
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Literal
 from fastapi import FastAPI, Depends, Body
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from shared_utils.auth import auth0_auth_middleware
-from outfit_gen.utils.db import get_prisma_client, get_items
+from shared_utils.auth import auth0_auth_middleware, get_token_cache_stats
+from outfit_gen.utils.db import get_prisma_client, parse_filters
+from outfit_gen.utils.wardrobe import get_wardrobe_index
 from outfit_gen.utils.weather import forecast
 from pydantic import BaseModel
 from datetime import datetime
-from collections import defaultdict
 import random
 
 app = FastAPI()
@@ -26,6 +26,11 @@ class GenerateOutfitRequest(BaseModel):
     longitude: Optional[float] = None
     latitude: Optional[float] = None
 
+class WardrobeEvent(BaseModel):
+    event: Literal["created", "updated", "deleted"]
+    user_id: int
+    item_id: Optional[int] = None
+
 class CategoryTag(BaseModel):
     category_id: int
     category_name: str
@@ -63,25 +68,6 @@ class Item(BaseModel):
             datetime: lambda v: v.isoformat() if v else None
         }
 
-def get_items_by_category(items: List) -> Dict[str, List]:
-    """
-    Group items by their category name.
-
-    :param items: List of items with a category_tag.category_name attribute.
-    :type items: list
-    :return: Dictionary mapping category names to lists of items.
-    :rtype: dict[str, list]
-    """
-    items_by_category: Dict[str, List[Any]] = defaultdict(list)
-    for item in items:
-        try:
-            category_name = item.category_tag.category_name
-            items_by_category[category_name].append(item)
-        except AttributeError:
-            print(f"Warning: Item {item} does not have the expected category structure.")
-
-    return dict(items_by_category)
-
 def generate_outfit(items_by_category: Dict[str, List[Any]]) -> Dict[str, Any]:
     """
     Select one random item per category to form an outfit.
@@ -177,9 +163,11 @@ async def generate_outfit_endpoint(body: GenerateOutfitRequest):
             filters["environment"] = weather["condition"]
             filters["waterproof"] = weather["rain"]
 
-        items = await get_items(db, user_id, filters)
+        # Look the items up in the user's wardrobe, read from the database
+        # only on the first request or after an item changed
+        wardrobe = await get_wardrobe_index().get(db, user_id)
 
-        items_by_category = get_items_by_category(items)
+        items_by_category = wardrobe.lookup(parse_filters(filters))
 
         outfit = generate_outfit(items_by_category)
 
@@ -191,4 +179,39 @@ async def generate_outfit_endpoint(body: GenerateOutfitRequest):
         return JSONResponse(
             content={"error": f"Couldn't generate outfit: {str(e)}"},
             status_code=500,
-        )
\ No newline at end of file
+        )
+
+
+@app.post("/wardrobe/events", dependencies=[Depends(auth0_auth_middleware)])
+async def wardrobe_event_endpoint(body: WardrobeEvent):
+    """
+    Report that an item was created, updated or deleted, so outfits stop being generated from the old items.
+
+    :param body: Request body with the event, the ID of the item's owner and, for deletions, the item ID.
+    :type body: WardrobeEvent
+    :return: JSON response saying whether the owner's wardrobe was in memory.
+    :rtype: JSONResponse
+    """
+    index = get_wardrobe_index()
+    if body.event == "created":
+        cached = index.item_created(body.user_id)
+    elif body.event == "updated":
+        cached = index.item_updated(body.user_id)
+    else:
+        cached = index.item_deleted(body.user_id, body.item_id)
+
+    return JSONResponse(content={"cached": cached})
+
+
+@app.get("/stats")
+async def stats_endpoint():
+    """
+    Report the wardrobe index and verified-token cache counters.
+
+    :return: JSON response with the wardrobe index size, hits, misses, evictions and invalidations, and the token cache hits and misses.
+    :rtype: JSONResponse
+    """
+    return JSONResponse(content={
+        "wardrobe_index": get_wardrobe_index().stats(),
+        "token_cache": get_token_cache_stats(),
+    })
@@ -1,7 +1,7 @@
 import pytest
-from outfit_gen.main import get_items_by_category
 from unittest.mock import AsyncMock, patch
 from outfit_gen.main import app
+from shared_utils.auth import get_token_cache_stats
 from fastapi.testclient import TestClient
 
 client = TestClient(app)
@@ -88,3 +88,13 @@ def test_get_items_by_category_multiple():
         "status": 200,
         "message": f"Items categorized successfully: {result}"
     })
+
+# Test case for the verified-token cache counters in /stats
+def test_stats_reports_token_cache():
+    response = client.get("/stats")
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert "wardrobe_index" in stats
+    assert stats["token_cache"] == get_token_cache_stats()
+    assert {"hits", "misses", "hit_rate"} <= set(stats["token_cache"])
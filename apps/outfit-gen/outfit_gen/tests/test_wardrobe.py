@@ -0,0 +1,191 @@
+import pytest
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from outfit_gen.utils.wardrobe import Wardrobe, WardrobeIndex
+
+def make_item(item_id, category_name, environment="Warm", waterproof=False, colour_id=1, size_id=1):
+    return SimpleNamespace(
+        item_id=item_id,
+        colour_id=colour_id,
+        category_id={"Top": 1, "Bottom": 2, "Jacket": 3}[category_name],
+        size_id=size_id,
+        environment=environment,
+        waterproof=waterproof,
+        category_tag=SimpleNamespace(category_name=category_name),
+    )
+
+ITEMS = [
+    make_item(1, "Top", "Warm", False, colour_id=1),
+    make_item(2, "Top", "Cold", False, colour_id=2),
+    make_item(3, "Bottom", "Warm", False),
+    make_item(4, "Jacket", "Cold", True),
+    make_item(5, "Jacket", None, None),
+]
+
+def ids(items_by_category):
+    return {category: [item.item_id for item in items] for category, items in items_by_category.items()}
+
+def mock_db(items=ITEMS):
+    db = MagicMock()
+    db.item.find_many = AsyncMock(return_value=list(items))
+    return db
+
+# Tests that lookups match items like the database filters would
+def test_wardrobe_lookup():
+    wardrobe = Wardrobe(ITEMS)
+    assert len(wardrobe) == 5
+    assert ids(wardrobe.lookup({})) == {"Top": [1, 2], "Bottom": [3], "Jacket": [4, 5]}
+    assert ids(wardrobe.lookup({"environment": "Warm"})) == {"Top": [1], "Bottom": [3]}
+    assert ids(wardrobe.lookup({"environment": "Cold", "waterproof": True})) == {"Jacket": [4]}
+    # Items without a waterproof flag only match when it isn't filtered on
+    assert ids(wardrobe.lookup({"waterproof": False})) == {"Top": [1, 2], "Bottom": [3]}
+    assert ids(wardrobe.lookup({"colour_id": 2})) == {"Top": [2]}
+    assert ids(wardrobe.lookup({"category_id": 2, "environment": "Cold"})) == {}
+
+# Tests that items without a category are left out
+def test_wardrobe_skips_items_without_category():
+    wardrobe = Wardrobe([make_item(1, "Top"), SimpleNamespace(item_id=2, environment="Warm", waterproof=False, category_tag=None)])
+    assert ids(wardrobe.lookup({})) == {"Top": [1]}
+
+# Tests removing an item from its bucket
+def test_wardrobe_remove():
+    wardrobe = Wardrobe(ITEMS)
+    assert wardrobe.remove(3)
+    assert not wardrobe.remove(3)
+    assert "Bottom" not in wardrobe.lookup({})
+
+# Tests that a wardrobe is read once and then served from memory
+@pytest.mark.asyncio
+async def test_wardrobe_index_caches():
+    db = mock_db()
+    index = WardrobeIndex(max_size=2)
+    first = await index.get(db, 42)
+    second = await index.get(db, 42)
+    assert first is second
+    db.item.find_many.assert_awaited_once_with(
+        where={"user_id": 42},
+        include={"category_tag": True, "colour_tag": True, "size_tag": True}
+    )
+
+# Tests that concurrent requests share one query
+@pytest.mark.asyncio
+async def test_wardrobe_index_shares_load():
+    db = mock_db()
+    index = WardrobeIndex()
+    wardrobes = await asyncio.gather(*(index.get(db, 42) for _ in range(5)))
+    assert all(wardrobe is wardrobes[0] for wardrobe in wardrobes)
+    assert db.item.find_many.await_count == 1
+
+# Tests that the least recently used wardrobe is evicted
+@pytest.mark.asyncio
+async def test_wardrobe_index_evicts():
+    db = mock_db()
+    index = WardrobeIndex(max_size=2)
+    for user_id in (1, 2, 1, 3, 1, 2):
+        await index.get(db, user_id)
+    # User 2 was evicted by user 3, then read again
+    assert db.item.find_many.await_count == 4
+    assert index.stats()["evictions"] == 2
+
+# Tests that wardrobes are read again once the TTL runs out
+@pytest.mark.asyncio
+async def test_wardrobe_index_ttl():
+    db = mock_db()
+    index = WardrobeIndex(ttl=0.01)
+    await index.get(db, 42)
+    await asyncio.sleep(0.02)
+    await index.get(db, 42)
+    assert db.item.find_many.await_count == 2
+
+# Tests that created and updated items make the wardrobe be read again
+@pytest.mark.asyncio
+async def test_wardrobe_index_item_created_and_updated():
+    db = mock_db()
+    index = WardrobeIndex()
+    await index.get(db, 42)
+    assert index.item_created(42)
+    assert not index.item_created(42)
+
+    db.item.find_many.return_value = ITEMS + [make_item(6, "Top")]
+    assert sorted(ids((await index.get(db, 42)).lookup({}))["Top"]) == [1, 2, 6]
+    assert index.item_updated(42)
+    await index.get(db, 42)
+    assert db.item.find_many.await_count == 3
+
+# Tests that deleted items are removed without reading the wardrobe again
+@pytest.mark.asyncio
+async def test_wardrobe_index_item_deleted():
+    db = mock_db()
+    index = WardrobeIndex()
+    await index.get(db, 42)
+    assert index.item_deleted(42, 4)
+    assert ids((await index.get(db, 42)).lookup({}))["Jacket"] == [5]
+    assert db.item.find_many.await_count == 1
+
+    # Without the item ID, the whole wardrobe is read again
+    assert index.item_deleted(42)
+    await index.get(db, 42)
+    assert db.item.find_many.await_count == 2
+
+# Tests that a load overtaken by a change isn't kept
+@pytest.mark.asyncio
+async def test_wardrobe_index_change_during_load():
+    loaded = asyncio.Event()
+    release = asyncio.Event()
+
+    async def find_many(**kwargs):
+        loaded.set()
+        await release.wait()
+        return list(ITEMS)
+
+    db = MagicMock()
+    db.item.find_many = AsyncMock(side_effect=find_many)
+    index = WardrobeIndex()
+    pending = asyncio.ensure_future(index.get(db, 42))
+    await loaded.wait()
+    index.item_created(42)
+    release.set()
+
+    # The waiting request gets the wardrobe it asked for, but the next one reads it again
+    assert len(await pending) == 5
+    await index.get(db, 42)
+    assert db.item.find_many.await_count == 2
+
+# Tests that a failed load gives an empty wardrobe, like get_items did, and isn't cached
+@pytest.mark.asyncio
+async def test_wardrobe_index_load_failure():
+    db = mock_db()
+    db.item.find_many.side_effect = [Exception("Connection lost"), list(ITEMS)]
+    index = WardrobeIndex()
+    assert len(await index.get(db, 42)) == 0
+    assert len(await index.get(db, 42)) == 5
+    assert index.stats()["load_errors"] == 1
+
+# Tests that deletions don't count as lookups or keep a wardrobe from being evicted
+@pytest.mark.asyncio
+async def test_wardrobe_index_item_deleted_leaves_stats_alone():
+    db = mock_db()
+    index = WardrobeIndex(max_size=2)
+    await index.get(db, 1)
+    await index.get(db, 2)
+    assert index.item_deleted(1, 4)
+    assert not index.item_deleted(3, 4)
+    stats = index.stats()
+    assert (stats["hits"], stats["misses"]) == (0, 2)
+
+    # User 1 is still the least recently used
+    await index.get(db, 3)
+    await index.get(db, 1)
+    assert db.item.find_many.await_count == 4
+
+# Tests that a disabled index reads the database on every request
+@pytest.mark.asyncio
+async def test_wardrobe_index_disabled():
+    db = mock_db()
+    index = WardrobeIndex(max_size=0)
+    await index.get(db, 42)
+    await index.get(db, 42)
+    assert db.item.find_many.await_count == 2
+    assert not index.item_created(42)
+    assert index.stats() == {"enabled": False, "load_errors": 0}
@@ -80,6 +80,24 @@ async def get_items(
     return []  
 
 
+async def get_wardrobe_items(db: Prisma, user_id: int) -> List[PrismaItem]:
+  """
+  Fetch all of a user's items with their category, colour and size tags.
+
+  :param db: The Prisma database client.
+  :type db: Prisma
+  :param user_id: The ID of the user whose items are being fetched.
+  :type user_id: int
+  :raise Exception: If there is an error fetching items from the database.
+  :return: Every item of the user.
+  :rtype: list[PrismaItem]
+  """
+  return await db.item.find_many(
+    where={"user_id": user_id},
+    include={"category_tag": True, "colour_tag": True, "size_tag": True}
+  )
+
+
 async def get_prisma_client() -> Prisma:
   """
   Return a Prisma client instance, reusing a cached instance if available.
@@ -0,0 +1,274 @@
+from typing import Any, Dict, List, Optional, Tuple
+from prisma import Prisma
+from shared_utils.cache import LRUCache
+from outfit_gen.utils.db import get_wardrobe_items
+import asyncio
+import os
+
+# Number of users whose wardrobes are kept in memory; 0 disables the index
+WARDROBE_INDEX_SIZE = int(os.getenv("WARDROBE_INDEX_SIZE") or 1024)
+# Seconds a wardrobe is served from memory before it is read again, in case a change wasn't reported
+WARDROBE_INDEX_TTL = float(os.getenv("WARDROBE_INDEX_TTL") or 300)
+
+# Filters answered by picking buckets rather than checking each item
+BUCKET_FILTERS = ("environment", "waterproof")
+
+# Cache the wardrobe index
+_wardrobe_index = None
+
+
+class Wardrobe:
+  """
+  One user's items, bucketed by environment and waterproof flag, then by category name.
+
+  Filters match like the database query in `get_items`: a filter on
+  environment or waterproof only matches items with exactly that value.
+  """
+
+  def __init__(self, items: List[Any]):
+    """
+    :param items: The user's items, with their category tag.
+    :type items: list
+    """
+    self.buckets: Dict[Tuple[Optional[str], Optional[bool]], Dict[str, List[Any]]] = {}
+    for item in items:
+      try:
+        category_name = item.category_tag.category_name
+      except AttributeError:
+        print(f"Warning: Item {item} does not have the expected category structure.")
+        continue
+      bucket = self.buckets.setdefault((item.environment, item.waterproof), {})
+      bucket.setdefault(category_name, []).append(item)
+
+  def __len__(self) -> int:
+    return sum(len(items) for bucket in self.buckets.values() for items in bucket.values())
+
+  def lookup(self, filters: Dict) -> Dict[str, List[Any]]:
+    """
+    Return the items matching validated filters, grouped by category name.
+
+    :param filters: Filters as returned by `parse_filters`.
+    :type filters: dict
+    :return: Dictionary mapping category names to lists of matching items.
+    :rtype: dict[str, list]
+    """
+    item_filters = [(key, value) for key, value in filters.items() if key not in BUCKET_FILTERS]
+
+    items_by_category: Dict[str, List[Any]] = {}
+    for (environment, waterproof), bucket in self.buckets.items():
+      if "environment" in filters and environment != filters["environment"]:
+        continue
+      if "waterproof" in filters and waterproof != filters["waterproof"]:
+        continue
+      for category_name, items in bucket.items():
+        matching = [
+          item for item in items
+          if all(getattr(item, key) == value for key, value in item_filters)
+        ]
+        if matching:
+          items_by_category.setdefault(category_name, []).extend(matching)
+    return items_by_category
+
+  def remove(self, item_id: int) -> bool:
+    """
+    Remove an item.
+
+    :param item_id: The ID of the item.
+    :type item_id: int
+    :return: True if the item was in the wardrobe.
+    :rtype: bool
+    """
+    for bucket in self.buckets.values():
+      for category_name, items in bucket.items():
+        for i, item in enumerate(items):
+          if item.item_id == item_id:
+            del items[i]
+            if not items:
+              del bucket[category_name]
+            return True
+    return False
+
+
+async def read_wardrobe(db: Prisma, user_id: int) -> Optional[Wardrobe]:
+  """
+  Read a user's wardrobe from the database.
+
+  :param db: The Prisma database client.
+  :type db: Prisma
+  :param user_id: The ID of the user.
+  :type user_id: int
+  :return: The user's wardrobe, or None if the items couldn't be fetched.
+  :rtype: Wardrobe | None
+  """
+  try:
+    return Wardrobe(await get_wardrobe_items(db, user_id))
+  except Exception as e:
+    print(f"Error fetching items: {e}")
+    return None
+
+
+class WardrobeIndex:
+  """
+  Users' wardrobes kept in memory, in a bounded LRU with a TTL.
+
+  A wardrobe is read from the database on first use and served from memory
+  until an item of the user changes, the TTL runs out or the wardrobe is
+  evicted. Concurrent requests for a wardrobe that is loading share one
+  query, and a load overtaken by a change is not kept. Like `get_items`, a
+  failed query gives an empty wardrobe, which is not kept either.
+  """
+
+  def __init__(self, max_size: int = WARDROBE_INDEX_SIZE, ttl: Optional[float] = WARDROBE_INDEX_TTL):
+    """
+    :param max_size: The maximum number of wardrobes kept in memory; 0 disables the index.
+    :type max_size: int
+    :param ttl: Seconds a wardrobe is kept, or None to keep it until it changes or is evicted.
+    :type ttl: float | None
+    """
+    self.enabled = max_size > 0
+    self._wardrobes = LRUCache(max_size, ttl=ttl) if self.enabled else None
+    self._loading: Dict[int, asyncio.Task] = {}
+    self.invalidations = 0
+    self.load_errors = 0
+
+  async def get(self, db: Prisma, user_id: int) -> Wardrobe:
+    """
+    Return a user's wardrobe, reading it from the database if it isn't in memory.
+
+    :param db: The Prisma database client.
+    :type db: Prisma
+    :param user_id: The ID of the user.
+    :type user_id: int
+    :return: The user's wardrobe, or an empty one if the items couldn't be fetched.
+    :rtype: Wardrobe
+    """
+    if not self.enabled:
+      wardrobe = await read_wardrobe(db, user_id)
+      if wardrobe is None:
+        self.load_errors += 1
+        return Wardrobe([])
+      return wardrobe
+
+    wardrobe = self._wardrobes.get(user_id)
+    if wardrobe is not None:
+      return wardrobe
+
+    task = self._loading.get(user_id)
+    if task is None:
+      task = asyncio.ensure_future(self._load(db, user_id))
+      # Failures are raised to every waiting request; don't also report them as unretrieved
+      task.add_done_callback(lambda task: task.cancelled() or task.exception())
+      self._loading[user_id] = task
+
+    # Shield the shared query so one client disconnecting doesn't cancel it for the others
+    return await asyncio.shield(task)
+
+  async def _load(self, db: Prisma, user_id: int) -> Wardrobe:
+    task = asyncio.current_task()
+    wardrobe = await read_wardrobe(db, user_id)
+    if wardrobe is None:
+      self.load_errors += 1
+
+    # An item that changed while this load ran took it out of `_loading`;
+    # its result is still returned to the requests waiting on it, but not kept
+    if self._loading.get(user_id) is task:
+      del self._loading[user_id]
+      if wardrobe is not None:
+        self._wardrobes.set(user_id, wardrobe)
+    return wardrobe if wardrobe is not None else Wardrobe([])
+
+  def invalidate(self, user_id: int) -> bool:
+    """
+    Forget a user's wardrobe, so the next request reads it from the database again.
+
+    :param user_id: The ID of the user.
+    :type user_id: int
+    :return: True if the wardrobe was in memory.
+    :rtype: bool
+    """
+    if not self.enabled:
+      return False
+
+    self.invalidations += 1
+    self._loading.pop(user_id, None)
+    return self._wardrobes.delete(user_id)
+
+  def item_created(self, user_id: int) -> bool:
+    """
+    Report that an item was added to a user's wardrobe.
+
+    :param user_id: The ID of the item's owner.
+    :type user_id: int
+    :return: True if the wardrobe was in memory.
+    :rtype: bool
+    """
+    # The new item's tags are only known to the database, so read the wardrobe again
+    return self.invalidate(user_id)
+
+  def item_updated(self, user_id: int) -> bool:
+    """
+    Report that one of a user's items was changed.
+
+    :param user_id: The ID of the item's owner.
+    :type user_id: int
+    :return: True if the wardrobe was in memory.
+    :rtype: bool
+    """
+    return self.invalidate(user_id)
+
+  def item_deleted(self, user_id: int, item_id: Optional[int] = None) -> bool:
+    """
+    Report that one of a user's items was deleted.
+
+    The item is removed from the wardrobe in memory, which stays warm; without
+    an item ID the wardrobe is read from the database again.
+
+    :param user_id: The ID of the item's owner.
+    :type user_id: int
+    :param item_id: The ID of the deleted item.
+    :type item_id: int | None
+    :return: True if the wardrobe was in memory.
+    :rtype: bool
+    """
+    if not self.enabled or item_id is None:
+      return self.invalidate(user_id)
+
+    self.invalidations += 1
+    # A load already running may have read the item before it was deleted
+    self._loading.pop(user_id, None)
+    # Not a lookup for a request, so it leaves the hit rate and recency alone
+    wardrobe = self._wardrobes.peek(user_id)
+    if wardrobe is None:
+      return False
+    wardrobe.remove(item_id)
+    return True
+
+  def stats(self) -> Dict[str, Any]:
+    """
+    Return the index counters.
+
+    :return: Whether the index is enabled, the LRU counters and the number of invalidations and failed reads.
+    :rtype: dict[str, Any]
+    """
+    if not self.enabled:
+      return {"enabled": False, "load_errors": self.load_errors}
+    return {
+      "enabled": True,
+      **self._wardrobes.stats(),
+      "loading": len(self._loading),
+      "invalidations": self.invalidations,
+      "load_errors": self.load_errors,
+    }
+
+
+def get_wardrobe_index() -> WardrobeIndex:
+  """
+  Load and return the wardrobe index.
+
+  :return: The shared wardrobe index.
+  :rtype: WardrobeIndex
+  """
+  global _wardrobe_index
+  if _wardrobe_index is None:
+    _wardrobe_index = WardrobeIndex()
+  return _wardrobe_index
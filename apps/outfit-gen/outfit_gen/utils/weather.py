@@ -1,8 +1,11 @@
-import openmeteo_requests
-import requests_cache
-import pandas as pd
-from retry_requests import retry
 from typing import Tuple, Optional
+from shared_utils.lazy import lazy_import
+
+# Imported on first forecast rather than at startup: pandas and requests_cache alone take most of a second
+openmeteo_requests = lazy_import("openmeteo_requests")
+requests_cache = lazy_import("requests_cache")
+retry_requests = lazy_import("retry_requests")
+pd = lazy_import("pandas")
 
 
 async def forecast(latitude: float, longitude: float, temperature_threshold: float = 12) -> Tuple[bool, str]:
@@ -20,7 +23,7 @@ async def forecast(latitude: float, longitude: float, temperature_threshold: flo
   :rtype: dict[str, Any]
   """
   cache_session = requests_cache.CachedSession(".cache", expire_after=3600)
-  retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+  retry_session = retry_requests.retry(cache_session, retries=5, backoff_factor=0.2)
   openmeteo = openmeteo_requests.Client(session=retry_session)
 
   url = "https://api.open-meteo.com/v1/forecast"
@@ -0,0 +1,60 @@
+/**
+ * @jest-environment node
+ */
+import { PUT, PATCH, DELETE } from "@/app/api/item/[id]/route";
+import { prisma } from "@/lib/prisma";
+import { notifyWardrobeChange } from "@/lib/outfit-gen";
+
+jest.mock("@/lib/prisma", () => ({
+  prisma: {
+    item: {
+      update: jest.fn(),
+      delete: jest.fn(),
+    },
+  },
+}));
+
+jest.mock("@/lib/outfit-gen", () => ({
+  notifyWardrobeChange: jest.fn(),
+}));
+
+describe("/api/item/[id]", () => {
+  const params = { params: Promise.resolve({ id: "2" }) };
+
+  beforeEach(() => {
+    jest.clearAllMocks();
+    (prisma.item.update as jest.Mock).mockResolvedValue({ item_id: 2, user_id: 1 });
+    (prisma.item.delete as jest.Mock).mockResolvedValue({ item_id: 2, user_id: 1 });
+  });
+
+  it("should tell outfit-gen about a replaced item", async () => {
+    const request = new Request("http://localhost/api/item/2", {
+      method: "PUT",
+      body: JSON.stringify({ item_name: "Shirt" }),
+    });
+    const response = await PUT(request, params);
+
+    expect(response.status).toBe(200);
+    expect(notifyWardrobeChange).toHaveBeenCalledWith("updated", 1, 2);
+  });
+
+  it("should tell outfit-gen about a patched item", async () => {
+    const request = new Request("http://localhost/api/item/2", {
+      method: "PATCH",
+      body: JSON.stringify({ item_name: "Shirt" }),
+    });
+    const response = await PATCH(request, params);
+
+    expect(response.status).toBe(200);
+    expect(notifyWardrobeChange).toHaveBeenCalledWith("updated", 1, 2);
+  });
+
+  it("should tell outfit-gen about a deleted item", async () => {
+    const request = new Request("http://localhost/api/item/2", { method: "DELETE" });
+    const response = await DELETE(request, params);
+
+    expect(response.status).toBe(204);
+    expect(prisma.item.delete).toHaveBeenCalledWith({ where: { item_id: 2 } });
+    expect(notifyWardrobeChange).toHaveBeenCalledWith("deleted", 1, 2);
+  });
+});
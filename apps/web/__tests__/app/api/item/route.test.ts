@@ -0,0 +1,59 @@
+/**
+ * @jest-environment node
+ */
+import { POST } from "@/app/api/item/route";
+import { prisma } from "@/lib/prisma";
+import { notifyWardrobeChange } from "@/lib/outfit-gen";
+
+jest.mock("@/lib/prisma", () => ({
+  prisma: {
+    item: {
+      create: jest.fn(),
+    },
+  },
+}));
+
+jest.mock("@/lib/outfit-gen", () => ({
+  notifyWardrobeChange: jest.fn(),
+}));
+
+jest.mock("next-auth", () => ({
+  getServerSession: jest.fn(),
+}));
+
+jest.mock("@/lib/auth", () => ({
+  authOptions: {},
+}));
+
+describe("POST /api/item", () => {
+  beforeEach(() => {
+    jest.clearAllMocks();
+  });
+
+  it("should tell outfit-gen about the new item", async () => {
+    (prisma.item.create as jest.Mock).mockResolvedValue({ item_id: 2, user_id: 1 });
+
+    const request = new Request("http://localhost/api/item", {
+      method: "POST",
+      body: JSON.stringify({ item_name: "Shirt", user_id: 1 }),
+    });
+    const response = await POST(request);
+
+    expect(response.status).toBe(201);
+    expect(notifyWardrobeChange).toHaveBeenCalledWith("created", 1, 2);
+  });
+
+  it("should not notify outfit-gen if the item wasn't created", async () => {
+    (prisma.item.create as jest.Mock).mockRejectedValue(new Error("DB failure"));
+    jest.spyOn(console, "error").mockImplementation(() => {});
+
+    const request = new Request("http://localhost/api/item", {
+      method: "POST",
+      body: JSON.stringify({ item_name: "Shirt", user_id: 1 }),
+    });
+    const response = await POST(request);
+
+    expect(response.status).toBe(500);
+    expect(notifyWardrobeChange).not.toHaveBeenCalled();
+  });
+});
@@ -17,6 +17,7 @@ jest.mock("next-auth", () => ({
 
 jest.mock("@/lib/auth", () => ({
   authOptions: {},
+  getAccessToken: jest.fn().mockResolvedValue("test-token"),
 }));
 
 jest.mock("next/cache", () => ({
@@ -34,6 +35,7 @@ describe("deleteItem", () => {
 
   beforeEach(() => {
     jest.clearAllMocks();
+    global.fetch = jest.fn().mockResolvedValue({ ok: true });
   });
 
   it("should return an error if the user is not authenticated", async () => {
@@ -64,11 +66,28 @@ describe("deleteItem", () => {
     expect(revalidatePath).toHaveBeenCalledWith("/");
     expect(revalidatePath).toHaveBeenCalledWith("/wardrobe/clothes/item/1");
 
+    expect(global.fetch).toHaveBeenCalledWith(
+      "http://127.0.0.1:4000/wardrobe/events",
+      expect.objectContaining({
+        method: "POST",
+        body: JSON.stringify({ event: "deleted", user_id: 1, item_id: 1 }),
+      })
+    );
+
     expect(result).toEqual({
       success: true,
     });
   });
 
+  it("should not post a wardrobe event if the item wasn't deleted", async () => {
+    (getServerSession as jest.Mock).mockResolvedValue(mockSession);
+    (prisma.item.delete as jest.Mock).mockRejectedValue(new Error("DB failure"));
+
+    await deleteItem(1);
+
+    expect(global.fetch).not.toHaveBeenCalled();
+  });
+
   it("should handle errors when deleting the item", async () => {
     (getServerSession as jest.Mock).mockResolvedValue(mockSession);
     const error = new Error("DB failure");
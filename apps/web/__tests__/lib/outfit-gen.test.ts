@@ -0,0 +1,68 @@
+import { notifyWardrobeChange } from "@/lib/outfit-gen";
+import { getAccessToken } from "@/lib/auth";
+
+jest.mock("@/lib/auth", () => ({
+  getAccessToken: jest.fn(),
+}));
+
+describe("notifyWardrobeChange", () => {
+  beforeEach(() => {
+    jest.clearAllMocks();
+    (getAccessToken as jest.Mock).mockResolvedValue("test-token");
+    global.fetch = jest.fn().mockResolvedValue({ ok: true });
+    jest.spyOn(console, "error").mockImplementation(() => {});
+  });
+
+  afterEach(() => {
+    jest.restoreAllMocks();
+  });
+
+  it("should post the wardrobe event to outfit-gen", async () => {
+    await notifyWardrobeChange("updated", 1, 2);
+
+    expect(global.fetch).toHaveBeenCalledWith("http://127.0.0.1:4000/wardrobe/events", {
+      method: "POST",
+      headers: {
+        "Authorization": "Bearer test-token",
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({ event: "updated", user_id: 1, item_id: 2 }),
+    });
+    expect(console.error).not.toHaveBeenCalled();
+  });
+
+  it("should do nothing without a user", async () => {
+    await notifyWardrobeChange("created", null, 2);
+
+    expect(getAccessToken).not.toHaveBeenCalled();
+    expect(global.fetch).not.toHaveBeenCalled();
+  });
+
+  it("should only log when no token can be generated", async () => {
+    (getAccessToken as jest.Mock).mockResolvedValue(undefined);
+
+    await expect(notifyWardrobeChange("deleted", 1, 2)).resolves.toBeUndefined();
+
+    expect(global.fetch).not.toHaveBeenCalled();
+    expect(console.error).toHaveBeenCalled();
+  });
+
+  it("should only log when outfit-gen rejects the event", async () => {
+    (global.fetch as jest.Mock).mockResolvedValue({ ok: false, status: 503, statusText: "Service Unavailable" });
+
+    await expect(notifyWardrobeChange("deleted", 1, 2)).resolves.toBeUndefined();
+
+    expect(console.error).toHaveBeenCalledWith(
+      "Error notifying outfit-gen of an item change:",
+      new Error("503 Service Unavailable")
+    );
+  });
+
+  it("should only log when outfit-gen can't be reached", async () => {
+    (global.fetch as jest.Mock).mockRejectedValue(new Error("ECONNREFUSED"));
+
+    await expect(notifyWardrobeChange("created", 1, 2)).resolves.toBeUndefined();
+
+    expect(console.error).toHaveBeenCalled();
+  });
+});
@@ -1,4 +1,5 @@
 import { prisma } from "@/lib/prisma";
+import { notifyWardrobeChange } from "@/lib/outfit-gen";
 import { NextResponse } from "next/server";
 
 interface Params {
@@ -50,6 +51,7 @@ export async function PUT(request: Request, { params }: Params) {
       where: { item_id: parseInt(id) },
       data: body,
     });
+    await notifyWardrobeChange("updated", item.user_id, item.item_id);
 
 
     return NextResponse.json(item, { status: 200 });
@@ -76,6 +78,7 @@ export async function PATCH(request: Request, { params }: Params) {
       where: { item_id: parseInt(id) },
       data: body,
     });
+    await notifyWardrobeChange("updated", item.user_id, item.item_id);
 
 
     return NextResponse.json(item, { status: 200 });
@@ -95,9 +98,10 @@ export async function DELETE(request: Request, { params }: Params) {
 
 
   try {
-    await prisma.item.delete({
+    const item = await prisma.item.delete({
       where: { item_id: parseInt(id) },
     });
+    await notifyWardrobeChange("deleted", item.user_id, item.item_id);
 
 
     return new NextResponse(null, { status: 204 }); // No content
@@ -1,5 +1,6 @@
 import { authOptions } from "@/lib/auth";
 import { prisma } from "@/lib/prisma";
+import { notifyWardrobeChange } from "@/lib/outfit-gen";
 import { getServerSession } from "next-auth";
 import { NextRequest, NextResponse } from "next/server";
 
@@ -51,6 +52,7 @@ export async function POST(request: Request) {
         outfit_items: true,
       }
     });
+    await notifyWardrobeChange("created", item.user_id, item.item_id);
     return NextResponse.json(item, { status: 201 });
   } catch (error) {
     console.error("Error creating item:", error);
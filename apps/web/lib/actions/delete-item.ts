@@ -4,6 +4,7 @@ import { revalidatePath } from "next/cache"
 import { prisma } from "@/lib/prisma"
 import { getServerSession } from "next-auth"
 import { authOptions } from "@/lib/auth"
+import { notifyWardrobeChange } from "@/lib/outfit-gen"
 
 
 type DeleteItemResult = {
@@ -28,6 +29,7 @@ export async function deleteItem(itemId: number): Promise<DeleteItemResult> {
         item_id: itemId
       }
     });
+    await notifyWardrobeChange("deleted", session.user.id, itemId)
 
     revalidatePath("/")
     revalidatePath(`/wardrobe/clothes/item/${itemId}`)
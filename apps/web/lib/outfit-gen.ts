@@ -0,0 +1,45 @@
+import { getAccessToken } from "@/lib/auth";
+
+export type WardrobeEvent = "created" | "updated" | "deleted";
+
+/**
+ * Tell outfit-gen that one of a user's items changed, so outfits stop being
+ * generated from its copy of the old wardrobe. Failures are only logged:
+ * outfit-gen also reads wardrobes again after a few minutes.
+ */
+export async function notifyWardrobeChange(
+  event: WardrobeEvent,
+  userId: number | null | undefined,
+  itemId?: number
+): Promise<void> {
+  if (userId == null) {
+    return;
+  }
+
+  try {
+    const token = await getAccessToken();
+
+    if (!token) {
+      throw new Error("Couldn't generate JWT token");
+    }
+
+    const response = await fetch(`http://127.0.0.1:4000/wardrobe/events`, {
+      method: "POST",
+      headers: {
+        "Authorization": `Bearer ${token}`,
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        event,
+        user_id: userId,
+        item_id: itemId,
+      }),
+    });
+
+    if (!response.ok) {
+      throw new Error(`${response.status} ${response.statusText}`);
+    }
+  } catch (error) {
+    console.error("Error notifying outfit-gen of an item change:", error);
+  }
+}
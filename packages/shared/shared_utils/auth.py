@@ -1,44 +1,247 @@
 from fastapi import Depends, HTTPException, Request, FastAPI
 from fastapi.security import HTTPBearer
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import hashlib
+import time
+import re
 import jwt
-import http.client
+import httpx
 import json
-from shared_utils.env import get_env 
+from shared_utils.env import get_env
+from shared_utils.cache import LRUCache
 
 # Security scheme for extracting tokens
 security = HTTPBearer()
 
+# How long fetched signing keys are trusted when Auth0 sends no Cache-Control
+JWKS_DEFAULT_TTL = 600
+# Lower and upper bounds applied to any Cache-Control max-age
+JWKS_MIN_TTL = 60
+JWKS_MAX_TTL = 86400
+# Minimum gap between refetches triggered by an unknown `kid` or a failed refresh
+JWKS_MISS_REFRESH_INTERVAL = 30
+# How long past expiry keys may still be served while a refresh runs in the background
+JWKS_STALE_TTL = 86400
+
+# Timeout budget (seconds) for a single JWKS request
+JWKS_CONNECT_TIMEOUT = 2.0
+JWKS_READ_TIMEOUT = 3.0
+
+# Process-wide JWKS cache: parsed public keys by `kid`
+_jwks_keys: Dict[str, Any] = {}
+_jwks_expires_at = 0.0
+_jwks_stale_until = 0.0
+_jwks_fetched_at = 0.0
+_jwks_lock: Optional[asyncio.Lock] = None
+_jwks_refresh_task: Optional[asyncio.Task] = None
+
+# Pooled keep-alive client used for all requests to Auth0
+_http_client: Optional[httpx.AsyncClient] = None
+
+# Maximum number of verified tokens kept in memory
+TOKEN_CACHE_MAX_SIZE = 4096
+
+# Verified claims by token digest, each kept until the token's `exp`
+_token_cache = LRUCache(max_size=TOKEN_CACHE_MAX_SIZE)
+
+_MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+def get_http_client() -> httpx.AsyncClient:
+  """
+  Return the shared HTTP client for Auth0, creating it on first use.
+
+  :return: An async client with pooled keep-alive connections to the Auth0 domain.
+  :rtype: httpx.AsyncClient
+  """
+  global _http_client
+  if _http_client is None or _http_client.is_closed:
+    env = get_env()
+    _http_client = httpx.AsyncClient(
+      base_url=f"https://{env['AUTH0_DOMAIN']}",
+      timeout=httpx.Timeout(JWKS_READ_TIMEOUT, connect=JWKS_CONNECT_TIMEOUT),
+      limits=httpx.Limits(max_connections=10, max_keepalive_connections=2, keepalive_expiry=60),
+    )
+  return _http_client
+
+
+async def close_http_client():
+  """Close the shared HTTP client, e.g. when the app shuts down."""
+  global _http_client
+  if _http_client is not None:
+    await _http_client.aclose()
+    _http_client = None
+
+
+async def _request_jwks() -> Tuple[Dict[str, Any], Optional[str]]:
+  """Request the JWKS document, returning it with its Cache-Control header."""
+  response = await get_http_client().get("/.well-known/jwks.json")
+  if response.status_code != 200:
+    raise Exception("Failed to fetch JWKS")
+  return response.json(), response.headers.get("Cache-Control")
+
+
 async def fetch_auth0_jwks():
   """Fetch Auth0's JWKS (JSON Web Key Set)"""
-  env = get_env()
   try:
-    conn = http.client.HTTPSConnection(env["AUTH0_DOMAIN"])
-    conn.request("GET", "/.well-known/jwks.json")
-    response = conn.getresponse()
-    if response.status != 200:
-      raise Exception("Failed to fetch JWKS")
-    jwks = json.loads(response.read().decode())
+    jwks, _ = await _request_jwks()
     return jwks
   except Exception as e:
     raise HTTPException(status_code=500, detail=f"Error fetching JWKS: {str(e)}")
 
 
+def parse_max_age(cache_control: Optional[str]) -> int:
+  """
+  Work out how long a JWKS response may be cached.
+
+  :param cache_control: The Cache-Control header of the JWKS response, if any.
+  :type cache_control: str | None
+  :return: The TTL in seconds, clamped to the allowed range.
+  :rtype: int
+  """
+  if not cache_control:
+    return JWKS_DEFAULT_TTL
+
+  directives = cache_control.lower()
+  if "no-store" in directives or "no-cache" in directives:
+    return JWKS_MIN_TTL
+
+  match = _MAX_AGE_PATTERN.search(directives)
+  if not match:
+    return JWKS_DEFAULT_TTL
+
+  return max(JWKS_MIN_TTL, min(int(match.group(1)), JWKS_MAX_TTL))
+
+
+def parse_jwks(jwks: Dict[str, Any]) -> Dict[str, Any]:
+  """
+  Parse the RSA public keys of a JWKS document.
+
+  :param jwks: The JWKS document returned by Auth0.
+  :type jwks: dict
+  :return: A dictionary mapping each `kid` to its public key.
+  :rtype: dict[str, Any]
+  """
+  keys = {}
+  for key in jwks.get("keys", []):
+    kid = key.get("kid")
+    if not kid or key.get("kty") != "RSA":
+      continue
+    keys[kid] = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(key))
+  return keys
+
+
+def _get_jwks_lock() -> asyncio.Lock:
+  """Return the lock guarding JWKS refreshes, creating it on first use."""
+  global _jwks_lock
+  if _jwks_lock is None:
+    _jwks_lock = asyncio.Lock()
+  return _jwks_lock
+
+
+def _jwks_refresh_due(kid: str) -> bool:
+  """Check whether the cached keys are stale or missing `kid` and may be refetched."""
+  now = time.monotonic()
+  if now >= _jwks_expires_at:
+    return True
+  return kid not in _jwks_keys and now - _jwks_fetched_at >= JWKS_MISS_REFRESH_INTERVAL
+
+
+async def refresh_jwks():
+  """Fetch the JWKS and replace the cached signing keys."""
+  global _jwks_keys, _jwks_expires_at, _jwks_stale_until, _jwks_fetched_at
+  try:
+    jwks, cache_control = await _request_jwks()
+    keys = parse_jwks(jwks)
+  except Exception as e:
+    raise HTTPException(status_code=500, detail=f"Error fetching JWKS: {str(e)}")
+
+  now = time.monotonic()
+  _jwks_keys = keys
+  _jwks_fetched_at = now
+  _jwks_expires_at = now + parse_max_age(cache_control)
+  _jwks_stale_until = _jwks_expires_at + JWKS_STALE_TTL
+
+
+async def _revalidate_jwks():
+  """Refresh expired keys in the background, keeping the stale keys if Auth0 fails."""
+  global _jwks_expires_at
+  async with _get_jwks_lock():
+    if time.monotonic() < _jwks_expires_at:
+      return
+    try:
+      await refresh_jwks()
+    except HTTPException as e:
+      print(f"Warning: {e.detail}. Serving stale signing keys.")
+      # Back off before the next attempt
+      _jwks_expires_at = time.monotonic() + JWKS_MISS_REFRESH_INTERVAL
+
+
+def _schedule_jwks_revalidation():
+  """Start a background refresh unless one is already running."""
+  global _jwks_refresh_task
+  if _jwks_refresh_task is None or _jwks_refresh_task.done():
+    _jwks_refresh_task = asyncio.create_task(_revalidate_jwks())
+
+
+async def get_signing_key(kid: str):
+  """
+  Return the public key for `kid`, refetching the JWKS only when needed.
+
+  Expired keys are served stale while a single background task revalidates
+  them. The request waits on a fetch only when `kid` is unknown or the keys
+  are past their stale window. Concurrent callers wait on the same fetch.
+
+  :param kid: The key ID from the token header.
+  :type kid: str
+  :raise HTTPException: If the JWKS cannot be fetched and no usable key is cached.
+  :return: The matching public key, or None if Auth0 does not publish it.
+  :rtype: Any
+  """
+  now = time.monotonic()
+  if kid in _jwks_keys and now < _jwks_stale_until:
+    if now >= _jwks_expires_at:
+      _schedule_jwks_revalidation()
+    return _jwks_keys[kid]
+
+  if not _jwks_refresh_due(kid):
+    return _jwks_keys.get(kid)
+
+  async with _get_jwks_lock():
+    # Another request may have refreshed the keys while we waited
+    if _jwks_refresh_due(kid):
+      try:
+        await refresh_jwks()
+      except HTTPException:
+        if kid not in _jwks_keys:
+          raise
+        print(f"Warning: Could not refresh JWKS. Serving stale key {kid}.")
+
+  return _jwks_keys.get(kid)
+
+
+def clear_jwks_cache():
+  """Drop the cached signing keys so the next request refetches them."""
+  global _jwks_keys, _jwks_expires_at, _jwks_stale_until, _jwks_fetched_at, _jwks_lock, _jwks_refresh_task
+  _jwks_keys = {}
+  _jwks_expires_at = 0.0
+  _jwks_stale_until = 0.0
+  _jwks_fetched_at = 0.0
+  _jwks_lock = None
+  _jwks_refresh_task = None
+
+
 async def verify_auth0_token(id_token: str):
   """Verify Auth0 JWT token."""
   env = get_env()
   try:
-    jwks = await fetch_auth0_jwks()  # Get public keys from Auth0
-
     # Decode JWT header to get 'kid'
     unverified_header = jwt.get_unverified_header(id_token)
     kid = unverified_header.get("kid")
 
     # Find the corresponding public key
-    public_key = None
-    for key in jwks["keys"]:
-      if key["kid"] == kid:
-        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(key))
-        break
+    public_key = await get_signing_key(kid)
 
     if not public_key:
       raise HTTPException(status_code=401, detail="Public key not found")
@@ -60,8 +263,40 @@ async def verify_auth0_token(id_token: str):
   except Exception as e:
     raise HTTPException(status_code=401, detail=f"Token verification error: {str(e)}")
 
+def token_digest(id_token: str) -> str:
+  """Return the cache key for a bearer token, so raw tokens are never kept in memory."""
+  return hashlib.sha256(id_token.encode()).hexdigest()
+
+
+def get_token_cache_stats() -> Dict[str, Any]:
+  """
+  Return hit/miss metrics of the verified-token cache.
+
+  :return: The token cache counters.
+  :rtype: dict[str, Any]
+  """
+  return _token_cache.stats()
+
+
+def clear_token_cache():
+  """Forget every verified token."""
+  _token_cache.clear()
+
+
 async def auth0_auth_middleware(request: Request, token: str = Depends(security)):
-  """Middleware to validate Auth0 token."""
+  """Middleware to validate Auth0 token, reusing claims of recently verified tokens."""
   id_token = token.credentials
+  key = token_digest(id_token)
+
+  claims = _token_cache.get(key)
+  if claims is not None:
+    return dict(claims)
+
   claims = await verify_auth0_token(id_token)
-  return claims
\ No newline at end of file
+
+  # Tokens without an expiry are verified on every request
+  expires_at = claims.get("exp")
+  if isinstance(expires_at, (int, float)):
+    _token_cache.set(key, claims, expires_at=expires_at)
+
+  return dict(claims)
@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import threading
+import time
+
+
+class LRUCache:
+  """
+  Bounded, thread-safe LRU cache with optional per-entry expiry.
+
+  Entries expire either after the cache-wide `ttl` or at an explicit
+  `expires_at` timestamp given to `set`. Expired entries are dropped
+  lazily on lookup and in bulk whenever the cache is full.
+  """
+
+  def __init__(self, max_size: int = 1024, ttl: Optional[float] = None, clock: Callable[[], float] = time.time):
+    """
+    :param max_size: The maximum number of entries to keep.
+    :type max_size: int
+    :param ttl: Default lifetime of an entry in seconds, or None to keep entries until evicted.
+    :type ttl: float | None
+    :param clock: Function returning the current time, in the same unit as `expires_at`.
+    :type clock: Callable[[], float]
+    :raise ValueError: If `max_size` is not positive.
+    """
+    if max_size <= 0:
+      raise ValueError("max_size must be a positive integer.")
+
+    self.max_size = max_size
+    self.ttl = ttl
+    self._clock = clock
+    self._entries: "OrderedDict[Hashable, tuple[Any, Optional[float]]]" = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def __contains__(self, key: Hashable) -> bool:
+    with self._lock:
+      entry = self._entries.get(key)
+      return entry is not None and not self._expired(entry, self._clock())
+
+  @staticmethod
+  def _expired(entry: tuple, now: float) -> bool:
+    expires_at = entry[1]
+    return expires_at is not None and now >= expires_at
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    """
+    Return the value for `key` and mark it as recently used.
+
+    :param key: The cache key.
+    :type key: Hashable
+    :param default: Value returned when the key is missing or expired.
+    :type default: Any
+    :return: The cached value or `default`.
+    :rtype: Any
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        self.misses += 1
+        return default
+
+      if self._expired(entry, self._clock()):
+        del self._entries[key]
+        self.expirations += 1
+        self.misses += 1
+        return default
+
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry[0]
+
+  def peek(self, key: Hashable, default: Any = None) -> Any:
+    """
+    Return the value for `key` without marking it as recently used or counting a hit or miss.
+
+    :param key: The cache key.
+    :type key: Hashable
+    :param default: Value returned when the key is missing or expired.
+    :type default: Any
+    :return: The cached value or `default`.
+    :rtype: Any
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or self._expired(entry, self._clock()):
+        return default
+      return entry[0]
+
+  def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, expires_at: Optional[float] = None):
+    """
+    Store `value` under `key`, evicting old entries if the cache is full.
+
+    :param key: The cache key.
+    :type key: Hashable
+    :param value: The value to store.
+    :type value: Any
+    :param ttl: Lifetime of this entry in seconds, overriding the cache default.
+    :type ttl: float | None
+    :param expires_at: Absolute expiry time of this entry, overriding any TTL.
+    :type expires_at: float | None
+    :return: None
+    :rtype: None
+    """
+    with self._lock:
+      now = self._clock()
+      if expires_at is None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl is not None else None
+
+      if key in self._entries:
+        self._entries.move_to_end(key)
+      elif len(self._entries) >= self.max_size:
+        # Sweep out everything that has expired before evicting live entries
+        if self._evict_expired(now) == 0:
+          self._entries.popitem(last=False)
+          self.evictions += 1
+
+      self._entries[key] = (value, expires_at)
+
+  def delete(self, key: Hashable) -> bool:
+    """
+    Remove `key` from the cache.
+
+    :param key: The cache key.
+    :type key: Hashable
+    :return: True if the key was present.
+    :rtype: bool
+    """
+    with self._lock:
+      return self._entries.pop(key, None) is not None
+
+  def clear(self):
+    """Remove every entry and reset the counters."""
+    with self._lock:
+      self._entries.clear()
+      self.hits = self.misses = self.evictions = self.expirations = 0
+
+  def _evict_expired(self, now: float) -> int:
+    expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+    for key in expired:
+      del self._entries[key]
+    self.expirations += len(expired)
+    return len(expired)
+
+  def evict_expired(self) -> int:
+    """
+    Remove all expired entries in one pass.
+
+    :return: The number of entries removed.
+    :rtype: int
+    """
+    with self._lock:
+      return self._evict_expired(self._clock())
+
+  def stats(self) -> Dict[str, Any]:
+    """
+    Return the cache counters.
+
+    :return: Size, capacity, hits, misses, evictions, expirations and hit rate.
+    :rtype: dict[str, Any]
+    """
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "size": len(self._entries),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "expirations": self.expirations,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+      }
@@ -0,0 +1,140 @@
+from typing import Dict, List, Optional, Sequence
+import subprocess
+import statistics
+import argparse
+import sys
+
+
+def parse_importtime(output: str) -> List[Dict[str, object]]:
+  """
+  Parse the report `python -X importtime` writes to stderr.
+
+  :param output: The stderr of the profiled interpreter.
+  :type output: str
+  :return: One entry per imported module, in report order, with its name, nesting depth
+    and self and cumulative import time in microseconds.
+  :rtype: List[Dict[str, object]]
+  """
+  modules = []
+  for line in output.splitlines():
+    if not line.startswith("import time:"):
+      continue
+    try:
+      self_us, cumulative_us, name = line[len("import time:"):].split("|")
+      self_us, cumulative_us = int(self_us), int(cumulative_us)
+    except ValueError:
+      # The column header
+      continue
+    stripped = name.lstrip()
+    modules.append({
+      "name": stripped,
+      "depth": (len(name) - len(stripped) - 1) // 2,
+      "self_us": self_us,
+      "cumulative_us": cumulative_us,
+    })
+  return modules
+
+
+def profile_imports(module: str, runs: int = 5) -> Dict[str, object]:
+  """
+  Import a module in fresh interpreters and report where the time goes.
+
+  Each run is a new `python -X importtime` process, so nothing is cached in
+  memory between runs; times are the median over the runs.
+
+  :param module: The module to import, e.g. "clothing_processor.main".
+  :type module: str
+  :param runs: The number of interpreters to start.
+  :type runs: int
+  :raise ValueError: If the import fails.
+  :return: The total import time in milliseconds, the median cumulative time of every
+    imported module in milliseconds, and the set of imported modules.
+  :rtype: Dict[str, object]
+  """
+  timings: Dict[str, List[float]] = {}
+  for _ in range(runs):
+    result = subprocess.run(
+      [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+      capture_output=True,
+      text=True,
+    )
+    if result.returncode != 0:
+      raise ValueError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    for entry in parse_importtime(result.stderr):
+      timings.setdefault(entry["name"], []).append(entry["cumulative_us"] / 1000)
+
+  if module not in timings:
+    raise ValueError(f"No import time reported for {module}.")
+
+  medians = {name: statistics.median(times) for name, times in timings.items()}
+  return {
+    "total_ms": medians[module],
+    "modules": medians,
+    "imported": set(medians),
+  }
+
+
+def check_budget(profile: Dict[str, object], budget_ms: Optional[float], forbidden: Sequence[str] = ()) -> List[str]:
+  """
+  Compare an import profile with a time budget and the modules startup must not import.
+
+  :param profile: The result of `profile_imports`.
+  :type profile: Dict[str, object]
+  :param budget_ms: The longest acceptable import time in milliseconds, or None for no limit.
+  :type budget_ms: float | None
+  :param forbidden: Modules that should only be imported on first use.
+  :type forbidden: Sequence[str]
+  :return: A description of each violation; empty if the profile is within budget.
+  :rtype: List[str]
+  """
+  violations = []
+  if budget_ms is not None and profile["total_ms"] > budget_ms:
+    violations.append(f"Import took {profile['total_ms']:.0f} ms, over the {budget_ms:.0f} ms budget.")
+  for name in forbidden:
+    if name in profile["imported"]:
+      violations.append(f"{name} is imported at startup ({profile['modules'][name]:.0f} ms); it should load on first use.")
+  return violations
+
+
+def main(
+  argv: Optional[Sequence[str]] = None,
+  module: Optional[str] = None,
+  budget_ms: Optional[float] = None,
+  forbidden: Sequence[str] = (),
+):
+  """
+  Profile the import of a module and exit with status 1 if it is over budget.
+
+  Defaults given as arguments let each service wrap this in its own script.
+  """
+  parser = argparse.ArgumentParser(description="Measure the import time of a module with `python -X importtime` and check it against a budget.")
+  parser.add_argument("module", nargs="?" if module else None, default=module)
+  parser.add_argument("--budget-ms", type=float, default=budget_ms, help="Fail if the import takes longer than this.")
+  parser.add_argument("--forbid", nargs="*", default=list(forbidden), help="Fail if any of these modules is imported.")
+  parser.add_argument("--runs", type=int, default=5)
+  parser.add_argument("--top", type=int, default=15, help="Number of slowest top-level imports to list.")
+  args = parser.parse_args(argv)
+
+  profile = profile_imports(args.module, args.runs)
+  print(f"import {args.module}: {profile['total_ms']:.0f} ms (median of {args.runs} runs)\n")
+
+  # The slowest packages, counted once each rather than with every submodule
+  packages: Dict[str, float] = {}
+  for name, ms in profile["modules"].items():
+    root = name.split(".")[0]
+    if root != args.module.split(".")[0]:
+      packages[root] = max(packages.get(root, 0.0), ms)
+  for name, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+    print(f"  {ms:>8.1f} ms  {name}")
+
+  violations = check_budget(profile, args.budget_ms, args.forbid)
+  print()
+  for violation in violations:
+    print(f"FAIL: {violation}")
+  if violations:
+    sys.exit(1)
+  print("Within budget." if args.budget_ms is not None else "No budget set.")
+
+
+if __name__ == "__main__":
+  main()
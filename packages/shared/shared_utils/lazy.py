@@ -0,0 +1,74 @@
+from types import ModuleType
+from typing import Any, List
+import importlib
+import sys
+
+
+class LazyModule:
+  """
+  Stands in for a module and imports it on first attribute access.
+
+  Heavy dependencies bound at the top of a module with `lazy_import` cost
+  nothing until they are used, so services start (and answer health checks)
+  sooner. Setting or deleting attributes is forwarded to the real module, so
+  `unittest.mock.patch` targets like `pkg.module.np.zeros` keep working.
+  """
+
+  def __init__(self, name: str):
+    """
+    :param name: The absolute name of the module, e.g. "tensorflow" or "boto3.s3.transfer".
+    :type name: str
+    """
+    object.__setattr__(self, "_name", name)
+    object.__setattr__(self, "_module", None)
+
+  def _load(self) -> ModuleType:
+    module = self._module
+    if module is None:
+      # The import system locks the module while importing, so threads racing here import it once
+      module = importlib.import_module(self._name)
+      object.__setattr__(self, "_module", module)
+    return module
+
+  def __getattr__(self, attr: str) -> Any:
+    return getattr(self._load(), attr)
+
+  def __setattr__(self, attr: str, value: Any):
+    setattr(self._load(), attr, value)
+
+  def __delattr__(self, attr: str):
+    delattr(self._load(), attr)
+
+  def __dir__(self) -> List[str]:
+    return dir(self._load())
+
+  def __repr__(self) -> str:
+    state = "loaded" if self._module is not None else "not loaded"
+    return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+  """
+  Return a stand-in for a module that imports it on first use.
+
+  Only defer imports in modules whose annotations don't evaluate the module
+  (use `from __future__ import annotations`) and that don't use it at import time.
+
+  :param name: The absolute name of the module.
+  :type name: str
+  :return: The lazy module.
+  :rtype: LazyModule
+  """
+  return LazyModule(name)
+
+
+def is_loaded(name: str) -> bool:
+  """
+  Return whether a module has been imported in this process.
+
+  :param name: The absolute name of the module.
+  :type name: str
+  :return: True if the module is in `sys.modules`.
+  :rtype: bool
+  """
+  return name in sys.modules
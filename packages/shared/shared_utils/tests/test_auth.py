@@ -0,0 +1,230 @@
+import json
+import time
+import asyncio
+import pytest
+import jwt
+import httpx
+from unittest.mock import patch
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from shared_utils import auth
+from shared_utils.auth import (
+  parse_max_age,
+  parse_jwks,
+  get_signing_key,
+  clear_jwks_cache,
+  fetch_auth0_jwks,
+  verify_auth0_token,
+  auth0_auth_middleware,
+  clear_token_cache,
+  get_token_cache_stats,
+  JWKS_DEFAULT_TTL,
+  JWKS_MIN_TTL,
+  JWKS_MAX_TTL,
+)
+
+TEST_ENV = {"AUTH0_DOMAIN": "example.auth0.com", "AUTH0_AUDIENCE": "https://api.wfits.app"}
+
+# Generate a single RSA key pair for all tests
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def make_jwks(*kids):
+  jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+  return {"keys": [{**jwk, "kid": kid, "kty": "RSA", "use": "sig"} for kid in kids]}
+
+def make_token(kid="key-1", expires_in=3600):
+  claims = {
+    "sub": "auth0|user",
+    "aud": TEST_ENV["AUTH0_AUDIENCE"],
+    "iss": f"https://{TEST_ENV['AUTH0_DOMAIN']}/",
+    "exp": int(time.time()) + expires_in,
+  }
+  return jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": kid})
+
+@pytest.fixture(autouse=True)
+def reset_cache():
+  clear_jwks_cache()
+  clear_token_cache()
+  with patch("shared_utils.auth.get_env", return_value=TEST_ENV):
+    yield
+  clear_jwks_cache()
+  clear_token_cache()
+
+# parse_max_age() Tests
+def test_parse_max_age_default():
+  assert parse_max_age(None) == JWKS_DEFAULT_TTL
+  assert parse_max_age("public") == JWKS_DEFAULT_TTL
+
+def test_parse_max_age_clamped():
+  assert parse_max_age("public, max-age=3600") == 3600
+  assert parse_max_age("max-age=1") == JWKS_MIN_TTL
+  assert parse_max_age("max-age=99999999") == JWKS_MAX_TTL
+  assert parse_max_age("no-store") == JWKS_MIN_TTL
+
+# parse_jwks() Tests
+def test_parse_jwks_skips_non_rsa_keys():
+  jwks = make_jwks("key-1")
+  jwks["keys"].append({"kid": "ec-key", "kty": "EC"})
+  keys = parse_jwks(jwks)
+  assert list(keys) == ["key-1"]
+
+# get_signing_key() Tests
+@pytest.mark.asyncio
+async def test_get_signing_key_cached():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), "max-age=600")) as mock_request:
+    assert await get_signing_key("key-1") is not None
+    assert await get_signing_key("key-1") is not None
+    mock_request.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_get_signing_key_refetches_on_unknown_kid():
+  responses = [(make_jwks("key-1"), None), (make_jwks("key-1", "key-2"), None)]
+  with patch("shared_utils.auth._request_jwks", side_effect=responses) as mock_request:
+    await get_signing_key("key-1")
+    auth._jwks_fetched_at -= auth.JWKS_MISS_REFRESH_INTERVAL
+    assert await get_signing_key("key-2") is not None
+    assert mock_request.call_count == 2
+
+@pytest.mark.asyncio
+async def test_get_signing_key_unknown_kid_rate_limited():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)) as mock_request:
+    await get_signing_key("key-1")
+    assert await get_signing_key("missing") is None
+    assert await get_signing_key("missing") is None
+    mock_request.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_get_signing_key_refetches_after_stale_window():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)) as mock_request:
+    await get_signing_key("key-1")
+    auth._jwks_expires_at = 0.0
+    auth._jwks_stale_until = 0.0
+    await get_signing_key("key-1")
+    assert mock_request.call_count == 2
+
+@pytest.mark.asyncio
+async def test_get_signing_key_concurrent_misses_share_fetch():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)) as mock_request:
+    keys = await asyncio.gather(*(get_signing_key("key-1") for _ in range(10)))
+    assert all(key is not None for key in keys)
+    mock_request.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_get_signing_key_fetch_error():
+  with patch("shared_utils.auth._request_jwks", side_effect=Exception("Connection refused")):
+    with pytest.raises(HTTPException, match="Error fetching JWKS"):
+      await get_signing_key("key-1")
+
+@pytest.mark.asyncio
+async def test_get_signing_key_serves_stale_while_revalidating():
+  gate = asyncio.Event()
+  calls = []
+
+  async def slow_request():
+    calls.append(1)
+    if len(calls) > 1:
+      await gate.wait()
+    return make_jwks("key-1"), None
+
+  with patch("shared_utils.auth._request_jwks", side_effect=slow_request):
+    stale_key = await get_signing_key("key-1")
+    auth._jwks_expires_at = 0.0
+    # Expired key is returned at once while the refresh waits in the background
+    assert await get_signing_key("key-1") is stale_key
+    assert await get_signing_key("key-1") is stale_key
+    gate.set()
+    await auth._jwks_refresh_task
+    assert len(calls) == 2
+    assert auth._jwks_expires_at > time.monotonic()
+
+@pytest.mark.asyncio
+async def test_get_signing_key_keeps_stale_keys_on_refresh_error():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    stale_key = await get_signing_key("key-1")
+  auth._jwks_expires_at = 0.0
+  with patch("shared_utils.auth._request_jwks", side_effect=Exception("Timed out")):
+    assert await get_signing_key("key-1") is stale_key
+    await auth._jwks_refresh_task
+    assert await get_signing_key("key-1") is stale_key
+
+# fetch_auth0_jwks() Tests
+@pytest.mark.asyncio
+async def test_fetch_auth0_jwks_uses_shared_client():
+  requests = []
+
+  def handler(request):
+    requests.append(request)
+    return httpx.Response(200, json=make_jwks("key-1"), headers={"Cache-Control": "max-age=600"})
+
+  client = httpx.AsyncClient(base_url="https://example.auth0.com", transport=httpx.MockTransport(handler))
+  with patch("shared_utils.auth._http_client", client):
+    jwks = await fetch_auth0_jwks()
+    await fetch_auth0_jwks()
+  await client.aclose()
+  assert jwks["keys"][0]["kid"] == "key-1"
+  assert [str(request.url) for request in requests] == ["https://example.auth0.com/.well-known/jwks.json"] * 2
+
+@pytest.mark.asyncio
+async def test_fetch_auth0_jwks_bad_status():
+  client = httpx.AsyncClient(base_url="https://example.auth0.com", transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+  with patch("shared_utils.auth._http_client", client):
+    with pytest.raises(HTTPException, match="Error fetching JWKS"):
+      await fetch_auth0_jwks()
+  await client.aclose()
+
+# verify_auth0_token() Tests
+@pytest.mark.asyncio
+async def test_verify_auth0_token_valid():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    claims = await verify_auth0_token(make_token())
+    assert claims["sub"] == "auth0|user"
+
+@pytest.mark.asyncio
+async def test_verify_auth0_token_expired():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    with pytest.raises(HTTPException, match="Token expired"):
+      await verify_auth0_token(make_token(expires_in=-60))
+
+@pytest.mark.asyncio
+async def test_verify_auth0_token_unknown_key():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    with pytest.raises(HTTPException, match="Public key not found"):
+      await verify_auth0_token(make_token(kid="other-key"))
+
+# auth0_auth_middleware() Tests
+def bearer(token):
+  return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+@pytest.mark.asyncio
+async def test_auth0_auth_middleware_caches_verified_token():
+  token = make_token()
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    with patch("shared_utils.auth.jwt.decode", wraps=jwt.decode) as mock_decode:
+      first = await auth0_auth_middleware(None, bearer(token))
+      second = await auth0_auth_middleware(None, bearer(token))
+      mock_decode.assert_called_once()
+  assert first == second
+  stats = get_token_cache_stats()
+  assert stats["hits"] == 1
+  assert stats["misses"] == 1
+
+@pytest.mark.asyncio
+async def test_auth0_auth_middleware_expired_cache_entry():
+  token = make_token(expires_in=60)
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    await auth0_auth_middleware(None, bearer(token))
+    # Once past `exp` the cached claims are dropped and the token is verified again
+    with patch.object(auth._token_cache, "_clock", return_value=time.time() + 120):
+      with patch("shared_utils.auth.verify_auth0_token", side_effect=HTTPException(status_code=401, detail="Token expired")):
+        with pytest.raises(HTTPException, match="Token expired"):
+          await auth0_auth_middleware(None, bearer(token))
+  assert get_token_cache_stats()["hits"] == 0
+
+@pytest.mark.asyncio
+async def test_auth0_auth_middleware_rejects_invalid_token():
+  with patch("shared_utils.auth._request_jwks", return_value=(make_jwks("key-1"), None)):
+    with pytest.raises(HTTPException):
+      await auth0_auth_middleware(None, bearer("not-a-token"))
+  assert get_token_cache_stats()["size"] == 0
@@ -0,0 +1,99 @@
+import pytest
+
+from shared_utils.cache import LRUCache
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+def test_lru_cache_get_and_set():
+  cache = LRUCache(max_size=2)
+  cache.set("a", 1)
+  assert cache.get("a") == 1
+  assert cache.get("missing", "default") == "default"
+  assert cache.stats()["hits"] == 1
+  assert cache.stats()["misses"] == 1
+
+def test_lru_cache_evicts_least_recently_used():
+  cache = LRUCache(max_size=2)
+  cache.set("a", 1)
+  cache.set("b", 2)
+  cache.get("a")
+  cache.set("c", 3)
+  assert "a" in cache
+  assert "b" not in cache
+  assert cache.stats()["evictions"] == 1
+
+def test_lru_cache_peek():
+  clock = FakeClock()
+  cache = LRUCache(max_size=2, ttl=10, clock=clock)
+  cache.set("a", 1)
+  cache.set("b", 2)
+  assert cache.peek("a") == 1
+  assert cache.peek("missing", "default") == "default"
+  # Peeking neither counts nor refreshes "a", so it is still evicted first
+  cache.set("c", 3)
+  assert "a" not in cache
+  clock.now += 11
+  assert cache.peek("b") is None
+  stats = cache.stats()
+  assert (stats["hits"], stats["misses"], stats["expirations"]) == (0, 0, 0)
+
+def test_lru_cache_ttl_expiry():
+  clock = FakeClock()
+  cache = LRUCache(max_size=2, ttl=10, clock=clock)
+  cache.set("a", 1)
+  clock.now += 11
+  assert cache.get("a") is None
+  assert len(cache) == 0
+  assert cache.stats()["expirations"] == 1
+
+def test_lru_cache_explicit_expiry():
+  clock = FakeClock()
+  cache = LRUCache(max_size=2, clock=clock)
+  cache.set("a", 1, expires_at=clock.now + 5)
+  cache.set("b", 2)
+  clock.now += 5
+  assert cache.get("a") is None
+  assert cache.get("b") == 2
+
+def test_lru_cache_full_sweeps_expired_in_bulk():
+  clock = FakeClock()
+  cache = LRUCache(max_size=3, clock=clock)
+  cache.set("a", 1, ttl=1)
+  cache.set("b", 2, ttl=1)
+  cache.set("c", 3)
+  clock.now += 2
+  cache.set("d", 4)
+  assert len(cache) == 2
+  assert cache.get("c") == 3
+  stats = cache.stats()
+  assert stats["expirations"] == 2
+  assert stats["evictions"] == 0
+
+def test_lru_cache_evict_expired():
+  clock = FakeClock()
+  cache = LRUCache(max_size=5, ttl=1, clock=clock)
+  for key in "abc":
+    cache.set(key, key)
+  clock.now += 1
+  assert cache.evict_expired() == 3
+  assert len(cache) == 0
+
+def test_lru_cache_delete_and_clear():
+  cache = LRUCache(max_size=2)
+  cache.set("a", 1)
+  assert cache.delete("a") is True
+  assert cache.delete("a") is False
+  cache.set("b", 2)
+  cache.get("b")
+  cache.clear()
+  assert len(cache) == 0
+  assert cache.stats()["hits"] == 0
+
+def test_lru_cache_invalid_size():
+  with pytest.raises(ValueError, match="max_size must be a positive integer."):
+    LRUCache(max_size=0)
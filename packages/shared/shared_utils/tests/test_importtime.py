@@ -0,0 +1,43 @@
+import pytest
+
+from shared_utils.importtime import parse_importtime, profile_imports, check_budget, main
+
+REPORT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _json
+import time:      1500 |       1620 |   json.decoder
+import time:       300 |       2100 | json
+"""
+
+def test_parse_importtime():
+  modules = parse_importtime(REPORT)
+  assert [m["name"] for m in modules] == ["_json", "json.decoder", "json"]
+  assert [m["depth"] for m in modules] == [2, 1, 0]
+  assert modules[2] == {"name": "json", "depth": 0, "self_us": 300, "cumulative_us": 2100}
+
+def test_profile_imports():
+  profile = profile_imports("json", runs=1)
+  assert profile["total_ms"] > 0
+  assert "json.decoder" in profile["imported"]
+
+def test_profile_imports_failure():
+  with pytest.raises(ValueError, match="Importing shared_utils_missing_module failed"):
+    profile_imports("shared_utils_missing_module", runs=1)
+
+def test_check_budget():
+  profile = {"total_ms": 120.0, "modules": {"json": 120.0, "pandas": 80.0}, "imported": {"json", "pandas"}}
+  assert check_budget(profile, 200) == []
+  assert check_budget(profile, None) == []
+  violations = check_budget(profile, 100, forbidden=["pandas", "tensorflow"])
+  assert len(violations) == 2
+  assert "over the 100 ms budget" in violations[0]
+  assert violations[1].startswith("pandas is imported at startup")
+
+def test_main_over_budget(capsys):
+  with pytest.raises(SystemExit) as exit_info:
+    main(["json", "--runs", "1", "--budget-ms", "0"])
+  assert exit_info.value.code == 1
+  assert "FAIL: Import took" in capsys.readouterr().out
+
+def test_main_within_budget(capsys):
+  main(["--runs", "1", "--forbid", "tensorflow"], module="json", budget_ms=10_000)
+  assert "Within budget." in capsys.readouterr().out
@@ -0,0 +1,46 @@
+import sys
+import pytest
+from unittest.mock import patch
+
+from shared_utils.lazy import lazy_import, is_loaded, LazyModule
+
+@pytest.fixture
+def unloaded_module():
+  # A small stdlib module few tests import, removed so the stand-in has to load it
+  name = "colorsys"
+  module = sys.modules.pop(name, None)
+  yield name
+  if module is not None:
+    sys.modules[name] = module
+
+def test_lazy_import_defers_until_first_use(unloaded_module):
+  colorsys = lazy_import(unloaded_module)
+  assert isinstance(colorsys, LazyModule)
+  assert not is_loaded(unloaded_module)
+  assert "not loaded" in repr(colorsys)
+
+  assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+  assert is_loaded(unloaded_module)
+  assert "(loaded)" in repr(colorsys)
+  assert "rgb_to_hsv" in dir(colorsys)
+
+def test_lazy_import_submodule():
+  path = lazy_import("os.path")
+  assert path.join("a", "b") == "a/b"
+
+def test_lazy_import_missing_module():
+  missing = lazy_import("shared_utils_missing_module")
+  with pytest.raises(ModuleNotFoundError):
+    missing.anything
+
+def test_lazy_import_forwards_patches():
+  json = lazy_import("json")
+  with patch.object(json, "dumps", return_value="patched"):
+    assert json.dumps({}) == "patched"
+    assert sys.modules["json"].dumps({}) == "patched"
+  assert json.dumps({}) == "{}"
+
+  # Patching through a module attribute path works the same way
+  with patch("json.loads", return_value="patched"):
+    assert json.loads("{}") == "patched"
+  assert json.loads("{}") == {}